@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+""" Compare the antlr_to_tuple decoder with the original implementation.
+
+The FASM file is encoded once by the native parser, then the encoded
+data is decoded by both decoders, keeping the best of several runs.
+
+Usage:
+    python3 benchmarks/decode.py [--copies N] [--runs N] [file.fasm]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pyximport
+
+from fasm.parser import antlr_to_tuple
+from fasm.parser.antlr import parse_fasm, RESULT_CALLBACK, ERROR_CALLBACK
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+pyximport.install(language_level=3)
+import legacy_antlr_to_tuple  # noqa: E402
+
+
+def encode(source):
+    """ Run the native parser, returning its encoded output. """
+    result = [None]
+    error = [None]
+
+    @RESULT_CALLBACK
+    def callback(s, n):
+        result[0] = s[:n]
+
+    @ERROR_CALLBACK
+    def error_callback(line, position, message):
+        error[0] = Exception(
+            'Parse error at {}:{} - {}'.format(
+                line, position, message.decode('ascii')))
+
+    parse_fasm.from_string(source, 0, callback, error_callback)
+
+    if error[0] is not None:
+        raise error[0]
+
+    return result[0]
+
+
+def best_time(decode, data, runs):
+    """ Returns the fastest of several runs of decode(data). """
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        lines = decode(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'file',
+        nargs='?',
+        default=os.path.join(
+            os.path.dirname(__file__), '..', 'examples', 'many.fasm'))
+    parser.add_argument(
+        '--copies',
+        type=int,
+        default=1000,
+        help='Number of copies of the file to decode at once.')
+    parser.add_argument(
+        '--runs', type=int, default=5, help='Number of runs to time.')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        source = f.read()
+    if not source.endswith(b'\n'):
+        source += b'\n'
+    data = encode(source * args.copies)
+
+    legacy_time, legacy_lines = best_time(
+        legacy_antlr_to_tuple.parse_fasm_data, data, args.runs)
+    typed_time, typed_lines = best_time(
+        antlr_to_tuple.parse_fasm_data, data, args.runs)
+    assert typed_lines == legacy_lines
+
+    count = len(typed_lines)
+    print('{} lines, {} bytes encoded'.format(count, len(data)))
+    for name, elapsed in (('legacy', legacy_time), ('typed', typed_time)):
+        print(
+            '{:>8}: {:.3f} s, {:.0f} ns/line'.format(
+                name, elapsed, elapsed / max(count, 1) * 1e9))
+    print('speedup: {:.1f}x'.format(legacy_time / typed_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,10 @@
 
 from __future__ import print_function
 
+import heapq
+import io
 import os.path
+import tempfile
 
 from fasm.model import ValueFormat, SetFasmFeature, Annotation, FasmLine
 from fasm.parser import parse_fasm_filename, parse_fasm_string
@@ -92,72 +95,84 @@ def set_feature_to_str(set_feature, check_if_canonical=False):
     return '{}{}{}'.format(feature, address, feature_value)
 
 
-def canonical_features(set_feature):
-    """ Yield SetFasmFeature tuples that are of canonical form.
+def canonical_addresses(set_feature):
+    """ Yield the address of each bit set by a SetFasmFeature tuple.
 
-    EG width 1, and value 1.
+    The address is None for a feature without an address, or for address
+    0, as the canonical form omits it. Only the set bits of the value are
+    visited, so wide values that are mostly zeros are cheap.
     """
-    if set_feature.value == 0:
+    value = set_feature.value
+    if value == 0:
         return
 
-    if set_feature.start is None:
-        assert set_feature.value == 1
+    start = set_feature.start
+    if start is None:
+        assert value == 1
         assert set_feature.end is None
+        yield None
+        return
+
+    if set_feature.end is None:
+        assert value == 1
+        yield start if start != 0 else None
+        return
+
+    assert start >= 0
+    assert set_feature.end >= start
+
+    if value == 1:
+        yield start if start != 0 else None
+        return
+
+    # Bits above the address range are ignored.
+    width = set_feature.end - start + 1
+    if value >> width:
+        value &= (1 << width) - 1
+
+    # Find set bits from the least significant in the binary digits.
+    bits = format(value, 'b')[::-1]
+    bit = bits.find('1')
+    while bit != -1:
+        address = start + bit
+        yield address if address != 0 else None
+        bit = bits.find('1', bit + 1)
+
+
+def canonical_features(set_feature):
+    """ Yield SetFasmFeature tuples that are of canonical form.
+
+    EG width 1, and value 1.
+    """
+    for address in canonical_addresses(set_feature):
         yield SetFasmFeature(
             feature=set_feature.feature,
-            start=None,
+            start=address,
             end=None,
             value=1,
             value_format=None,
         )
 
-        return
 
-    if set_feature.start is not None and set_feature.end is None:
-        assert set_feature.value == 1
-
-        if set_feature.start == 0:
-            yield SetFasmFeature(
-                feature=set_feature.feature,
-                start=None,
-                end=None,
-                value=1,
-                value_format=None,
-            )
-        else:
-            yield SetFasmFeature(
-                feature=set_feature.feature,
-                start=set_feature.start,
-                end=None,
-                value=1,
-                value_format=None,
-            )
+def canonical_feature_bits(model):
+    """ Yield (feature, address) of each bit set by the model given.
 
-        return
+    This is the same as canonical_features of each line, without creating
+    a SetFasmFeature tuple for each bit. See canonical_addresses for the
+    meaning of address.
 
-    assert set_feature.start is not None
-    assert set_feature.start >= 0
-    assert set_feature.end >= set_feature.start
-
-    for address in range(set_feature.start, set_feature.end + 1):
-        value = (set_feature.value >> (address - set_feature.start)) & 1
-        if value:
-            if address == 0:
-                yield SetFasmFeature(
-                    feature=set_feature.feature,
-                    start=None,
-                    end=None,
-                    value=1,
-                    value_format=None,
-                )
-            else:
-                yield SetFasmFeature(
-                    feature=set_feature.feature,
-                    start=address,
-                    end=None,
-                    value=1,
-                    value_format=None,
-                )
+    Args:
+        model: Iterable of fasm.model.FasmLine.
+
+    Yields:
+        Tuples of feature name and address.
+    """
+    for fasm_line in model:
+        set_feature = fasm_line.set_feature
+        if set_feature is not None:
+            feature = set_feature.feature
+            for address in canonical_addresses(set_feature):
+                yield feature, address
 
 
 def fasm_line_to_string(fasm_line, canonical=False):
@@ -191,19 +206,136 @@ def fasm_line_to_string(fasm_line, canonical=False):
     yield ' '.join(parts)
 
 
+WRITE_BATCH = 4096
+""" Number of lines joined into each write by write_fasm. """
+
+CANONICAL_RUN_LINES = 1 << 20
+""" Number of distinct canonical lines sorted in memory at a time. """
+
+
+def spill_lines(lines, directory=None):
+    """ Writes lines to a new temporary file, returning it open for
+    reading from the start.
+    """
+    f = tempfile.TemporaryFile('w+', newline='\n', dir=directory)
+    for i in range(0, len(lines), WRITE_BATCH):
+        batch = lines[i:i + WRITE_BATCH]
+        batch.append('')
+        f.write('\n'.join(batch))
+    f.seek(0)
+    return f
+
+
+def read_spilled_lines(f):
+    """ Yields the lines of a file from spill_lines. """
+    for line in f:
+        yield line[:-1]
+
+
+def sorted_canonical_lines(
+        model, run_lines=CANONICAL_RUN_LINES, directory=None):
+    """ Yields the canonical lines of the model given, sorted and without
+    duplicates.
+
+    At most run_lines distinct lines are held in memory. Beyond that, the
+    lines are sorted in runs of run_lines, which are spilled to temporary
+    files in directory and merged as the lines are yielded. The result is
+    the same as sorting the set of all the lines.
+
+    Args:
+        model: Iterable of fasm.model.FasmLine.
+        run_lines: Maximum number of lines sorted in memory.
+        directory: Directory for temporary files, or None for the default.
+
+    Yields:
+        str, one canonical line at a time, without a newline.
+    """
+    runs = []
+    lines = set()
+    try:
+        for feature, address in canonical_feature_bits(model):
+            if address is None:
+                lines.add(feature)
+            else:
+                lines.add('{}[{}]'.format(feature, address))
+            if len(lines) >= run_lines:
+                runs.append(spill_lines(sorted(lines), directory))
+                lines.clear()
+
+        if not runs:
+            yield from sorted(lines)
+            return
+
+        if lines:
+            runs.append(spill_lines(sorted(lines), directory))
+            lines.clear()
+
+        previous = None
+        for line in heapq.merge(*[read_spilled_lines(run) for run in runs]):
+            if line != previous:
+                yield line
+                previous = line
+    finally:
+        for run in runs:
+            run.close()
+
+
+def write_fasm(
+        model,
+        fileobj,
+        canonical=False,
+        run_lines=CANONICAL_RUN_LINES,
+        directory=None):
+    """ Writes the FASM file for the model given to fileobj.
+
+    Lines are written as they are generated, a batch of lines per write,
+    so the output is never held in memory at once. In canonical mode,
+    the lines must be sorted and deduplicated, which is done by
+    sorted_canonical_lines with at most run_lines lines in memory.
+
+    Args:
+        model: Iterable of fasm.model.FasmLine.
+        fileobj: A file object opened for writing text.
+        canonical: If true, write the canonical form of the model.
+        run_lines: See sorted_canonical_lines.
+        directory: See sorted_canonical_lines.
+
+    Returns:
+        The number of lines written.
+    """
+    if canonical:
+        lines = sorted_canonical_lines(model, run_lines, directory)
+    else:
+        lines = (
+            line for fasm_line in model
+            for line in fasm_line_to_string(fasm_line))
+
+    write = fileobj.write
+    count = 0
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == WRITE_BATCH:
+            count += len(batch)
+            batch.append('')
+            write('\n'.join(batch))
+            batch.clear()
+
+    if batch:
+        count += len(batch)
+        batch.append('')
+        write('\n'.join(batch))
+    return count
+
+
 def fasm_tuple_to_string(model, canonical=False):
     """ Returns string of FASM file for the model given.
 
     Note that calling parse_fasm_filename and then calling fasm_tuple_to_string
     will result in all optional whitespace replaced with one space.
-    """
 
-    lines = []
-    for fasm_line in model:
-        for line in fasm_line_to_string(fasm_line, canonical=canonical):
-            lines.append(line)
-
-    if canonical:
-        lines = list(sorted(set(lines)))
-
-    return '\n'.join(lines) + '\n'
+    See write_fasm to write the FASM file without building the string.
+    """
+    output = io.StringIO()
+    write_fasm(model, output, canonical=canonical)
+    return output.getvalue() or '\n'
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+""" asyncio API for parsing and writing FASM files.
+
+Parsing and writing run on a thread pool, so they do not block the event
+loop. The antlr parser releases the GIL while it parses, so other
+coroutines keep running while files are parsed.
+
+By default, work runs on a shared pool of DEFAULT_WORKERS threads, which
+bounds how many files are parsed at once. Each function also takes an
+executor, e.g. a concurrent.futures.ThreadPoolExecutor, to run on
+instead.
+
+Cancelling a coroutine drops its result. Work that has not started yet
+is skipped, work that has started runs to completion in the background.
+"""
+
+import asyncio
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
+import os
+import threading
+
+from fasm import write_fasm
+from fasm.compression import open_fasm_file
+from fasm.parser import parse_fasm_filename, iter_parse_fasm_filename
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+""" Number of threads of the default executor. """
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def default_executor():
+    """ Returns the shared executor, creating it on first use. """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(DEFAULT_WORKERS)
+        return _executor
+
+
+def submit(executor, function, *args, **kwargs):
+    """ Returns a concurrent.futures.Future of function(*args, **kwargs)
+    running on executor, or on the default executor if it is None.
+    """
+    if executor is None:
+        executor = default_executor()
+    return executor.submit(functools.partial(function, *args, **kwargs))
+
+
+def run(executor, function, *args, **kwargs):
+    """ Returns an asyncio future of function(*args, **kwargs) running on
+    executor, or on the default executor if it is None.
+    """
+    return asyncio.wrap_future(submit(executor, function, *args, **kwargs))
+
+
+def parse_list(filename, kwargs):
+    """ Returns parse_fasm_filename(filename, **kwargs) as a sequence,
+    so that the lines are all parsed on the executor.
+    """
+    lines = parse_fasm_filename(filename, **kwargs)
+    if not isinstance(lines, Sequence):
+        lines = list(lines)
+    return lines
+
+
+async def aparse_fasm_filename(filename, executor=None, **kwargs):
+    """ Parse FASM file, returning list of FasmLine named tuples.
+
+    Args:
+        filename: The file containing FASM source to parse.
+        executor: Executor to parse on, or None for the default.
+        kwargs: Passed to fasm.parser.parse_fasm_filename.
+
+    Returns:
+        A list of fasm.model.FasmLine, or a LazyFasmLines if lazy is
+        true.
+    """
+    return await run(executor, parse_list, filename, kwargs)
+
+
+def iter_lines(filename, kwargs):
+    """ Yields the lines of iter_parse_fasm_filename(filename, **kwargs).
+
+    iter_parse_fasm_filename is only called for the first line, so that
+    creating the generator on the event loop doesn't parse anything,
+    even with the textx parser, which parses the whole file at once.
+    """
+    yield from iter_parse_fasm_filename(filename, **kwargs)
+
+
+class AsyncFasmLines(object):
+    """ Async iterator of the FasmLine named tuples of a FASM file.
+
+    >>> async for line in AsyncFasmLines('design.fasm'):  # doctest: +SKIP
+    ...     print(line)
+
+    The file is parsed with fasm.parser.iter_parse_fasm_filename, up to
+    chunk_size lines at a time, as the lines are consumed. It can be
+    used as an async context manager, which closes the file early if
+    not all lines are consumed.
+
+    Args:
+        filename: The file containing FASM source to parse.
+        executor: Executor to parse on, or None for the default.
+        chunk_size: Number of lines parsed per call to the executor.
+        kwargs: Passed to fasm.parser.iter_parse_fasm_filename.
+    """
+
+    def __init__(self, filename, executor=None, chunk_size=4096, **kwargs):
+        self.lines = iter_lines(filename, kwargs)
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.chunk = deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.chunk:
+            if self.lines is None:
+                raise StopAsyncIteration
+            self.chunk.extend(await self.next_chunk())
+            if not self.chunk:
+                await self.aclose()
+
+        return self.chunk.popleft()
+
+    async def next_chunk(self):
+        lines = self.lines
+        future = submit(
+            self.executor, list, itertools.islice(lines, self.chunk_size))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # The parser can't be closed while it is running, so close it
+            # once the chunk is parsed, or now if it was not started.
+            self.lines = None
+            future.add_done_callback(lambda _: lines.close())
+            raise
+
+    async def aclose(self):
+        """ Stop parsing the file. """
+        if self.lines is not None:
+            self.lines.close()
+            self.lines = None
+        self.chunk.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+def write_fasm_filename(filename, lines, canonical):
+    """ Writes lines to filename, compressed according to its extension. """
+    with open_fasm_file(filename, 'wt') as f:
+        write_fasm(lines, f, canonical=canonical)
+
+
+async def awrite_fasm_filename(
+        filename, lines, canonical=False, executor=None):
+    """ Write FasmLine named tuples to a FASM file.
+
+    Args:
+        filename: The file to write, which is compressed according to
+            its extension, see fasm.compression.
+        lines: Iterable of fasm.model.FasmLine. It is consumed on the
+            executor, so it should not be changed until this returns.
+        canonical: If true, write the canonical form of the lines.
+        executor: Executor to write on, or None for the default.
+    """
+    await run(executor, write_fasm_filename, filename, lines, canonical)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+""" Columnar form of parsed FASM, using NumPy arrays.
+
+A FasmColumns holds the same lines as a list of FasmLine, with one row
+per line, in a few arrays instead of a named tuple per line. This takes
+much less memory, and rows can be filtered with vectorized operations.
+
+NumPy is an optional dependency of fasm, only needed by this module.
+"""
+
+import numpy
+
+from fasm import fasm_tuple_to_string
+from fasm.model import SetFasmFeature, FasmLine, ValueFormat
+
+NONE = -1
+""" Value of feature_id, start, end or value_format standing for None. """
+
+
+class FasmColumns(object):
+    """ Struct of arrays form of a list of FasmLine.
+
+    Row i of each array describes line i. Annotations and comments are
+    rare, so they are kept in dicts by row instead of arrays.
+
+    Attributes:
+        features: List of feature names, indexed by feature_id.
+        feature_id: int32 array of the index in features of the feature
+            set by each line, or NONE if the line doesn't set a feature.
+        start: int64 array of the start of the address, or NONE.
+        end: int64 array of the end of the address, or NONE.
+        value: uint64 array of the value. Values wider than 64 bits are
+            0 here, and stored in wide_values instead.
+        value_format: int8 array of the ValueFormat value, or NONE.
+        wide_values: Dict of values wider than 64 bits, by row.
+        annotations: Dict of lists of fasm.model.Annotation, by row.
+        comments: Dict of comments, by row.
+    """
+
+    def __init__(
+            self,
+            features,
+            feature_id,
+            start,
+            end,
+            value,
+            value_format,
+            wide_values=None,
+            annotations=None,
+            comments=None):
+        self.features = features
+        self.feature_id = feature_id
+        self.start = start
+        self.end = end
+        self.value = value
+        self.value_format = value_format
+        self.wide_values = wide_values or {}
+        self.annotations = annotations or {}
+        self.comments = comments or {}
+
+    @classmethod
+    def from_lines(cls, lines):
+        """ Build columns from an iterable of fasm.model.FasmLine. """
+        features = []
+        feature_ids = {}
+        feature_id = []
+        start = []
+        end = []
+        value = []
+        value_format = []
+        wide_values = {}
+        annotations = {}
+        comments = {}
+
+        for row, line in enumerate(lines):
+            set_feature = line.set_feature
+            if set_feature is None:
+                feature_id.append(NONE)
+                start.append(NONE)
+                end.append(NONE)
+                value.append(0)
+                value_format.append(NONE)
+            else:
+                index = feature_ids.get(set_feature.feature)
+                if index is None:
+                    index = len(features)
+                    feature_ids[set_feature.feature] = index
+                    features.append(set_feature.feature)
+                feature_id.append(index)
+                start.append(
+                    NONE if set_feature.start is None else set_feature.start)
+                end.append(
+                    NONE if set_feature.end is None else set_feature.end)
+                if set_feature.value < 2**64:
+                    value.append(set_feature.value)
+                else:
+                    value.append(0)
+                    wide_values[row] = set_feature.value
+                value_format.append(
+                    NONE if set_feature.value_format is None else set_feature.
+                    value_format.value)
+
+            if line.annotations is not None:
+                annotations[row] = line.annotations
+            if line.comment is not None:
+                comments[row] = line.comment
+
+        return cls(
+            features=features,
+            feature_id=numpy.array(feature_id, dtype=numpy.int32),
+            start=numpy.array(start, dtype=numpy.int64),
+            end=numpy.array(end, dtype=numpy.int64),
+            value=numpy.array(value, dtype=numpy.uint64),
+            value_format=numpy.array(value_format, dtype=numpy.int8),
+            wide_values=wide_values,
+            annotations=annotations,
+            comments=comments)
+
+    def __len__(self):
+        return len(self.feature_id)
+
+    def __iter__(self):
+        """ Yields the rows as fasm.model.FasmLine. """
+        # Converting whole columns to lists is much faster than reading
+        # NumPy scalars one at a time.
+        rows = zip(
+            self.feature_id.tolist(), self.start.tolist(), self.end.tolist(),
+            self.value.tolist(), self.value_format.tolist())
+        for row, (feature_id, start, end, value,
+                  value_format) in enumerate(rows):
+            yield self._line(row, feature_id, start, end, value, value_format)
+
+    def line(self, row):
+        """ Returns row as a fasm.model.FasmLine. """
+        if row < 0:
+            row += len(self)
+        return self._line(
+            row, int(self.feature_id[row]), int(self.start[row]),
+            int(self.end[row]), int(self.value[row]),
+            int(self.value_format[row]))
+
+    def _line(self, row, feature_id, start, end, value, value_format):
+        set_feature = None
+        if feature_id != NONE:
+            set_feature = SetFasmFeature(
+                feature=self.features[feature_id],
+                start=None if start == NONE else start,
+                end=None if end == NONE else end,
+                value=self.wide_values.get(row, value),
+                value_format=None
+                if value_format == NONE else ValueFormat(value_format))
+
+        return FasmLine(
+            set_feature=set_feature,
+            annotations=self.annotations.get(row),
+            comment=self.comments.get(row))
+
+    def to_lines(self):
+        """ Returns a list of fasm.model.FasmLine. """
+        return list(self)
+
+    def to_string(self, canonical=False):
+        """ Returns the lines as FASM text.
+
+        See fasm.fasm_tuple_to_string for the meaning of canonical.
+        """
+        return fasm_tuple_to_string(self, canonical=canonical)
+
+    def feature_mask(self, predicate):
+        """ Returns a boolean array of the rows setting a feature for which
+        predicate(feature) is true.
+
+        The predicate is called once per distinct feature, not per row.
+        """
+        matches = numpy.array(
+            [bool(predicate(feature)) for feature in self.features] + [False],
+            dtype=bool)
+        # NONE indexes the final False.
+        return matches[self.feature_id]
+
+    def prefix_mask(self, prefix):
+        """ Returns a boolean array of the rows setting a feature that
+        starts with prefix, e.g. the name of a tile.
+        """
+        return self.feature_mask(lambda feature: feature.startswith(prefix))
+
+    def select(self, rows):
+        """ Returns the given rows as a new FasmColumns.
+
+        Args:
+            rows: A boolean mask, like those from feature_mask, or an
+                array of row indices.
+
+        Returns:
+            A FasmColumns sharing the features of this one.
+        """
+        rows = numpy.asarray(rows)
+        if rows.dtype == bool:
+            rows = numpy.flatnonzero(rows)
+
+        def select_dict(by_row):
+            if not by_row:
+                return {}
+            selected = numpy.flatnonzero(numpy.isin(rows, list(by_row)))
+            return {
+                position: by_row[row]
+                for position, row in zip(
+                    selected.tolist(), rows[selected].tolist())
+            }
+
+        return FasmColumns(
+            features=self.features,
+            feature_id=self.feature_id[rows],
+            start=self.start[rows],
+            end=self.end[rows],
+            value=self.value[rows],
+            value_format=self.value_format[rows],
+            wide_values=select_dict(self.wide_values),
+            annotations=select_dict(self.annotations),
+            comments=select_dict(self.comments))
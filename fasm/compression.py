@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+""" Transparent compression of FASM files.
+
+Compressed input is recognized by its magic bytes, whatever the name of
+the file, and output is compressed according to the extension of the
+file name. gzip, xz and bz2 are supported by the standard library, zstd
+requires the zstandard package.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os.path
+
+MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'(\xb5/\xfd', 'zstd'),
+] + [
+    # BZh alone could start a feature name, so the block size and the
+    # magic of the first block, or of the end of an empty stream, follow.
+    (b'BZh' + str(level).encode() + block, 'bz2')
+    for level in range(1, 10)
+    for block in (b'1AY&SY', b'\x17rE8P\x90')
+]
+""" Magic bytes at the start of each kind of compressed file. """
+
+MAGIC_SIZE = max(len(magic) for magic, _ in MAGIC)
+
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.xz': 'xz',
+    '.bz2': 'bz2',
+    '.zst': 'zstd',
+}
+""" Compression used when writing files with each extension. """
+
+
+def compression_of_magic(data):
+    """ Returns the compression of a file starting with data, or None. """
+    for magic, compression in MAGIC:
+        if data.startswith(magic):
+            return compression
+    return None
+
+
+def compression_of_extension(filename):
+    """ Returns the compression implied by the extension of filename,
+    or None.
+    """
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def detect_compression(filename):
+    """ Returns the compression of the file filename, or None.
+
+    Only the magic bytes are used. Every compressed file starts with
+    them, so the extension could only change the result for a file whose
+    name doesn't match its contents, which would then fail to open.
+    """
+    with open(filename, 'rb') as f:
+        return compression_of_magic(f.read(MAGIC_SIZE))
+
+
+def open_compressed(fileobj, compression, mode='rb'):
+    """ Returns a file object reading or writing compression compressed
+    data from or to fileobj, a filename or a binary file object.
+    """
+    if compression == 'gzip':
+        return gzip.open(fileobj, mode)
+    elif compression == 'xz':
+        return lzma.open(fileobj, mode)
+    elif compression == 'bz2':
+        return bz2.open(fileobj, mode)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                'The zstandard package is required for zstd compressed '
+                'FASM files.')
+        return zstandard.open(fileobj, mode)
+    else:
+        raise ValueError('Unknown compression {}'.format(compression))
+
+
+def open_fasm_file(filename, mode='rb'):
+    """ Open a FASM file, compressed or not.
+
+    When reading, the compression is detected from the contents of the
+    file. When writing, it is chosen by the extension of filename.
+
+    Args:
+        filename: The file to open.
+        mode: Mode as for open, e.g. 'rb', 'rt' or 'wt'.
+
+    Returns:
+        A file object.
+    """
+    if 'r' in mode:
+        compression = detect_compression(filename)
+    else:
+        compression = compression_of_extension(filename)
+
+    if compression is None:
+        return open(filename, mode)
+    return open_compressed(filename, compression, mode)
+
+
+class PrefixedReader(io.RawIOBase):
+    """ Raw binary stream reading prefix, then the rest of fileobj.
+
+    Used to put back the bytes read from a stream that can't peek.
+    """
+
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.prefix:
+            n = min(len(b), len(self.prefix))
+            b[:n] = self.prefix[:n]
+            self.prefix = self.prefix[n:]
+            return n
+
+        data = self.fileobj.read(len(b))
+        if data is None:
+            return None
+        b[:len(data)] = data
+        return len(data)
+
+
+def read_magic(fileobj):
+    """ Returns the first MAGIC_SIZE bytes of the binary file object
+    fileobj, or all of them if it is shorter, consuming them.
+    """
+    head = b''
+    while len(head) < MAGIC_SIZE:
+        data = fileobj.read(MAGIC_SIZE - len(head))
+        if not data:
+            break
+        head += data
+    return head
+
+
+def decompressed(fileobj):
+    """ Returns a file object reading the decompressed contents of the
+    binary file object fileobj if it is compressed, otherwise fileobj
+    or a file object reading the same contents.
+
+    The magic bytes are found with fileobj.peek if it returns enough of
+    them. Otherwise, e.g. for pipes whose buffer holds fewer bytes or
+    streams without peek, they are read until there are enough or the
+    stream ends, and put back in front of the rest of the stream. Text
+    streams are returned as is, as they can't be compressed.
+    """
+    if isinstance(fileobj, io.TextIOBase):
+        return fileobj
+
+    peek = getattr(fileobj, 'peek', None)
+    head = peek(MAGIC_SIZE)[:MAGIC_SIZE] if peek is not None else b''
+    if len(head) < MAGIC_SIZE:
+        head = read_magic(fileobj)
+        fileobj = io.BufferedReader(PrefixedReader(head, fileobj))
+
+    compression = compression_of_magic(head)
+    if compression is None:
+        return fileobj
+    return open_compressed(fileobj, compression)
@@ -20,11 +20,19 @@
 
 merge_features - Combines multiple FASM SetFasmFeature into one.
 merge_and_sort - Groups and sorts FASM lines, useful for non-canonical output.
+merge_and_sort_sharded - merge_and_sort in memory bounded by the largest tile.
 
 """
+from concurrent.futures import ProcessPoolExecutor
 import enum
+import io
+import pickle
+import tempfile
 from fasm import SetFasmFeature, FasmLine, ValueFormat
 
+MERGE_RUN_LINES = 1 << 20
+""" Number of lines held in memory by ShardedGroups before spilling. """
+
 
 def is_only_comment(line):
     """ Returns True if line is only a comment. """
@@ -41,6 +49,81 @@ def is_blank_line(line):
     return not line.set_feature and not line.annotations and not line.comment
 
 
+def find_eligable_feature(group):
+    """ Returns the feature of group if it can be merged with other
+    addresses of the same feature, otherwise None.
+    """
+    if len(group) > 1:
+        return None
+
+    if group[0].annotations:
+        return None
+
+    if group[0].comment:
+        return None
+
+    return group[0].set_feature
+
+
+def get_group_id(group):
+    """ Returns the first feature part of the first feature in group, or
+    None if group has no feature.
+    """
+    for line in group:
+        if line.set_feature:
+            return line.set_feature.feature.split('.')[0]
+
+    return None
+
+
+def feature_group_key(group):
+    """ Returns the first feature of group, which groups are sorted by. """
+    for line in group:
+        if line.set_feature:
+            assert line.set_feature.feature is not None
+            return line.set_feature.feature
+
+    assert False
+
+
+def bits_mask(bits):
+    """ Returns a mask with the bits at the given indices set. """
+    if not bits:
+        return 0
+
+    mask = bytearray((max(bits) >> 3) + 1)
+    for bit in bits:
+        mask[bit >> 3] |= 1 << (bit & 7)
+    return int.from_bytes(mask, 'little')
+
+
+def combine_masks(masks):
+    """ Returns the bitwise OR of masks, a list of (start, mask) tuples
+    where mask is shifted left by start.
+
+    Masks are sorted by start and ORed in pairs, so each shift is only as
+    wide as the masks it joins. Combining many narrow masks at high
+    addresses then costs about the total width of the masks, instead of
+    their number times the highest address.
+    """
+    masks = sorted(masks, key=lambda mask: mask[0])
+    if not masks:
+        return 0
+
+    while len(masks) > 1:
+        pairs = zip(masks[0::2], masks[1::2])
+        combined = [
+            (start, mask | (next_mask << (next_start - start)))
+            for (start, mask), (next_start, next_mask) in pairs
+        ]
+        if len(masks) % 2:
+            combined.append(masks[-1])
+        masks = combined
+
+    start, mask = masks[0]
+    return mask << start
+
+
 def merge_features(features):
     """ Combines features with varying addresses but same feature.
 
@@ -62,8 +145,12 @@ def merge_features(features):
     # Ensure all features are for the same feature
     assert len(set(feature.feature for feature in features)) == 1
 
-    set_bits = set()
-    cleared_bits = set()
+    # Single bits, the usual case, are collected by index, wider fields
+    # as masks.
+    set_bits = []
+    cleared_bits = []
+    set_masks = []
+    clear_masks = []
 
     for feature in features:
         start = 0
@@ -82,26 +169,30 @@ def merge_features(features):
         if feature.value is not None:
             value = feature.value
 
-        for bit in range(start, end + 1):
-            bit_is_set = ((value >> (bit - start)) & 1) != 0
-            if bit_is_set:
-                assert bit not in cleared_bits
-                set_bits.add(bit)
+        if start == end:
+            if value & 1:
+                set_bits.append(start)
             else:
-                assert bit not in set_bits
-                cleared_bits.add(bit)
+                cleared_bits.append(start)
+        elif start < end:
+            field = (1 << (end - start + 1)) - 1
+            set_masks.append((start, value & field))
+            clear_masks.append((start, ~value & field))
+
+    set_mask = bits_mask(set_bits) | combine_masks(set_masks)
+    clear_mask = bits_mask(cleared_bits) | combine_masks(clear_masks)
 
-    max_bit = max(set_bits | cleared_bits)
+    # A bit can't be both set and cleared.
+    assert not set_mask & clear_mask
 
-    final_value = 0
-    for bit in set_bits:
-        final_value |= (1 << bit)
+    max_bit = (set_mask | clear_mask).bit_length() - 1
+    assert max_bit >= 0
 
     return SetFasmFeature(
         feature=features[0].feature,
         start=0,
         end=max_bit,
-        value=final_value,
+        value=set_mask,
         value_format=ValueFormat.VERILOG_BINARY)
 
 
@@ -120,6 +211,10 @@ class MergeModel(object):
     If a feature has a comment in its group, it is not eligable for address
     merging.
 
+    If workers is not None, merge_addresses merges and sorts the features
+    of each first feature part on a pool of that many processes, see
+    merge_groups_parallel. The output is the same.
+
     """
 
     class State(enum.Enum):
@@ -128,10 +223,11 @@ class MergeModel(object):
         InCommentGroup = 2
         InAnnotationGroup = 3
 
-    def __init__(self):
+    def __init__(self, workers=None):
         self.state = MergeModel.State.NoGroup
         self.groups = []
         self.current_group = None
+        self.workers = workers
 
     def start_comment_group(self, line):
         """ Start a new group of comments.
@@ -221,21 +317,9 @@ class MergeModel(object):
 
         Call after all lines have been added to the model.
         """
-        for group in self.groups:
-            for line in group:
-                assert not is_blank_line(line)
-
-        def find_eligable_feature(group):
-            if len(group) > 1:
-                return None
-
-            if group[0].annotations:
-                return None
-
-            if group[0].comment:
-                return None
-
-            return group[0].set_feature
+        if self.workers is not None:
+            self.groups = merge_groups_parallel(self.groups, self.workers)
+            return
 
         eligable_address_features = {}
 
@@ -243,6 +327,9 @@ class MergeModel(object):
         non_eligable_features = set()
 
         for group in self.groups:
+            for line in group:
+                assert not is_blank_line(line)
+
             feature = find_eligable_feature(group)
 
             if feature is None:
@@ -259,33 +346,18 @@ class MergeModel(object):
         self.groups = non_eligable_groups
 
         for feature_group in eligable_address_features.values():
-            if feature_group[0].feature in non_eligable_features:
-                for feature in feature_group:
-                    self.groups.append(
-                        [
-                            FasmLine(
-                                set_feature=feature,
-                                annotations=None,
-                                comment=None)
-                        ])
-            else:
-                if len(feature_group) > 1:
-                    self.groups.append(
-                        [
-                            FasmLine(
-                                set_feature=merge_features(feature_group),
-                                annotations=None,
-                                comment=None)
-                        ])
-                else:
-                    for feature in feature_group:
-                        self.groups.append(
-                            [
-                                FasmLine(
-                                    set_feature=feature,
-                                    annotations=None,
-                                    comment=None)
-                            ])
+            if len(feature_group) > 1 and \
+                    feature_group[0].feature not in non_eligable_features:
+                feature_group = [merge_features(feature_group)]
+
+            for feature in feature_group:
+                self.groups.append(
+                    [
+                        FasmLine(
+                            set_feature=feature,
+                            annotations=None,
+                            comment=None)
+                    ])
 
     def output_sorted_lines(self, zero_function=None, sort_key=None):
         """ Yields sorted FasmLine's.
@@ -302,30 +374,17 @@ class MergeModel(object):
         non_feature_groups = []
 
         for group in self.groups:
-            is_feature_group = False
-            for line in group:
-                if line.set_feature:
-                    group_id = line.set_feature.feature.split('.')[0]
-
-                    if group_id not in feature_groups:
-                        feature_groups[group_id] = []
-
-                    feature_groups[group_id].append(group)
-                    is_feature_group = True
-                    break
+            group_id = get_group_id(group)
 
-            if not is_feature_group:
+            if group_id is None:
                 non_feature_groups.append(group)
+            else:
+                if group_id not in feature_groups:
+                    feature_groups[group_id] = []
 
-        output_groups = []
+                feature_groups[group_id].append(group)
 
-        def feature_group_key(group):
-            for line in group:
-                if line.set_feature:
-                    assert line.set_feature.feature is not None
-                    return line.set_feature.feature
-
-            assert False
+        output_groups = []
 
         if sort_key is None:
             group_ids = sorted(feature_groups.keys())
@@ -357,7 +416,102 @@ class MergeModel(object):
                     set_feature=None, annotations=None, comment=None)
 
 
-def merge_and_sort(model, zero_function=None, sort_key=None):
+def pack_group(group_id, group):
+    """ Returns group in a compact form for sending to another process.
+
+    Groups of a single line setting a feature, the bulk of most models,
+    become a tuple of the fields of the feature, without the group_id
+    prefix of its name. Other groups are returned as is.
+    """
+    if len(group) == 1:
+        line = group[0]
+        if line.set_feature and line.annotations is None and \
+                line.comment is None:
+            feature = line.set_feature
+            return (
+                feature.feature[len(group_id):], feature.start, feature.end,
+                feature.value, feature.value_format)
+
+    return group
+
+
+def unpack_group(group_id, packed):
+    """ Returns the group packed by pack_group. """
+    if isinstance(packed, list):
+        return packed
+
+    feature, start, end, value, value_format = packed
+    return [
+        FasmLine(
+            set_feature=SetFasmFeature(
+                group_id + feature, start, end, value, value_format),
+            annotations=None,
+            comment=None)
+    ]
+
+
+def merge_tile(payload):
+    """ Merges and sorts the packed groups of one first feature part.
+
+    Runs in a worker process of merge_groups_parallel.
+    """
+    group_id, packed_groups = payload
+
+    merged_model = MergeModel()
+    merged_model.groups = [
+        unpack_group(group_id, packed) for packed in packed_groups
+    ]
+    merged_model.merge_addresses()
+
+    groups = sorted(merged_model.groups, key=feature_group_key)
+    return [pack_group(group_id, group) for group in groups]
+
+
+def merge_groups_parallel(groups, workers):
+    """ Merges address features of groups on a process pool.
+
+    The groups of each first feature part are merged independently, so
+    each part is sent in the form of pack_group to a worker, which merges
+    and sorts its groups. The groups are returned by part, in the order
+    MergeModel.output_sorted_lines would find them after a serial
+    MergeModel.merge_addresses, followed by the groups without features.
+    As the groups of each part are already sorted, the output is the
+    same.
+
+    Args:
+        groups: List of groups of a MergeModel.
+        workers: Number of processes to merge with.
+
+    Returns:
+        The list of merged groups.
+    """
+    shards = ShardedGroups(run_lines=None)
+    for group in groups:
+        for line in group:
+            assert not is_blank_line(line)
+
+        shards.append(group)
+
+    group_ids = shards.group_ids()
+    payloads = []
+    for group_id in group_ids:
+        groups = shards.get(group_id)
+        payloads.append(
+            (group_id, [pack_group(group_id, group) for group in groups]))
+
+    merged_groups = []
+    with ProcessPoolExecutor(workers) as executor:
+        chunksize = max(1, len(payloads) // (workers * 4))
+        results = executor.map(merge_tile, payloads, chunksize=chunksize)
+        for group_id, packed_groups in zip(group_ids, results):
+            merged_groups.extend(
+                unpack_group(group_id, packed) for packed in packed_groups)
+
+    merged_groups.extend(shards.get(None))
+    return merged_groups
+
+
+def merge_and_sort(model, zero_function=None, sort_key=None, workers=None):
     """ Given a model, groups and sorts entries.
 
     zero_function - Function that takes a feature string, and returns true
@@ -375,6 +529,11 @@ def merge_and_sort(model, zero_function=None, sort_key=None):
 
         with if the key function returns (A, 2, 1) for A_X2Y1.
 
+    workers -       Number of processes to merge and sort the features of
+                    each first feature part on, or None to do it in this
+                    process.  zero_function and sort_key run in this
+                    process.
+
     Yields FasmLine's.
 
     Grouping logic:
@@ -389,7 +548,7 @@ def merge_and_sort(model, zero_function=None, sort_key=None):
     Sorting logic:
      - Features will appear before raw annotations.
     """
-    merged_model = MergeModel()
+    merged_model = MergeModel(workers=workers)
 
     for line in model:
         merged_model.add_to_model(line)
@@ -402,3 +561,152 @@ def merge_and_sort(model, zero_function=None, sort_key=None):
     merged_model.merge_addresses()
     return merged_model.output_sorted_lines(
         zero_function=zero_function, sort_key=sort_key)
+
+
+class ShardedGroups(object):
+    """ Groups of lines partitioned by group id into shards.
+
+    Groups are added with append, like a list, so a MergeModel whose
+    groups are a ShardedGroups partitions its groups as lines are added.
+    Once run_lines lines are held in memory, all shards are appended to a
+    temporary file in directory, and read back one shard at a time.
+
+    Args:
+        run_lines: Maximum number of lines held in memory, or None to
+            keep all shards in memory.
+        directory: Directory for the temporary file, or None for the
+            default.
+    """
+
+    def __init__(self, run_lines=MERGE_RUN_LINES, directory=None):
+        self.run_lines = run_lines
+        self.directory = directory
+        self.shards = {}
+        self.spilled = {}
+        self.lines = 0
+        self.file = None
+
+        # The first position of each group id after merge_addresses, which
+        # moves the groups that can't be merged before the others.
+        self.first_groups = {}
+        self.count = 0
+
+    def append(self, group):
+        group_id = get_group_id(group)
+
+        if group_id is not None:
+            # Only a group that can't be merged moves a group id forward.
+            first = self.first_groups.get(group_id)
+            if first is None or \
+                    (first[0] and find_eligable_feature(group) is None):
+                eligable = find_eligable_feature(group) is not None
+                self.first_groups[group_id] = (eligable, self.count)
+        self.count += 1
+
+        if group_id not in self.shards:
+            self.shards[group_id] = []
+        self.shards[group_id].append(group)
+
+        self.lines += len(group)
+        if self.run_lines is not None and self.lines >= self.run_lines:
+            self.spill()
+
+    def spill(self):
+        """ Append the shards in memory to the temporary file. """
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(dir=self.directory)
+
+        self.file.seek(0, io.SEEK_END)
+        for group_id, groups in self.shards.items():
+            if group_id not in self.spilled:
+                self.spilled[group_id] = []
+            self.spilled[group_id].append(self.file.tell())
+            pickle.dump(groups, self.file, pickle.HIGHEST_PROTOCOL)
+
+        self.shards.clear()
+        self.lines = 0
+
+    def group_ids(self):
+        """ Returns the group ids of the shards, excluding None, in the
+        order MergeModel.output_sorted_lines finds them.
+        """
+        return sorted(self.first_groups, key=self.first_groups.get)
+
+    def get(self, group_id):
+        """ Returns the list of groups with group_id, in order. """
+        groups = []
+        for offset in self.spilled.get(group_id, []):
+            self.file.seek(offset)
+            groups.extend(pickle.load(self.file))
+        groups.extend(self.shards.get(group_id, []))
+        return groups
+
+    def close(self):
+        """ Remove the temporary file. """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def merge_and_sort_sharded(
+        model,
+        zero_function=None,
+        sort_key=None,
+        run_lines=MERGE_RUN_LINES,
+        directory=None):
+    """ Given a model, groups and sorts entries, like merge_and_sort.
+
+    The output is the same as merge_and_sort, but the groups are
+    partitioned by first feature part as lines are added, see
+    ShardedGroups, and each part is merged and sorted on its own. Memory
+    grows with the largest part instead of the whole model.
+
+    Args:
+        model: Iterable of fasm.model.FasmLine.
+        zero_function: See merge_and_sort.
+        sort_key: See merge_and_sort.
+        run_lines: Maximum number of lines held in memory while lines are
+            added, or None to keep all of them in memory.
+        directory: Directory for temporary files, or None for the default.
+
+    Yields FasmLine's.
+    """
+    shards = ShardedGroups(run_lines, directory)
+    try:
+        merged_model = MergeModel()
+        merged_model.groups = shards
+
+        for line in model:
+            merged_model.add_to_model(line)
+
+        # Add the last processed annotation or comment blocks to the model
+        if merged_model.state != MergeModel.State.NoGroup:
+            if merged_model.current_group is not None:
+                merged_model.groups.append(merged_model.current_group)
+
+        if sort_key is None:
+            group_ids = sorted(shards.group_ids())
+        else:
+            group_ids = sorted(shards.group_ids(), key=sort_key)
+
+        # Groups without features are output last.
+        group_ids.append(None)
+
+        separate = False
+        for group_id in group_ids:
+            shard_model = MergeModel()
+            shard_model.groups = shards.get(group_id)
+            shard_model.merge_addresses()
+
+            lines = shard_model.output_sorted_lines(
+                zero_function=zero_function, sort_key=sort_key)
+            for idx, line in enumerate(lines):
+                # Blank lines separate the output of each shard.
+                if idx == 0 and separate:
+                    yield FasmLine(
+                        set_feature=None, annotations=None, comment=None)
+
+                yield line
+                separate = True
+    finally:
+        shards.close()
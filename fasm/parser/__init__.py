@@ -24,7 +24,9 @@ available = []
 
 try:
     from fasm.parser.antlr import \
-        parse_fasm_filename, parse_fasm_string, implementation
+        parse_fasm_filename, parse_fasm_string, iter_parse_fasm_filename, \
+        parse_fasm_filename_columns, parse_fasm_file, iter_parse_fasm_file, \
+        write_canonical_fasm, implementation
     available.append('antlr')
 except ImportError as e:
     warn(
@@ -40,7 +42,12 @@ except ImportError as e:
     pip install -v fasm
 """.format(e), RuntimeWarning)
     from fasm.parser.textx import \
-        parse_fasm_filename, parse_fasm_string, implementation
+        parse_fasm_filename, parse_fasm_string, iter_parse_fasm_filename, \
+        parse_fasm_filename_columns, parse_fasm_file, iter_parse_fasm_file, \
+        write_canonical_fasm, implementation
 
 # The textx parser is available as a fallback.
 available.append('textx')
+
+from fasm.parser.batch import parse_fasm_filenames, ParseResult  # noqa: E402
+from fasm.parser.cache import DiskCache, MemoryCache  # noqa: E402
@@ -16,11 +16,25 @@
 # limitations under the License.
 #
 # SPDX-License-Identifier: Apache-2.0
+""" FASM parser using the native ANTLR based libparse_fasm library.
 
-from ctypes import CDLL, POINTER, CFUNCTYPE, c_char, c_size_t, c_char_p
+The native parser keeps no global state, and ctypes releases the GIL
+while it runs, so files and strings can be parsed concurrently from
+several threads, e.g. with concurrent.futures.ThreadPoolExecutor.
+Each thread parses strings with its own native parse context.
+"""
+
+from ctypes import CDLL, POINTER, CFUNCTYPE, c_bool, c_char, c_int, \
+    c_size_t, c_char_p, c_void_p, byref, cast
+import hashlib
+import io
+import mmap
 import os
+from fasm.compression import detect_compression, open_compressed, \
+    decompressed, compression_of_magic, MAGIC_SIZE
 from fasm.parser import antlr_to_tuple
 import platform
+import threading
 from pathlib import Path
 
 implementation = 'antlr'
@@ -39,38 +53,190 @@ try:
 except OSError:
     raise ImportError('Could not find parse_fasm library.')
 
+RESULT_CALLBACK = CFUNCTYPE(None, POINTER(c_char), c_size_t)
+ERROR_CALLBACK = CFUNCTYPE(None, c_size_t, c_size_t, c_char_p)
+
+parse_fasm.from_file_streaming.argtypes = [
+    c_char_p, c_bool, c_size_t, RESULT_CALLBACK, ERROR_CALLBACK
+]
+parse_fasm.from_file_streaming.restype = None
+parse_fasm.open_file_stream.argtypes = [
+    c_char_p, c_bool, c_size_t, ERROR_CALLBACK
+]
+parse_fasm.open_file_stream.restype = c_void_p
+parse_fasm.next_batch.argtypes = [c_void_p, RESULT_CALLBACK, ERROR_CALLBACK]
+parse_fasm.next_batch.restype = c_bool
+parse_fasm.close_stream.argtypes = [c_void_p]
+parse_fasm.close_stream.restype = None
+parse_fasm.fasm_context_create.argtypes = [c_bool]
+parse_fasm.fasm_context_create.restype = c_void_p
+parse_fasm.fasm_context_destroy.argtypes = [c_void_p]
+parse_fasm.fasm_context_destroy.restype = None
+parse_fasm.fasm_context_parse_string.argtypes = [
+    c_void_p, c_char_p, RESULT_CALLBACK, ERROR_CALLBACK
+]
+parse_fasm.fasm_context_parse_string.restype = None
+parse_fasm.fasm_context_parse_buffer.argtypes = [
+    c_void_p, c_void_p, c_size_t, RESULT_CALLBACK, ERROR_CALLBACK
+]
+parse_fasm.fasm_context_parse_buffer.restype = None
+parse_fasm.fasm_context_parse_file.argtypes = [
+    c_void_p, c_char_p, RESULT_CALLBACK, ERROR_CALLBACK
+]
+parse_fasm.fasm_context_parse_file.restype = None
+parse_fasm.open_feed_stream.argtypes = [c_bool, c_size_t]
+parse_fasm.open_feed_stream.restype = c_void_p
+parse_fasm.feed_stream.argtypes = [
+    c_void_p, c_void_p, c_size_t, RESULT_CALLBACK, ERROR_CALLBACK
+]
+parse_fasm.feed_stream.restype = c_bool
+parse_fasm.finish_stream.argtypes = [c_void_p, RESULT_CALLBACK, ERROR_CALLBACK]
+parse_fasm.finish_stream.restype = c_bool
+parse_fasm.close_feed_stream.argtypes = [c_void_p]
+parse_fasm.close_feed_stream.restype = None
+parse_fasm.from_file_parallel.argtypes = [
+    c_char_p, c_size_t, c_bool, RESULT_CALLBACK, ERROR_CALLBACK
+]
+parse_fasm.from_file_parallel.restype = None
+parse_fasm.from_buffer_parallel.argtypes = [
+    c_void_p, c_size_t, c_size_t, c_bool, RESULT_CALLBACK, ERROR_CALLBACK
+]
+parse_fasm.from_buffer_parallel.restype = None
+parse_fasm.canonical_from_file.argtypes = [
+    c_char_p, c_size_t, c_int,
+    POINTER(c_size_t), ERROR_CALLBACK
+]
+parse_fasm.canonical_from_file.restype = c_bool
+parse_fasm.canonical_from_encoded.argtypes = [
+    c_void_p, c_size_t, c_int,
+    POINTER(c_size_t), ERROR_CALLBACK
+]
+parse_fasm.canonical_from_encoded.restype = c_bool
+
+READ_SIZE = 1 << 16
+""" Number of bytes read from a file object at a time. """
+
+
+class ParseContext(object):
+    """ Owns a native parse context.
+
+    A context reuses its output buffer from parse to parse, so it must
+    only be used by one thread at a time. Separate contexts share
+    nothing and can be used concurrently.
+    """
+
+    def __init__(self):
+        self.handle = parse_fasm.fasm_context_create(False)
+
+    def __del__(self):
+        parse_fasm.fasm_context_destroy(self.handle)
+
+
+def buffer_view(s, n):
+    """ Returns a memoryview of the n bytes at s, without copying them.
+
+    The memory is owned by libparse_fasm, and is only valid until the
+    callback that received it returns, so it must be decoded there.
+
+    Args:
+        s: A POINTER(c_char) passed to a RESULT_CALLBACK.
+        n: The number of bytes at s.
+
+    Returns:
+        A memoryview of unsigned bytes.
+    """
+    return memoryview(cast(s, POINTER(c_char * n)).contents).cast('B')
+
+
+_thread_state = threading.local()
+
+
+def thread_context():
+    """ Returns the ParseContext of the calling thread. """
+    context = getattr(_thread_state, 'context', None)
+    if context is None:
+        context = ParseContext()
+        _thread_state.context = context
+    return context
+
+
+def result_callback(error):
+    """ Decorator making a RESULT_CALLBACK of a function(s, n).
+
+    ctypes only prints an exception raised in a callback, and the native
+    parser carries on as if it had returned, so the result would be lost
+    without an error. The first exception is kept in error[0] instead,
+    to be raised once the native call returns, and the results after an
+    error are ignored.
+    """
 
-def parse_fasm_string(s):
+    def decorator(function):
+        @RESULT_CALLBACK
+        def callback(s, n):
+            if error[0] is not None:
+                return
+            try:
+                function(s, n)
+            except BaseException as e:
+                error[0] = e
+
+        return callback
+
+    return decorator
+
+
+def decode(s, n, lazy, names=None):
+    """ Decode a result passed to a RESULT_CALLBACK.
+
+    If lazy is true, the result is copied into a LazyFasmLines.
+    Otherwise, it is decoded in place into a list of FasmLine.
+    Names are interned in names, a StringTable, if it is given.
+    """
+    if lazy:
+        return antlr_to_tuple.LazyFasmLines(s[:n], names)
+    else:
+        return antlr_to_tuple.parse_fasm_data(buffer_view(s, n), names)
+
+
+def parse_fasm_string(s, lazy=False):
     """ Parse FASM string, returning list of FasmLine named tuples.
 
     >>> parse_fasm_string('a.b.c = 1')[0].set_feature.feature
     'a.b.c'
 
+    s may also be bytes, or another contiguous buffer of bytes such as a
+    memoryview, which is parsed in place without copying it.
+
     Args:
         s: The string containing FASM source to parse.
+        lazy: If true, return a LazyFasmLines, which only decodes lines
+            as they are accessed.
 
     Returns:
-        A list of fasm.model.FasmLine.
+        A list of fasm.model.FasmLine, or a LazyFasmLines.
     """
+    if isinstance(s, str):
+        s = s.encode('ascii')
+    address, size = antlr_to_tuple.buffer_address(s)
+
     result = [None]
     error = [None]
 
     # Use a closure to parse while allowing C++ to handle memory.
-    @CFUNCTYPE(None, POINTER(c_char), c_size_t)
+    # The result is decoded or copied before the callback returns.
+    @result_callback(error)
     def callback(s, n):
-        data = s[:n]
-        assert len(data) == n
-        result[0] = antlr_to_tuple.parse_fasm_data(data)
-        error[0] = None
+        result[0] = decode(s, n, lazy)
 
-    @CFUNCTYPE(None, c_size_t, c_size_t, c_char_p)
+    @ERROR_CALLBACK
     def error_callback(line, position, message):
         result[0] = None
         error[0] = Exception(
             'Parse error at {}:{} - {}'.format(
                 line, position, message.decode('ascii')))
 
-    parse_fasm.from_string(bytes(s, 'ascii'), 0, callback, error_callback)
+    parse_fasm.fasm_context_parse_buffer(
+        thread_context().handle, address, size, callback, error_callback)
 
     if error[0] is not None:
         raise error[0]
@@ -78,40 +244,474 @@ def parse_fasm_string(s):
     return result[0]
 
 
-def parse_fasm_filename(filename):
+def parse_fasm_filename(
+        filename, batch_size=0, workers=None, lazy=False, cache=None):
     """ Parse FASM file, returning list of FasmLine named tuples.
 
     >>> parse_fasm_filename('examples/feature_only.fasm')[0]\
         .set_feature.feature
     'EXAMPLE_FEATURE.X0.Y0.BLAH'
 
+    By default, the file is parsed in batches of lines, so the memory
+    used by the native parser does not depend on the size of the file.
+
+    If workers is given, the whole file is instead split into chunks of
+    lines that are parsed on that many threads, which is faster for large
+    files on machines with many cores.
+
+    If lazy is true, the result is a LazyFasmLines, which keeps the
+    encoded lines and only decodes them as they are accessed. This is
+    much faster and smaller when only some lines or features are used.
+    The whole file is encoded at once in this case.
+
+    If cache is given, the encoded lines are kept in it, and parsing the
+    unchanged file again decodes them without parsing the file. The whole
+    file is encoded at once in this case.
+
+    Compressed files (see fasm.compression) are decompressed as they are
+    parsed, on the calling thread.
+
     Args:
         filename: The file containing FASM source to parse.
+        batch_size: Approximate number of bytes of FASM source parsed
+            at a time, or 0 for the default. Ignored if workers, lazy or
+            cache is given.
+        workers: Number of threads to parse with, 0 for one per core,
+            or None to parse on the calling thread.
+        lazy: If true, return a LazyFasmLines.
+        cache: A fasm.parser.cache.DiskCache, or None.
 
     Returns:
-        A list of fasm.model.FasmLine.
+        A list of fasm.model.FasmLine, or a LazyFasmLines.
     """
-    result = [None]
+    if cache is not None:
+        return parse_fasm_filename_cached(filename, workers, lazy, cache)
+
+    if lazy:
+        return parse_fasm_filename_at_once(
+            filename, workers, lambda s, n: decode(s, n, lazy=True))
+
+    f = open_if_compressed(filename)
+    if f is not None:
+        with f:
+            return parse_fasm_file(f, batch_size)
+
+    result = []
     error = [None]
+    names = antlr_to_tuple.StringTable()
 
     # Use a closure to parse while allowing C++ to handle memory.
-    @CFUNCTYPE(None, POINTER(c_char), c_size_t)
+    # This is called once per batch of lines, which is decoded in place.
+    # The batches share names.
+    @result_callback(error)
     def callback(s, n):
-        data = s[:n]
-        assert len(data) == n
-        result[0] = antlr_to_tuple.parse_fasm_data(data)
-        error[0] = None
+        result.extend(decode(s, n, lazy=False, names=names))
 
-    @CFUNCTYPE(None, c_size_t, c_size_t, c_char_p)
+    @ERROR_CALLBACK
     def error_callback(line, position, message):
-        result[0] = None
         error[0] = Exception(
             'Parse error at {}:{} - {}'.format(
                 line, position, message.decode('ascii')))
 
-    parse_fasm.from_file(bytes(filename, 'ascii'), 0, callback, error_callback)
+    if workers is None:
+        parse_fasm.from_file_streaming(
+            bytes(filename, 'ascii'), False, batch_size, callback,
+            error_callback)
+    else:
+        parse_fasm.from_file_parallel(
+            bytes(filename, 'ascii'), workers, False, callback, error_callback)
+
+    if error[0] is not None:
+        raise error[0]
+
+    return result
+
+
+def parse_fasm_filename_at_once(filename, workers, decode_result):
+    """ Parse FASM file into a single buffer, returning decode_result(s, n)
+    of the RESULT_CALLBACK arguments.
+    """
+    f = open_if_compressed(filename)
+    if f is not None:
+        with f:
+            return decode_encoded_file(f, decode_result)
+
+    result = [None]
+    error = [None]
+
+    @result_callback(error)
+    def callback(s, n):
+        result[0] = decode_result(s, n)
+
+    @ERROR_CALLBACK
+    def error_callback(line, position, message):
+        error[0] = Exception(
+            'Parse error at {}:{} - {}'.format(
+                line, position, message.decode('ascii')))
+
+    if workers is None:
+        parse_fasm.fasm_context_parse_file(
+            thread_context().handle, bytes(filename, 'ascii'), callback,
+            error_callback)
+    else:
+        parse_fasm.from_file_parallel(
+            bytes(filename, 'ascii'), workers, False, callback, error_callback)
+
+    if error[0] is not None:
+        raise error[0]
+
+    return result[0]
+
+
+def decode_encoded_file(fileobj, decode_result):
+    """ Encode the FASM file object fileobj, returning decode_result(s, n)
+    of the encoded lines, as for a RESULT_CALLBACK.
+    """
+    data = encode_file(fileobj)
+    return decode_result(
+        cast((c_char * len(data)).from_buffer(data), POINTER(c_char)),
+        len(data))
+
+
+def parse_fasm_buffer_at_once(source, workers, decode_result):
+    """ Parse the contents of a FASM file, compressed or not, from source,
+    a contiguous buffer of bytes. Returns decode_result(s, n) of the
+    RESULT_CALLBACK arguments.
+    """
+    compression = compression_of_magic(bytes(source[:MAGIC_SIZE]))
+    if compression is not None:
+        with open_compressed(io.BytesIO(source), compression) as f:
+            return decode_encoded_file(f, decode_result)
+
+    address, size = antlr_to_tuple.buffer_address(source)
+    result = [None]
+    error = [None]
+
+    @result_callback(error)
+    def callback(s, n):
+        result[0] = decode_result(s, n)
+
+    @ERROR_CALLBACK
+    def error_callback(line, position, message):
+        error[0] = Exception(
+            'Parse error at {}:{} - {}'.format(
+                line, position, message.decode('ascii')))
+
+    if workers is None:
+        parse_fasm.fasm_context_parse_buffer(
+            thread_context().handle, address, size, callback, error_callback)
+    else:
+        parse_fasm.from_buffer_parallel(
+            address, size, workers, False, callback, error_callback)
 
     if error[0] is not None:
         raise error[0]
 
     return result[0]
+
+
+def parse_fasm_filename_cached(filename, workers, lazy, cache):
+    """ Parse FASM file through cache, a fasm.parser.cache.DiskCache. """
+    key = cache.key(filename)
+    data = cache.load(key)
+    if data is None:
+        data = encode_and_store(filename, workers, key, cache)
+
+    # An entry stays mapped while a LazyFasmLines uses it.
+    if lazy:
+        return antlr_to_tuple.LazyFasmLines(data)
+    else:
+        return antlr_to_tuple.parse_fasm_data(data)
+
+
+def encode_and_store(filename, workers, key, cache):
+    """ Returns the encoded lines of filename as bytes, after storing them
+    in cache under key, the CacheKey taken before parsing.
+
+    The cache is only written once the parse is done. A cache that
+    can't be written is only a miss, it doesn't change the result.
+    """
+    # The file is mapped once, for both its digest and the parser.
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            source = b''
+        else:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        digest = hashlib.sha256(source).digest()
+        data = parse_fasm_buffer_at_once(source, workers, lambda s, n: s[:n])
+    finally:
+        if isinstance(source, mmap.mmap):
+            source.close()
+
+    try:
+        cache.store(key, data, digest)
+    except OSError:
+        pass
+    return data
+
+
+def parse_fasm_filename_columns(filename, workers=None):
+    """ Parse FASM file into columns of NumPy arrays.
+
+    The columns are decoded directly from the output of the native
+    parser, which is much faster and smaller than a list of FasmLine.
+    NumPy is required.
+
+    Args:
+        filename: The file containing FASM source to parse.
+        workers: Number of threads to parse with, 0 for one per core,
+            or None to parse on the calling thread.
+
+    Returns:
+        A fasm.columns.FasmColumns.
+    """
+
+    def decode_columns(s, n):
+        return antlr_to_tuple.parse_fasm_data_columns(buffer_view(s, n))
+
+    return parse_fasm_filename_at_once(filename, workers, decode_columns)
+
+
+def iter_parse_fasm_filename(filename, batch_size=0):
+    """ Parse FASM file, yielding FasmLine named tuples.
+
+    >>> next(iter_parse_fasm_filename('examples/feature_only.fasm'))\
+        .set_feature.feature
+    'EXAMPLE_FEATURE.X0.Y0.BLAH'
+
+    The file is parsed a batch of lines at a time as the result is
+    consumed, so closing the generator early skips parsing the rest of
+    the file.
+
+    Args:
+        filename: The file containing FASM source to parse.
+        batch_size: Approximate number of bytes of FASM source parsed
+            at a time, or 0 for the default.
+
+    Yields:
+        fasm.model.FasmLine.
+    """
+    f = open_if_compressed(filename)
+    if f is not None:
+        with f:
+            yield from iter_parse_fasm_file(f, batch_size)
+        return
+
+    batch = []
+    error = [None]
+    names = antlr_to_tuple.StringTable()
+
+    @result_callback(error)
+    def callback(s, n):
+        batch.extend(decode(s, n, lazy=False, names=names))
+
+    @ERROR_CALLBACK
+    def error_callback(line, position, message):
+        error[0] = Exception(
+            'Parse error at {}:{} - {}'.format(
+                line, position, message.decode('ascii')))
+
+    stream = parse_fasm.open_file_stream(
+        bytes(filename, 'ascii'), False, batch_size, error_callback)
+    if not stream:
+        raise error[0]
+
+    try:
+        while parse_fasm.next_batch(stream, callback, error_callback):
+            if error[0] is not None:
+                break
+            yield from batch
+            batch.clear()
+
+        if error[0] is not None:
+            raise error[0]
+    finally:
+        parse_fasm.close_stream(stream)
+
+
+def read_chunks(fileobj):
+    """ Yields chunks of bytes read from fileobj until the end of file.
+
+    Binary files are read into a reused buffer, so each chunk must be
+    used before the next one is read.
+    """
+    readinto = getattr(fileobj, 'readinto', None)
+    if readinto is None:
+        while True:
+            chunk = fileobj.read(READ_SIZE)
+            if not chunk:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode('ascii')
+            yield chunk
+        return
+
+    buffer = memoryview(bytearray(READ_SIZE))
+    while True:
+        n = readinto(buffer)
+        if not n:
+            break
+        yield buffer[:n]
+
+
+def feed_file(fileobj, batch_size, consume):
+    """ Feed fileobj to the native parser a chunk at a time, calling
+    consume(s, n) with each encoded batch of lines, as for a
+    RESULT_CALLBACK. Exceptions raised by consume are raised here.
+
+    This is a generator, which yields after each chunk, so that the
+    batches can be consumed as the file is parsed.
+    """
+    error = [None]
+    callback = result_callback(error)(consume)
+
+    @ERROR_CALLBACK
+    def error_callback(line, position, message):
+        error[0] = Exception(
+            'Parse error at {}:{} - {}'.format(
+                line, position, message.decode('ascii')))
+
+    stream = parse_fasm.open_feed_stream(False, batch_size)
+    try:
+        for chunk in read_chunks(fileobj):
+            address, size = antlr_to_tuple.buffer_address(chunk)
+            parse_fasm.feed_stream(
+                stream, address, size, callback, error_callback)
+            if error[0] is not None:
+                raise error[0]
+            yield
+
+        parse_fasm.finish_stream(stream, callback, error_callback)
+        if error[0] is not None:
+            raise error[0]
+        yield
+    finally:
+        parse_fasm.close_feed_stream(stream)
+
+
+def encode_file(fileobj):
+    """ Returns the encoded lines of the FASM file object fileobj, as a
+    single bytearray like the output of from_file.
+    """
+    data = bytearray()
+
+    def consume(s, n):
+        # Drop the null byte ending each batch.
+        data.extend(buffer_view(s, n - 1))
+
+    for _ in feed_file(fileobj, 0, consume):
+        pass
+
+    data.append(0)
+    return data
+
+
+def open_if_compressed(filename):
+    """ Returns a file object of the decompressed contents of filename if
+    it is compressed, otherwise None.
+    """
+    compression = detect_compression(filename)
+    if compression is None:
+        return None
+    return open_compressed(filename, compression)
+
+
+def iter_parse_fasm_file(fileobj, batch_size=0):
+    """ Parse FASM from a file object, yielding FasmLine named tuples.
+
+    The file is read a chunk at a time and fed to the native parser, so
+    neither the file nor its lines are held in memory at once. This works
+    for pipes, e.g. sys.stdin.buffer or the stdout of a subprocess.
+    Compressed binary data is decompressed, see
+    fasm.compression.decompressed.
+
+    Args:
+        fileobj: A readable file object, preferably opened in binary
+            mode.
+        batch_size: Approximate number of bytes of FASM source parsed
+            at a time, or 0 for the default.
+
+    Yields:
+        fasm.model.FasmLine.
+    """
+    batch = []
+    names = antlr_to_tuple.StringTable()
+
+    def consume(s, n):
+        batch.extend(decode(s, n, lazy=False, names=names))
+
+    for _ in feed_file(decompressed(fileobj), batch_size, consume):
+        yield from batch
+        batch.clear()
+
+
+def parse_fasm_file(fileobj, batch_size=0):
+    """ Parse FASM from a file object, returning list of FasmLine named
+    tuples.
+
+    See iter_parse_fasm_file.
+
+    Args:
+        fileobj: A readable file object, preferably opened in binary
+            mode.
+        batch_size: Approximate number of bytes of FASM source parsed
+            at a time, or 0 for the default.
+
+    Returns:
+        A list of fasm.model.FasmLine.
+    """
+    return list(iter_parse_fasm_file(fileobj, batch_size))
+
+
+def write_canonical_fasm(filename, fileobj, workers=None):
+    """ Write the canonical form of a FASM file to a file object.
+
+    The output is the same as fasm.fasm_tuple_to_string(lines, True) of
+    the parsed lines, except that no newline is written if there are no
+    lines. The lines are expanded, sorted and written by libparse_fasm,
+    without creating a FasmLine for each.
+
+    Args:
+        filename: The file containing FASM source to parse, which may be
+            compressed, see fasm.compression.
+        fileobj: A file object with a file descriptor, e.g. sys.stdout
+            or a file opened for writing without compression. It is
+            flushed before the lines are written to its descriptor.
+        workers: Number of threads to parse with, 0 for one per core,
+            or None to parse on the calling thread, as in
+            parse_fasm_filename. Compressed files are always parsed on
+            the calling thread.
+
+    Returns:
+        The number of lines written.
+    """
+    error = [None]
+    count = c_size_t(0)
+
+    @ERROR_CALLBACK
+    def error_callback(line, position, message):
+        error[0] = Exception(
+            'Parse error at {}:{} - {}'.format(
+                line, position, message.decode('ascii')))
+
+    fileobj.flush()
+    fd = fileobj.fileno()
+
+    f = open_if_compressed(filename)
+    if f is not None:
+        with f:
+            data = encode_file(f)
+        address, size = antlr_to_tuple.buffer_address(data)
+        parse_fasm.canonical_from_encoded(
+            address, size, fd, byref(count), error_callback)
+    else:
+        nthreads = 1 if workers is None else workers
+        parse_fasm.canonical_from_file(
+            bytes(filename, 'ascii'), c_size_t(nthreads), fd, byref(count),
+            error_callback)
+
+    if error[0] is not None:
+        raise error[0]
+    return count.value
@@ -17,7 +17,12 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-from sys import byteorder
+from libc.stdint cimport uint32_t, uint64_t
+from libc.stdint cimport int8_t, int32_t, int64_t
+from libc.string cimport memcmp, memcpy, memset
+from cpython.unicode cimport PyUnicode_1BYTE_DATA, PyUnicode_GET_LENGTH
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from collections.abc import Sequence
 from fasm.model import \
     SetFasmFeature, Annotation, FasmLine, ValueFormat
 from fasm.parser import tags
@@ -33,179 +38,591 @@ TAG_TO_VALUE_FORMAT = {
 
 # The following functions decode the binary format generated by parse_fasm.
 # This is a lightweight binary format designed to be fast to decode.
-
-cdef (int, int) get_header(char* tags, char* data, int i):
-    """
-    Match a tag and retrieve length from the header.
-    Returns data length and offset, or None and the same offset
-    if the header doesn't match on of the given tags.
-    """
-    if not data[i] in tags:
-        return -1, i
-
-    return int.from_bytes(data[i + 1:i + 5], byteorder), i + 5
-
-
-def tagged_string_from_bytes(tag, data, i):
-    """ Decode a tagged string. """
-    length, i = get_header(tag, data, i)
-    if length == -1:
-        return None, i
-
-    return data[i:i + length].decode('ascii'), i + length
-
-
-def fasm_address_from_bytes(data, i):
-    """ Decode a FASM address: [x:y] """
-    length, i = get_header(tags.address, data, i)
-    if length == -1:
-        return None, None, i
-
-    assert length == 4 or length == 8, length
-
-    end = int.from_bytes(data[i:i + 4], byteorder)
-
-    if length == 8:
-        start = int.from_bytes(data[i + 4:i + 8], byteorder)
-    else:  # If there is only one value, assign it to start
-        start = end
-        end = None
-
-    return start, end, i + length
-
-
-def fasm_value_from_bytes(data, i):
-    """ Decode a FASM value. """
-    tag = data[i:i+1]
-    if tag == tags.plain:  # Matches a plain decimal integer.
-        length = 4
-        i = i + 1
-    else:  # Matches Verilog number formats: hex, octal, binary, or decimal.
-        length, i = get_header(
-            tags.hex + tags.octal + tags.binary + tags.decimal, data, i)
-
-    if length == -1:
-        return None, None, i
-
-    assert length % 4 == 0, length
-
-    value = 0
-    for j in range(i, i + length, 4):
-        value = value << 32 | int.from_bytes(data[j:j + 4], byteorder)
-
-    return value, TAG_TO_VALUE_FORMAT[tag], i + length
-
-
-def fasm_width_from_bytes(data, i):
-    """ Decode the width of a Verilog value. """
-    if data[i:i+1] != tags.width:
-        return None, i
-    else:
-        return int.from_bytes(data[i + 1:i + 5], byteorder), i + 5
-
-
-def address_width(start, end):
+#
+# Each value is a one byte tag, followed by its length as a 4 byte
+# integer in native endianness, except for plain values, which are
+# always 4 bytes long and have no length.
+#
+# The decoder reads the buffer through a pointer, so only the objects
+# returned to the caller are allocated.
+
+cdef unsigned char TAG_LINE = tags.line[0]
+cdef unsigned char TAG_SET_FEATURE = tags.set_feature[0]
+cdef unsigned char TAG_FEATURE = tags.feature[0]
+cdef unsigned char TAG_ADDRESS = tags.address[0]
+cdef unsigned char TAG_WIDTH = tags.width[0]
+cdef unsigned char TAG_PLAIN = tags.plain[0]
+cdef unsigned char TAG_ANNOTATIONS = tags.annotations[0]
+cdef unsigned char TAG_ANNOTATION = tags.annotation[0]
+cdef unsigned char TAG_ANNOTATION_NAME = tags.annotation_name[0]
+cdef unsigned char TAG_ANNOTATION_VALUE = tags.annotation_value[0]
+cdef unsigned char TAG_COMMENT = tags.comment[0]
+
+# Build the named tuples the way their _make() does, which is much faster
+# than calling them with keyword arguments.
+cdef object tuple_new = tuple.__new__
+
+cdef list VALUE_FORMATS = [None] * 256
+""" TAG_TO_VALUE_FORMAT, indexed by the tag byte. """
+
+cdef signed char VALUE_FORMAT_CODES[256]
+""" The ValueFormat value for each tag byte, or -1 for other bytes. """
+
+memset(VALUE_FORMAT_CODES, -1, sizeof(VALUE_FORMAT_CODES))
+for tag, value_format in TAG_TO_VALUE_FORMAT.items():
+    VALUE_FORMATS[tag[0]] = value_format
+    VALUE_FORMAT_CODES[tag[0]] = value_format.value
+
+
+cdef struct SetFeature:
+    # The offset and length of the feature name.
+    Py_ssize_t feature
+    Py_ssize_t feature_length
+    # The number of values in the address [x:y], and their values.
+    int address_count
+    uint32_t address[2]
+    # The width of the value, or 0 if there is none.
+    uint32_t width
+    # The tag of the value, or 0 if there is no value, and the offset
+    # and length of its words, most significant first.
+    unsigned char value_tag
+    Py_ssize_t value
+    Py_ssize_t value_length
+
+
+cdef inline long long address_width(SetFeature* sf):
     """ Calculate bit width inferred from the address. """
-    return 1 if (start is None or end is None) else end - start + 1
+    if sf.address_count == 2:
+        return <long long>sf.address[0] - sf.address[1] + 1
+    return 1
 
 
-def fasm_set_feature_from_bytes(data, i):
-    """ Decode a set feature: feature = value """
-    length, i = get_header(tags.set_feature, data, i)
-    if length == -1:
-        return None, i
+cdef inline uint32_t read_u32(const unsigned char* data):
+    """ Read a 4 byte integer in native endianness. """
+    cdef uint32_t value
+    memcpy(&value, data, sizeof(value))
+    return value
 
-    feature, p = tagged_string_from_bytes(tags.feature, data, i)
-    start, end, p = fasm_address_from_bytes(data, p)
-    width, p = fasm_width_from_bytes(data, p)
-    value, value_format, p = fasm_value_from_bytes(data, p)
 
-    assert p == i + length
+cdef enum:
+    # Number of slots for recently seen names in a StringTable.
+    RECENT_STRINGS = 1 << 14
 
-    assert feature is not None
 
-    if value is None:
-        value = 1
+cdef class StringTable:
+    """ Interns names decoded from the output of parse_fasm.
 
-    if width:
-        assert value < 2 ** width, \
-            "value {} larger than specified width of {}".format(value, width)
+    Each distinct name is decoded once, and all of its occurrences share
+    the same str object. This saves memory, since the same features are
+    often set many times, e.g. one bit at a time, and dict lookups by
+    name are faster when the key is the same object.
 
-    assert value < 2**address_width(start, end), (value, start, end)
+    Recently seen names are found by hashing their encoded bytes,
+    without decoding them again.
 
-    return SetFasmFeature(
-        feature=feature,
-        start=start,
-        end=end,
-        value=value,
-        value_format=value_format), i + length
-
-
-def fasm_annotation_from_bytes(data, i):
-    """ Decode an annotation: x = "y" """
-    length, i = get_header(tags.annotation, data, i)
-    if length == -1:
-        return None, i
-
-    name, p = tagged_string_from_bytes(tags.annotation_name, data, i)
-    value, p = tagged_string_from_bytes(tags.annotation_value, data, p)
-
-    assert p == i + length
-
-    assert name is not None
-    assert value is not None
-
-    return Annotation(name=name, value=value), i + length
-
-
-def fasm_annotations_from_bytes(data, i):
-    """ Decode a set of annotations: { ... } """
-    length, i = get_header(tags.annotations, data, i)
-    if length == -1:
-        return None, i
-
-    annotations = []
-    annotation, p = fasm_annotation_from_bytes(data, i)
-    while annotation:
-        annotations.append(annotation)
-        annotation, p = fasm_annotation_from_bytes(data, p)
-
-    assert p == i + length
-
-    return annotations, i + length
-
-
-def fasm_line_from_bytes(data, i):
-    """ Decode an entire FASM line. """
-    length, i = get_header(tags.line, data, i)
-    if length == -1:
-        return None, i
-
-    set_feature, p = fasm_set_feature_from_bytes(data, i)
-    annotations, p = fasm_annotations_from_bytes(data, p)
-    comment, p = tagged_string_from_bytes(tags.comment, data, p)
-
-    assert p == i + length
+    A table can be shared by several decodes, e.g. of the batches of one
+    file, so names are shared between their results.
+    """
+    cdef dict strings
+    cdef list recent
+
+    def __init__(self):
+        self.strings = {}
+        self.recent = [None] * RECENT_STRINGS
+
+    def __len__(self):
+        return len(self.strings)
+
+    cdef object get(self, const unsigned char* data, Py_ssize_t length):
+        """ Returns the str for the ASCII string data[0:length]. """
+        # FNV-1a hash
+        cdef uint64_t h = 14695981039346656037ULL
+        cdef Py_ssize_t i
+        for i in range(length):
+            h = (h ^ data[i]) * 1099511628211ULL
+        cdef Py_ssize_t slot = h & (RECENT_STRINGS - 1)
+
+        string = self.recent[slot]
+        if (string is not None and PyUnicode_GET_LENGTH(string) == length
+                and memcmp(PyUnicode_1BYTE_DATA(string), data, length) == 0):
+            return string
+
+        string = (<const char*>data)[:length].decode('ascii')
+        string = self.strings.setdefault(string, string)
+        self.recent[slot] = string
+        return string
+
+
+cdef class Decoder:
+    """ Decodes values from a buffer, advancing the position p. """
+    cdef const unsigned char[::1] buffer
+    cdef const unsigned char* data
+    cdef Py_ssize_t size
+    cdef Py_ssize_t p
+    cdef StringTable names
+
+    def __init__(self, const unsigned char[::1] buffer, StringTable names):
+        self.buffer = buffer
+        self.size = buffer.shape[0]
+        self.data = &buffer[0] if self.size else NULL
+        self.p = 0
+        self.names = names if names is not None else StringTable()
+
+    cdef Decoder at(self, Py_ssize_t p):
+        """ Returns a new decoder of the same buffer, at position p. """
+        cdef Decoder decoder = Decoder.__new__(Decoder)
+        decoder.buffer = self.buffer
+        decoder.data = self.data
+        decoder.size = self.size
+        decoder.p = p
+        decoder.names = self.names
+        return decoder
+
+    cdef Py_ssize_t header(self, unsigned char tag) except -2:
+        """
+        Match a tag and retrieve length from the header.
+        Returns the data length and advances past the header,
+        or returns -1 if the header doesn't match the given tag.
+        """
+        if self.p >= self.size or self.data[self.p] != tag:
+            return -1
+
+        assert self.p + 5 <= self.size, self.p
+        cdef Py_ssize_t length = read_u32(self.data + self.p + 1)
+        self.p += 5
+        assert self.p + length <= self.size, (self.p, length)
+        return length
+
+    cdef object tagged_string(self, unsigned char tag, bint name=False):
+        """ Decode a tagged string, interning it if it is a name. """
+        cdef Py_ssize_t length = self.header(tag)
+        if length == -1:
+            return None
+
+        self.p += length
+        if name:
+            return self.names.get(self.data + self.p - length, length)
+        return self.string(self.p - length, length)
+
+    cdef Py_ssize_t count_lines(self) except -1:
+        """
+        Count the lines from the current position, checking that they
+        fill the buffer. The position is left unchanged.
+        """
+        cdef Py_ssize_t start = self.p
+        cdef Py_ssize_t count = 0
+        cdef Py_ssize_t length = self.header(TAG_LINE)
+        while length != -1:
+            self.p += length
+            count += 1
+            length = self.header(TAG_LINE)
+
+        # Check that data read, plus the final null header,
+        # is equal to the buffer size.
+        assert self.p + 1 == self.size, self.p
+
+        self.p = start
+        return count
+
+    cdef object string(self, Py_ssize_t start, Py_ssize_t length):
+        """ Decode the string at data[start:start + length]. """
+        return (<const char*>(self.data + start))[:length].decode('ascii')
+
+    cdef bint scan_set_feature(self, SetFeature* sf) except -1:
+        """
+        Scan a set feature: feature = value
+        Returns True and fills in sf, or returns False if the next
+        value isn't a set feature.
+        """
+        cdef Py_ssize_t length = self.header(TAG_SET_FEATURE)
+        if length == -1:
+            return False
+        cdef Py_ssize_t end_of_value = self.p + length
+
+        length = self.header(TAG_FEATURE)
+        assert length != -1
+        sf.feature = self.p
+        sf.feature_length = length
+        self.p += length
+
+        # Scan a FASM address: [x:y]
+        sf.address_count = 0
+        length = self.header(TAG_ADDRESS)
+        if length != -1:
+            assert length == 4 or length == 8, length
+            sf.address_count = length // 4
+            sf.address[0] = read_u32(self.data + self.p)
+            if length == 8:
+                sf.address[1] = read_u32(self.data + self.p + 4)
+            self.p += length
+
+        # Scan the width of a Verilog value.
+        sf.width = 0
+        if self.p < self.size and self.data[self.p] == TAG_WIDTH:
+            sf.width = read_u32(self.data + self.p + 1)
+            self.p += 5
+
+        # Scan a FASM value.
+        cdef unsigned char tag = self.data[self.p] if self.p < self.size else 0
+        sf.value_tag = 0
+        sf.value_length = 0
+        if tag == TAG_PLAIN:  # Matches a plain decimal integer.
+            sf.value_tag = tag
+            sf.value = self.p + 1
+            sf.value_length = 4
+            self.p += 5
+        elif VALUE_FORMATS[tag] is not None:
+            # Matches Verilog number formats: hex, octal, binary, or decimal.
+            sf.value_tag = tag
+            sf.value_length = self.header(tag)
+            sf.value = self.p
+            self.p += sf.value_length
+            assert sf.value_length % 4 == 0, sf.value_length
+
+        assert self.p == end_of_value
+        return True
+
+    cdef tuple address(self, SetFeature* sf):
+        """ Returns the start and end of the address, as in SetFasmFeature.
+        If there is only one value, assign it to start.
+        """
+        if sf.address_count == 2:
+            return sf.address[1], sf.address[0]
+        elif sf.address_count == 1:
+            return sf.address[0], None
+        else:
+            return None, None
+
+    cdef uint64_t small_value(self, SetFeature* sf) except? 0:
+        """ Returns a value that fits in 64 bits, checking its width. """
+        # A missing value is 1.
+        cdef uint64_t value = 1 if sf.value_tag == 0 else 0
+        cdef Py_ssize_t j
+        for j in range(sf.value, sf.value + sf.value_length, 4):
+            value = value << 32 | read_u32(self.data + j)
+
+        if sf.width and sf.width < 64:
+            assert value >> sf.width == 0, \
+                "value {} larger than specified width of {}".format(
+                    value, sf.width)
+        cdef long long width = address_width(sf)
+        if width <= 0:
+            assert value == 0, (value, ) + self.address(sf)
+        elif width < 64:
+            assert value >> width == 0, (value, ) + self.address(sf)
+        return value
+
+    cdef object wide_value(self, SetFeature* sf):
+        """ Returns a value wider than 64 bits, checking its width. """
+        value = 0
+        cdef Py_ssize_t j
+        for j in range(sf.value, sf.value + sf.value_length, 4):
+            value = value << 32 | read_u32(self.data + j)
+
+        if sf.width:
+            assert value >> sf.width == 0, \
+                "value {} larger than specified width of {}".format(
+                    value, sf.width)
+        cdef long long width = address_width(sf)
+        if width <= 0:
+            assert value == 0, (value, ) + self.address(sf)
+        else:
+            assert value >> width == 0, (value, ) + self.address(sf)
+        return value
+
+    cdef object set_feature(self):
+        """ Decode a set feature: feature = value """
+        cdef SetFeature sf
+        if not self.scan_set_feature(&sf):
+            return None
+
+        feature = self.names.get(self.data + sf.feature, sf.feature_length)
+        start, end = self.address(&sf)
+        if sf.value_length <= 8:
+            value = self.small_value(&sf)
+        else:
+            value = self.wide_value(&sf)
+
+        return tuple_new(
+            SetFasmFeature,
+            (feature, start, end, value, VALUE_FORMATS[sf.value_tag]))
+
+    cdef object annotation(self):
+        """ Decode an annotation: x = "y" """
+        cdef Py_ssize_t length = self.header(TAG_ANNOTATION)
+        if length == -1:
+            return None
+        cdef Py_ssize_t end_of_value = self.p + length
+
+        name = self.tagged_string(TAG_ANNOTATION_NAME, name=True)
+        value = self.tagged_string(TAG_ANNOTATION_VALUE)
+
+        assert self.p == end_of_value
+
+        assert name is not None
+        assert value is not None
+
+        return tuple_new(Annotation, (name, value))
+
+    cdef object annotations(self):
+        """ Decode a set of annotations: { ... } """
+        cdef Py_ssize_t length = self.header(TAG_ANNOTATIONS)
+        if length == -1:
+            return None
+        cdef Py_ssize_t end_of_value = self.p + length
+
+        annotations = []
+        annotation = self.annotation()
+        while annotation is not None:
+            annotations.append(annotation)
+            annotation = self.annotation()
+
+        assert self.p == end_of_value
+
+        return annotations
+
+    cdef object line(self):
+        """ Decode an entire FASM line. """
+        cdef Py_ssize_t length = self.header(TAG_LINE)
+        if length == -1:
+            return None
+        cdef Py_ssize_t end_of_value = self.p + length
+
+        set_feature = self.set_feature()
+        annotations = self.annotations()
+        comment = self.tagged_string(TAG_COMMENT)
+
+        assert self.p == end_of_value
+
+        assert (
+            set_feature is not None or annotations is not None
+            or comment is not None)
+
+        return tuple_new(FasmLine, (set_feature, annotations, comment))
+
+
+def buffer_address(const unsigned char[::1] data):
+    """ Returns the address and size of data, a contiguous buffer of bytes,
+    for passing it to the native parser without copying it.
+
+    The address is only valid while data is alive and not resized.
+    """
+    if data.shape[0] == 0:
+        return 0, 0
+    return <size_t>&data[0], data.shape[0]
 
-    assert (
-        set_feature is not None or annotations is not None
-        or comment is not None)
 
-    return FasmLine(
-        set_feature=set_feature, annotations=annotations,
-        comment=comment), i + length
+def parse_fasm_data(data, StringTable names=None):
+    """ Parse FASM string, returning list of FasmLine named tuples.
 
+    data may be any contiguous buffer of bytes, such as bytes or a
+    memoryview, which is read in place without copying it.
 
-def parse_fasm_data(data):
-    """ Parse FASM string, returning list of FasmLine named tuples."""
+    Feature and annotation names are interned in names, or in a new
+    StringTable if names is None.
+    """
+    cdef Decoder decoder = Decoder(data, names)
     lines = []
-    line, p = fasm_line_from_bytes(data, 0)
-    while line:
+    line = decoder.line()
+    while line is not None:
         lines.append(line)
-        line, p = fasm_line_from_bytes(data, p)
+        line = decoder.line()
 
     # Check that data read, plus the final null header,
     # is equal to the buffer size.
-    assert p + 1 == len(data), p
+    assert decoder.p + 1 == decoder.size, decoder.p
 
     return lines
+
+
+def parse_fasm_data_columns(data, StringTable names=None):
+    """ Parse FASM string into a fasm.columns.FasmColumns.
+
+    The columns are filled directly from the encoded data, without
+    building a FasmLine for each line. NumPy is required.
+
+    Args:
+        data: The output of parse_fasm, as bytes or another contiguous
+            buffer of bytes.
+        names: StringTable to intern names in, or None for a new one.
+
+    Returns:
+        A fasm.columns.FasmColumns.
+    """
+    import numpy
+    from fasm.columns import FasmColumns, NONE
+
+    cdef Decoder decoder = Decoder(data, names)
+    cdef Py_ssize_t count = decoder.count_lines()
+
+    feature_id_array = numpy.empty(count, dtype=numpy.int32)
+    start_array = numpy.empty(count, dtype=numpy.int64)
+    end_array = numpy.empty(count, dtype=numpy.int64)
+    value_array = numpy.empty(count, dtype=numpy.uint64)
+    value_format_array = numpy.empty(count, dtype=numpy.int8)
+    cdef int32_t[::1] feature_id = feature_id_array
+    cdef int64_t[::1] start = start_array
+    cdef int64_t[::1] end = end_array
+    cdef uint64_t[::1] value = value_array
+    cdef int8_t[::1] value_format = value_format_array
+
+    features = []
+    feature_ids = {}
+    wide_values = {}
+    annotations = {}
+    comments = {}
+
+    cdef SetFeature sf
+    cdef Py_ssize_t i, end_of_line
+    for i in range(count):
+        end_of_line = decoder.header(TAG_LINE)
+        end_of_line += decoder.p
+
+        if decoder.scan_set_feature(&sf):
+            feature = decoder.names.get(
+                decoder.data + sf.feature, sf.feature_length)
+            index = feature_ids.get(feature)
+            if index is None:
+                index = len(features)
+                feature_ids[feature] = index
+                features.append(feature)
+            feature_id[i] = index
+
+            start[i] = NONE
+            end[i] = NONE
+            if sf.address_count == 2:
+                start[i] = sf.address[1]
+                end[i] = sf.address[0]
+            elif sf.address_count == 1:
+                start[i] = sf.address[0]
+
+            # As in FasmColumns.from_lines, values are wide by their size,
+            # not their encoding, which may have leading zero words.
+            if sf.value_length <= 8:
+                value[i] = decoder.small_value(&sf)
+            else:
+                wide_value = decoder.wide_value(&sf)
+                if wide_value < 2**64:
+                    value[i] = wide_value
+                else:
+                    value[i] = 0
+                    wide_values[i] = wide_value
+            value_format[i] = VALUE_FORMAT_CODES[sf.value_tag]
+        else:
+            feature_id[i] = NONE
+            start[i] = NONE
+            end[i] = NONE
+            value[i] = 0
+            value_format[i] = NONE
+
+        line_annotations = decoder.annotations()
+        if line_annotations is not None:
+            annotations[i] = line_annotations
+        comment = decoder.tagged_string(TAG_COMMENT)
+        if comment is not None:
+            comments[i] = comment
+
+        assert decoder.p == end_of_line
+        assert (
+            feature_id[i] != NONE or line_annotations is not None
+            or comment is not None)
+
+    return FasmColumns(
+        features=features,
+        feature_id=feature_id_array,
+        start=start_array,
+        end=end_array,
+        value=value_array,
+        value_format=value_format_array,
+        wide_values=wide_values,
+        annotations=annotations,
+        comments=comments)
+
+
+cdef class LazyFasmLines:
+    """ Sequence of FasmLine named tuples, decoded when they are accessed.
+
+    Only the encoded data and the offset of each line in it are kept,
+    so an unused result takes about as much memory as the encoded data.
+    Lines are decoded again each time they are accessed.
+
+    Args:
+        data: The output of parse_fasm, as bytes or another contiguous
+            buffer of bytes, which must not change while it is in use.
+        names: StringTable to intern names in, or None for a new one.
+            Lines decoded more than once share their names.
+    """
+    cdef Decoder decoder
+    cdef Py_ssize_t* offsets
+    cdef Py_ssize_t nlines
+
+    def __init__(self, data, StringTable names=None):
+        self.decoder = Decoder(data, names)
+
+        # Index the start of each line.
+        cdef Decoder decoder = self.decoder.at(0)
+        cdef Py_ssize_t count = decoder.count_lines()
+        self.offsets = <Py_ssize_t*>PyMem_Malloc(
+            max(count, 1) * sizeof(Py_ssize_t))
+        if not self.offsets:
+            raise MemoryError()
+        cdef Py_ssize_t i
+        for i in range(count):
+            self.offsets[i] = decoder.p
+            decoder.p += decoder.header(TAG_LINE)
+        self.nlines = count
+
+    def __dealloc__(self):
+        PyMem_Free(self.offsets)
+
+    def __len__(self):
+        return self.nlines
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.nlines))]
+
+        cdef Py_ssize_t i = index
+        if i < 0:
+            i += self.nlines
+        if i < 0 or i >= self.nlines:
+            raise IndexError('line index out of range')
+        return self.decoder.at(self.offsets[i]).line()
+
+    def __iter__(self):
+        cdef Decoder decoder = self.decoder.at(0)
+        for _ in range(self.nlines):
+            yield decoder.line()
+
+    def index(self, value, start=0, stop=None):
+        """ Returns the index of the first line equal to value, between
+        start and stop as for list.index, decoding lines until it is
+        found. Raises ValueError if there is none.
+        """
+        cdef Py_ssize_t i
+        for i in range(*slice(start, stop).indices(self.nlines)):
+            if self[i] == value:
+                return i
+        raise ValueError('line not in LazyFasmLines')
+
+    def count(self, value):
+        """ Returns the number of lines equal to value, decoding every
+        line.
+        """
+        return sum(1 for line in self if line == value)
+
+    def features(self):
+        """ Yields the feature of each line that sets one.
+
+        Only the feature names are decoded, which is much faster than
+        decoding whole lines.
+        """
+        cdef Decoder decoder = self.decoder.at(0)
+        cdef Py_ssize_t i
+        for i in range(self.nlines):
+            decoder.p = self.offsets[i] + 5
+            if decoder.header(TAG_SET_FEATURE) != -1:
+                yield decoder.tagged_string(TAG_FEATURE, name=True)
+
+
+Sequence.register(LazyFasmLines)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+""" Parsing of many FASM files with a pool of workers. """
+
+from collections import namedtuple
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, \
+    Future, as_completed, wait, FIRST_COMPLETED
+import importlib
+import threading
+import time
+
+ParseResult = namedtuple('ParseResult', 'filename lines seconds')
+""" Lines parsed from filename, and the seconds spent parsing them. """
+
+
+def parse_timed(backend, filename, kwargs):
+    """ Parse filename with the backend parser module, returning a
+    ParseResult.
+    """
+    parser = importlib.import_module('fasm.parser.' + backend)
+    start = time.perf_counter()
+    lines = parser.parse_fasm_filename(filename, **kwargs)
+    if not isinstance(lines, Sequence):
+        lines = list(lines)
+    return ParseResult(filename, lines, time.perf_counter() - start)
+
+
+def parse_fasm_filenames(
+        filenames, workers=None, backend=None, ordered=True, **kwargs):
+    """ Parse FASM files on a pool of workers, yielding a ParseResult for
+    each.
+
+    The antlr parser releases the GIL, so files are parsed on threads.
+    The textx parser does not, so files are parsed in separate processes
+    and the lines are sent back to the calling process.
+
+    If parsing a file raises an exception, files that are not being
+    parsed yet are skipped and the exception is raised as soon as it
+    happens, even if earlier files are still being parsed. The files
+    that are being parsed finish in the background. The same happens if
+    the generator is closed early.
+
+    Args:
+        filenames: The files containing FASM source to parse.
+        workers: Number of threads or processes to parse with, or None
+            for the default of concurrent.futures.
+        backend: Name of the parser module to use, from
+            fasm.parser.available, or None for fasm.parser.implementation.
+        ordered: If true, results are yielded in the order of filenames,
+            otherwise as soon as each file is parsed.
+        kwargs: Passed to parse_fasm_filename of the parser. The results
+            must be picklable when parsing in separate processes.
+
+    Yields:
+        ParseResult of each file.
+    """
+    from fasm.parser import available, implementation
+
+    if backend is None:
+        backend = implementation
+    if backend not in available:
+        raise ValueError(
+            'Parser {} is not available, expected one of {}'.format(
+                backend, available))
+
+    if backend == 'antlr':
+        executor = ThreadPoolExecutor(workers)
+    else:
+        executor = ProcessPoolExecutor(workers)
+
+    futures = []
+    failed = Future()
+    failed_lock = threading.Lock()
+
+    def cancel_on_error(future):
+        # Skip the other files as soon as one fails, and wake up the
+        # caller if it waits on an earlier file.
+        if future.cancelled() or future.exception() is None:
+            return
+        for other in futures:
+            other.cancel()
+        with failed_lock:
+            if not failed.done():
+                failed.set_result(future)
+
+    finished = False
+    try:
+        for filename in filenames:
+            futures.append(
+                executor.submit(parse_timed, backend, filename, kwargs))
+        for future in futures:
+            future.add_done_callback(cancel_on_error)
+
+        if ordered:
+            for future in futures:
+                wait([future, failed], return_when=FIRST_COMPLETED)
+                if failed.done():
+                    raise failed.result().exception()
+                yield future.result()
+        else:
+            for future in as_completed(futures):
+                yield future.result()
+        finished = True
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=finished)
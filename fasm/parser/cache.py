@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+""" Caches of parsed FASM files.
+
+A MemoryCache keeps the lines of recently parsed files in memory, for
+long-running processes that parse the same files repeatedly.
+
+The antlr parser encodes the lines of a file into a compact binary form,
+which fasm.parser.antlr_to_tuple decodes into FasmLine tuples. A
+DiskCache keeps that encoded form of each file in a directory, so parsing
+the unchanged file again just memory-maps the entry and decodes it.
+
+>>> cache = DiskCache('/tmp/fasm-cache')  # doctest: +SKIP
+>>> lines = parse_fasm_filename('design.fasm', cache=cache)  # doctest: +SKIP
+
+The disk cache is only used by the antlr parser.
+"""
+
+from collections import namedtuple, OrderedDict
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+
+from fasm.model import FasmLine
+
+MAGIC = b'FASMTLV\0'
+
+VERSION = 1
+""" Version of the entry format, which must be changed along with the
+encoding produced by the native parser.
+"""
+
+BYTE_ORDER = 0x01020304
+""" Written in native byte order, so entries written on a machine of the
+other endianness are not used.
+"""
+
+HEADER = struct.Struct('=8sIIQqQ32s')
+""" Entry header of magic, version, byte order, source size,
+source mtime in nanoseconds, encoded size and source digest.
+The encoded lines follow the header.
+"""
+
+SUFFIX = '.fasmtlv'
+
+CacheKey = namedtuple('CacheKey', 'path size mtime_ns')
+
+CacheInfo = namedtuple(
+    'CacheInfo', 'hits misses evictions entries size max_bytes')
+
+
+def file_digest(filename):
+    """ Returns the SHA-256 digest of the contents of filename. """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class DiskCache(object):
+    """ Cache of encoded FASM files in a directory.
+
+    Entries are found by absolute path, and are used if the size and
+    mtime of the file are unchanged. If only the mtime changed, the
+    contents of the file are hashed and the entry is still used if they
+    are unchanged.
+
+    The least recently used entries are removed when the entries take
+    more than max_bytes. Entries are replaced atomically, so a directory
+    can be shared by several processes.
+
+    Args:
+        directory: Directory to keep entries in, which is created if it
+            does not exist.
+        max_bytes: Maximum total size of the entries.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, filename):
+        """ Returns the CacheKey of the current state of filename. """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        return CacheKey(path, st.st_size, st.st_mtime_ns)
+
+    def entry_path(self, key):
+        """ Returns the path of the entry for key. """
+        name = hashlib.sha256(os.fsencode(key.path)).hexdigest()[:32]
+        return os.path.join(self.directory, name + SUFFIX)
+
+    def load(self, key):
+        """ Returns the encoded lines cached for key, or None.
+
+        Args:
+            key: CacheKey from key().
+
+        Returns:
+            A read only memoryview of the memory-mapped entry, or None if
+            there is no valid entry.
+        """
+        entry = self.entry_path(key)
+        try:
+            f = open(entry, 'rb')
+        except OSError:
+            return None
+
+        with f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                return None
+
+            magic, version, byte_order, size, mtime_ns, data_size, digest = \
+                HEADER.unpack(header)
+            if (magic, version, byte_order) != (MAGIC, VERSION, BYTE_ORDER):
+                return None
+            if HEADER.size + data_size != os.fstat(f.fileno()).st_size:
+                return None
+            if size != key.size:
+                return None
+
+            if mtime_ns != key.mtime_ns:
+                # The file was touched, check whether it changed.
+                if file_digest(key.path) != digest:
+                    return None
+                self.update_header(
+                    entry,
+                    HEADER.pack(
+                        magic, version, byte_order, size, key.mtime_ns,
+                        data_size, digest))
+
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Entries are evicted in order of mtime.
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+        return memoryview(data)[HEADER.size:]
+
+    def update_header(self, entry, header):
+        """ Overwrites the header of entry, if the directory is writable. """
+        try:
+            with open(entry, 'r+b') as f:
+                f.write(header)
+        except OSError:
+            pass
+
+    def store(self, key, data, digest):
+        """ Stores the encoded lines of the file of key.
+
+        Nothing is stored if the file changed after key was taken, as
+        data may not match the contents of the file.
+
+        Args:
+            key: CacheKey from key(), taken before the file was parsed.
+            data: The encoded lines, as bytes or another contiguous
+                buffer of bytes.
+            digest: The SHA-256 digest of the contents that were parsed,
+                which the parser has already read, see file_digest.
+        """
+        if self.key(key.path) != key:
+            return
+
+        data = memoryview(data)
+        fd, temp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(
+                    HEADER.pack(
+                        MAGIC, VERSION, BYTE_ORDER, key.size, key.mtime_ns,
+                        data.nbytes, digest))
+                f.write(data)
+            os.replace(temp, self.entry_path(key))
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+        self.evict()
+
+    def entries(self):
+        """ Returns (mtime_ns, size, path) of each entry. """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(SUFFIX):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """ Removes the least recently used entries until the entries take
+        at most max_bytes.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Entries that are still mapped can't be removed on
+                # Windows.
+                continue
+            total -= size
+
+    def clear(self):
+        """ Removes all entries. """
+        for _, _, path in self.entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def freeze_lines(lines):
+    """ Returns lines as a tuple of immutable FasmLine, and their
+    approximate size in bytes.
+
+    Names are often shared between lines, so each string is only counted
+    once.
+    """
+    frozen = []
+    seen = set()
+    size = 0
+
+    def string_size(s):
+        if s is None or id(s) in seen:
+            return 0
+        seen.add(id(s))
+        return sys.getsizeof(s)
+
+    for line in lines:
+        set_feature = line.set_feature
+        if set_feature is not None:
+            size += sys.getsizeof(set_feature)
+            size += string_size(set_feature.feature)
+            size += sys.getsizeof(set_feature.value)
+
+        annotations = line.annotations
+        if annotations is not None:
+            if not isinstance(annotations, tuple):
+                annotations = tuple(annotations)
+                line = FasmLine(set_feature, annotations, line.comment)
+            size += sys.getsizeof(annotations)
+            for annotation in annotations:
+                size += sys.getsizeof(annotation)
+                size += string_size(annotation.name)
+                size += string_size(annotation.value)
+
+        size += sys.getsizeof(line) + string_size(line.comment)
+        frozen.append(line)
+
+    frozen = tuple(frozen)
+    return frozen, size + sys.getsizeof(frozen)
+
+
+class MemoryCache(object):
+    """ In-memory LRU cache of parsed FASM files.
+
+    Each file is parsed once, and the same tuple of FasmLine is returned
+    until the size or mtime of the file changes. The results are shared,
+    so lines are returned as tuples, with annotations as tuples.
+
+    The least recently used results are dropped when the results take
+    more than max_bytes, as estimated with sys.getsizeof. Results larger
+    than max_bytes are not kept at all. The cache can be used from
+    several threads.
+
+    >>> cache = MemoryCache(max_bytes=1 << 28)  # doctest: +SKIP
+    >>> lines = cache.parse_fasm_filename('design.fasm')  # doctest: +SKIP
+
+    Args:
+        max_bytes: Maximum total size of the results.
+        parse: Function parsing a filename into an iterable of FasmLine,
+            fasm.parser.parse_fasm_filename by default. For example,
+            functools.partial(parse_fasm_filename, cache=disk_cache)
+            fills the memory cache from a DiskCache.
+    """
+
+    def __init__(self, max_bytes=256 << 20, parse=None):
+        self.max_bytes = max_bytes
+        self.parse = parse
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def parse_fasm_filename(self, filename):
+        """ Parse FASM file, returning a tuple of FasmLine named tuples.
+
+        Args:
+            filename: The file containing FASM source to parse.
+
+        Returns:
+            A tuple of fasm.model.FasmLine, which may be shared with other
+            callers.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        key = CacheKey(path, st.st_size, st.st_mtime_ns)
+
+        with self.lock:
+            result = self.results.get(path)
+            if result is not None and result[0] == key:
+                self.results.move_to_end(path)
+                self.hits += 1
+                return result[1]
+            self.misses += 1
+
+        # Parse without holding the lock, so other files can be served.
+        parse = self.parse
+        if parse is None:
+            from fasm.parser import parse_fasm_filename as parse
+        lines, size = freeze_lines(parse(path))
+
+        with self.lock:
+            self.discard(path)
+            if size <= self.max_bytes:
+                self.results[path] = (key, lines, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    _, (_, _, evicted) = self.results.popitem(last=False)
+                    self.size -= evicted
+                    self.evictions += 1
+
+        return lines
+
+    def discard(self, path):
+        """ Drops the result for path, if any. Must hold lock. """
+        result = self.results.pop(path, None)
+        if result is not None:
+            self.size -= result[2]
+
+    def info(self):
+        """ Returns a CacheInfo of counters and current size. """
+        with self.lock:
+            return CacheInfo(
+                self.hits, self.misses, self.evictions, len(self.results),
+                self.size, self.max_bytes)
+
+    def clear(self):
+        """ Drops all results. Counters are not reset. """
+        with self.lock:
+            self.results.clear()
+            self.size = 0
@@ -20,6 +20,8 @@
 from __future__ import print_function
 import textx
 import os.path
+from fasm.compression import detect_compression, open_fasm_file, \
+    decompressed
 from fasm.model import \
     ValueFormat, SetFasmFeature, Annotation, FasmLine
 
@@ -136,32 +138,133 @@ def fasm_model_to_tuple(fasm_model):
         )
 
 
-def parse_fasm_string(s):
+def parse_fasm_string(s, lazy=False):
     """ Parse FASM string, returning list of FasmLine named tuples.
 
     >>> parse_fasm_string('a.b.c = 1')[0].set_feature.feature
     'a.b.c'
 
     Args:
-        s: The string containing FASM source to parse.
+        s: The string containing FASM source to parse, or bytes or
+            another buffer of ASCII bytes.
+        lazy: If true, return a list, which can be indexed like the
+            LazyFasmLines returned by the antlr parser.
 
     Returns:
-        A list of fasm.model.FasmLine.
+        An iterable of fasm.model.FasmLine, or a list if lazy is true.
     """
-    return fasm_model_to_tuple(get_fasm_metamodel().model_from_str(s))
+    if not isinstance(s, str):
+        s = bytes(s).decode('ascii')
+    lines = fasm_model_to_tuple(get_fasm_metamodel().model_from_str(s))
+    return list(lines) if lazy else lines
 
 
-def parse_fasm_filename(filename):
+def parse_fasm_filename(filename, lazy=False, cache=None):
     """ Parse FASM file, returning list of FasmLine named tuples.
 
     >>> parse_fasm_filename('examples/feature_only.fasm')[0]\
         .set_feature.feature
     'EXAMPLE_FEATURE.X0.Y0.BLAH'
 
+    Compressed files (see fasm.compression) are decompressed into
+    memory first.
+
+    Args:
+        filename: The file containing FASM source to parse.
+        lazy: If true, return a list, which can be indexed like the
+            LazyFasmLines returned by the antlr parser.
+        cache: Ignored, only the antlr parser output can be cached.
+
+    Returns:
+        An iterable of fasm.model.FasmLine, or a list if lazy is true.
+    """
+    if detect_compression(filename) is not None:
+        with open_fasm_file(filename) as f:
+            return parse_fasm_string(f.read(), lazy)
+
+    lines = fasm_model_to_tuple(get_fasm_metamodel().model_from_file(filename))
+    return list(lines) if lazy else lines
+
+
+def parse_fasm_filename_columns(filename):
+    """ Parse FASM file into columns of NumPy arrays.
+
+    NumPy is required.
+
     Args:
         filename: The file containing FASM source to parse.
 
+    Returns:
+        A fasm.columns.FasmColumns.
+    """
+    from fasm.columns import FasmColumns
+    return FasmColumns.from_lines(parse_fasm_filename(filename))
+
+
+def iter_parse_fasm_filename(filename):
+    """ Parse FASM file, yielding FasmLine named tuples.
+
+    >>> next(iter_parse_fasm_filename('examples/feature_only.fasm'))\
+        .set_feature.feature
+    'EXAMPLE_FEATURE.X0.Y0.BLAH'
+
+    Note that textX parses the whole file before the first line is
+    yielded, only the conversion to FasmLine is done lazily.
+
+    Args:
+        filename: The file containing FASM source to parse.
+
+    Yields:
+        fasm.model.FasmLine.
+    """
+    return parse_fasm_filename(filename)
+
+
+def parse_fasm_file(fileobj):
+    """ Parse FASM from a file object, returning list of FasmLine named
+    tuples.
+
+    Note that textX needs the whole file, so it is read into memory.
+    Compressed binary data is decompressed, see
+    fasm.compression.decompressed.
+
+    Args:
+        fileobj: A readable file object, in binary or text mode.
+
     Returns:
         A list of fasm.model.FasmLine.
     """
-    return fasm_model_to_tuple(get_fasm_metamodel().model_from_file(filename))
+    return list(iter_parse_fasm_file(fileobj))
+
+
+def iter_parse_fasm_file(fileobj):
+    """ Parse FASM from a file object, yielding FasmLine named tuples.
+
+    Note that textX parses the whole file before the first line is
+    yielded.
+
+    Args:
+        fileobj: A readable file object, in binary or text mode.
+
+    Yields:
+        fasm.model.FasmLine.
+    """
+    return parse_fasm_string(decompressed(fileobj).read())
+
+
+def write_canonical_fasm(filename, fileobj, workers=None):
+    """ Write the canonical form of a FASM file to a file object.
+
+    The lines are parsed and written with fasm.write_fasm, workers is
+    accepted for compatibility with the antlr parser.
+
+    Args:
+        filename: The file containing FASM source to parse.
+        fileobj: A file object opened for writing text.
+        workers: Ignored.
+
+    Returns:
+        The number of lines written.
+    """
+    from fasm import write_fasm
+    return write_fasm(parse_fasm_filename(filename), fileobj, canonical=True)
@@ -19,8 +19,10 @@
 
 import argparse
 import importlib
+import sys
 import fasm.parser
-from fasm import fasm_tuple_to_string
+from fasm import write_fasm
+from fasm.compression import open_fasm_file, compression_of_extension
 
 
 def nullable_string(val):
@@ -42,7 +44,8 @@ def get_fasm_parser(name=None):
 
 def main():
     parser = argparse.ArgumentParser('FASM tool')
-    parser.add_argument('file', help='Filename to process')
+    parser.add_argument(
+        'file', help='Filename to process, or - to read standard input')
     parser.add_argument(
         '--canonical',
         action='store_true',
@@ -52,13 +55,39 @@ def main():
         type=nullable_string,
         help='Select FASM parser to use. '
         'Default is to choose the best implementation available.')
+    parser.add_argument(
+        '--output',
+        help='Write FASM to this file instead of standard output. '
+        'It is compressed if its extension is .gz, .xz, .bz2 or .zst.')
 
     args = parser.parse_args()
 
     try:
         fasm_parser = get_fasm_parser(args.parser)
-        fasm_tuples = fasm_parser.parse_fasm_filename(args.file)
-        print(fasm_tuple_to_string(fasm_tuples, args.canonical))
+        if args.canonical and args.file != '-':
+            # The parser writes the canonical form directly.
+            if args.output is None:
+                # Empty output is a blank line, like fasm_tuple_to_string.
+                if not fasm_parser.write_canonical_fasm(args.file, sys.stdout):
+                    print()
+                print()
+                return
+            if compression_of_extension(args.output) is None:
+                with open(args.output, 'w') as f:
+                    fasm_parser.write_canonical_fasm(args.file, f)
+                return
+
+        if args.file == '-':
+            fasm_tuples = fasm_parser.parse_fasm_file(sys.stdin.buffer)
+        else:
+            fasm_tuples = fasm_parser.parse_fasm_filename(args.file)
+        if args.output is None:
+            if not write_fasm(fasm_tuples, sys.stdout, args.canonical):
+                print()
+            print()
+        else:
+            with open_fasm_file(args.output, 'wt') as f:
+                write_fasm(fasm_tuples, f, args.canonical)
     except Exception as e:
         print('Error: ' + str(e))
 
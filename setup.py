@@ -273,6 +273,10 @@ setuptools.setup(
     url="https://github.com/chipsalliance/fasm",
     packages=setuptools.find_packages(exclude=('tests*', )),
     install_requires=['textx'],
+    extras_require={
+        'numpy': ['numpy'],
+        'zstd': ['zstandard'],
+    },
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -14,6 +14,26 @@
 //
 // SPDX-License-Identifier: Apache-2.0
 
+#include <algorithm>
+#include <atomic>
+#include <deque>
+#include <functional>
+#include <memory>
+#include <optional>
+#include <string_view>
+#include <thread>
+
+#ifdef _WIN32
+#define NOMINMAX
+#include <io.h>
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
 #include "FasmLexer.h"
 #include "FasmParser.h"
 #include "FasmParserVisitor.h"
@@ -39,8 +59,8 @@
 ///
 /// TLVs can be nested, with each level adding 5 bytes of header
 /// overhead. There is a choice to aggregate values under another header
-/// (using withHeader) or not. Even though this encodes redundant size
-/// information, it can make the result easier to parse.
+/// (using Encoder::begin and Encoder::end) or not. Even though this encodes
+/// redundant size information, it can make the result easier to parse.
 ///
 /// Example of a nested TLV:
 ///   <outer tag : 1 byte> <outer length = 5 + nA + 5 + nB : 4 bytes>
@@ -56,8 +76,10 @@
 /// manipulation.
 ///
 /// The format used here does not rely on knowing the size of the
-/// entire output, which allows streaming line by line, although
-/// ANTLR does not yet implement an incremental parser.
+/// entire output, which allows streaming line by line. ANTLR does not
+/// implement an incremental parser, so streaming is done by splitting
+/// the input into batches of whole lines, each parsed on its own
+/// (see FasmStreamParser below.)
 ///
 /// For a concrete example, see the test case in ParseFasmTests.cpp
 
@@ -75,81 +97,190 @@ void from_file(const char* path,
                bool hex,
                void (*ret)(const char* str, size_t),
                void (*err)(size_t, size_t, const char*));
+void from_file_streaming(const char* path,
+                         bool hex,
+                         size_t batch_size,
+                         void (*ret)(const char* str, size_t),
+                         void (*err)(size_t, size_t, const char*));
+void from_file_parallel(const char* path,
+                        size_t nthreads,
+                        bool hex,
+                        void (*ret)(const char* str, size_t),
+                        void (*err)(size_t, size_t, const char*));
+void from_buffer_parallel(const char* data,
+                          size_t size,
+                          size_t nthreads,
+                          bool hex,
+                          void (*ret)(const char* str, size_t),
+                          void (*err)(size_t, size_t, const char*));
+
+struct FasmFileStream;
+FasmFileStream* open_file_stream(const char* path,
+                                 bool hex,
+                                 size_t batch_size,
+                                 void (*err)(size_t, size_t, const char*));
+bool next_batch(FasmFileStream* stream,
+                void (*ret)(const char* str, size_t),
+                void (*err)(size_t, size_t, const char*));
+void close_stream(FasmFileStream* stream);
+
+struct FasmContext;
+FasmContext* fasm_context_create(bool hex);
+void fasm_context_destroy(FasmContext* ctx);
+void fasm_context_parse_string(FasmContext* ctx,
+                               const char* in,
+                               void (*ret)(const char* str, size_t),
+                               void (*err)(size_t, size_t, const char*));
+void fasm_context_parse_buffer(FasmContext* ctx,
+                               const char* data,
+                               size_t size,
+                               void (*ret)(const char* str, size_t),
+                               void (*err)(size_t, size_t, const char*));
+void fasm_context_parse_file(FasmContext* ctx,
+                             const char* path,
+                             void (*ret)(const char* str, size_t),
+                             void (*err)(size_t, size_t, const char*));
+
+struct FasmFeedStream;
+FasmFeedStream* open_feed_stream(bool hex, size_t batch_size);
+bool feed_stream(FasmFeedStream* stream,
+                 const char* data,
+                 size_t size,
+                 void (*ret)(const char* str, size_t),
+                 void (*err)(size_t, size_t, const char*));
+bool finish_stream(FasmFeedStream* stream,
+                   void (*ret)(const char* str, size_t),
+                   void (*err)(size_t, size_t, const char*));
+void close_feed_stream(FasmFeedStream* stream);
+
+bool canonical_from_file(const char* path,
+                         size_t nthreads,
+                         int fd,
+                         size_t* count,
+                         void (*err)(size_t, size_t, const char*));
+bool canonical_from_encoded(const char* data,
+                            size_t size,
+                            int fd,
+                            size_t* count,
+                            void (*err)(size_t, size_t, const char*));
 }
 
 using namespace antlr4;
 using namespace antlrcpp;
 
+/// Builds the encoded output in a single growable buffer.
+///
+/// Nested values are written in place: begin() writes the tag and
+/// reserves space for the length, which end() fills in once the
+/// contents have been written. This way, encoding a line doesn't copy
+/// it at each level of nesting, and once the buffer has grown to fit
+/// a line, encoding further lines doesn't allocate.
+///
 /// Hex mode is useful for debugging.
 /// In this mode, binary values are printed as hex values surrounded by < >
-bool hex_mode = false;
-
-/// The Num class provides an << operator that either dumps the raw value
-/// or prints the hex value based on the mode. It also can print a tag.
-class Num {
+/// Numbers are printed as <XX>, so the length of a header isn't known
+/// in advance, and end() inserts it instead. This is slower, but hex mode
+/// is only used for debugging.
+///
+/// The mode is fixed for the lifetime of an Encoder, so parses using
+/// different encoders don't share any state and can run concurrently.
+class Encoder {
        public:
-        /// Constructors, with optional tag character
-        Num(char tag, uint32_t num) : num(num), tag(tag) {}
-        Num(uint32_t num) : num(num), tag(0) {}
+        /// The bit width of a number.
+        static constexpr int kNumWidth = sizeof(uint32_t) * 8;
 
-        uint32_t num;  /// The value
-        char tag;      /// Tag character
+        /// The buffer is reused, so only clear() it between uses.
+        explicit Encoder(bool hex = false) : hex_mode(hex) {}
+        Encoder(const Encoder&) = delete;
+        Encoder& operator=(const Encoder&) = delete;
 
-        /// The bit width
-        static constexpr int kWidth = sizeof(num) * 8;
-};
+        /// Write a number, optionally preceded by a tag.
+        /// Numbers are copied in their underlying representation,
+        /// so this will use the native endianness.
+        void num(uint32_t num) {
+                if (hex_mode) {
+                        char hex[16];
+                        int n = snprintf(hex, sizeof(hex), "<%x>", num);
+                        buffer.append(hex, n);
+                } else {
+                        buffer.append(reinterpret_cast<const char*>(&num),
+                                      sizeof(num));
+                }
+        }
+        void num(char tag, uint32_t value) {
+                buffer.push_back(tag);
+                num(value);
+        }
 
-/// Output stream operator for Num.
-/// In hex mode, Nums are printed as <XX>, otherwise they are
-/// copied into the output stream in the underlying representation.
-/// As such, this will use the native endianness.
-std::ostream& operator<<(std::ostream& s, const Num& num) {
-        if (num.tag)
-                s << num.tag;
-        if (hex_mode) {
-                s << "<" << std::hex << num.num << ">";
-        } else {
-                s.write(reinterpret_cast<const char*>(&num.num),
-                        sizeof(num.num));
+        /// Write a string with its tag and length.
+        /// Note that some characters are escaped in hex mode to
+        /// avoid confusion.
+        void str(char tag, const char* data, size_t size) {
+                num(tag, size);
+                if (hex_mode) {  /// escape < \ >
+                        for (size_t i = 0; i < size; i++) {
+                                char c = data[i];
+                                if (c == '<' || c == '>' || c == '\\') {
+                                        buffer.push_back('\\');
+                                }
+                                buffer.push_back(c);
+                        }
+                } else {
+                        buffer.append(data, size);
+                }
+        }
+        void str(char tag, const std::string& data) {
+                str(tag, data.data(), data.size());
         }
-        return s;
-}
 
-/// The Str class wraps a std::string to provide an << operator
-/// that includes the tag and length.
-struct Str {
-        /// Takes the tag and string data
-        Str(char tag, std::string data) : tag(tag), data(data) {}
+        /// Start a value that aggregates other values under a header.
+        /// Returns a mark to pass to end() or cancel().
+        size_t begin(char tag) {
+                buffer.push_back(tag);
+                size_t mark = buffer.size();
+                if (!hex_mode) {
+                        buffer.append(sizeof(uint32_t), 0);
+                }
+                return mark;
+        }
 
-        char tag;
-        std::string data;
-};
+        /// True if nothing has been written since begin().
+        bool empty(size_t mark) const {
+                return buffer.size() ==
+                       mark + (hex_mode ? 0 : sizeof(uint32_t));
+        }
 
-/// This output stream operator adds the header needed to decode
-/// a string of unknown length and type.
-/// Note that some characters are escaped in hex mode to
-/// avoid confusion.
-std::ostream& operator<<(std::ostream& s, const Str& str) {
-        s << str.tag << Num(str.data.size());
-        if (hex_mode) {  /// escape < \ >
-                for (char c : str.data) {
-                        if (c == '<' || c == '>' || c == '\\') {
-                                s.put('\\');
-                        }
-                        s.put(c);
+        /// Finish a value, filling in the length in its header.
+        void end(size_t mark) {
+                if (hex_mode) {
+                        char hex[16];
+                        int n = snprintf(hex, sizeof(hex), "<%x>",
+                                         uint32_t(buffer.size() - mark));
+                        buffer.insert(mark, hex, n);
+                } else {
+                        uint32_t length =
+                            buffer.size() - mark - sizeof(uint32_t);
+                        memcpy(&buffer[mark], &length, sizeof(length));
                 }
-        } else {
-                s << str.data;
         }
-        return s;
-}
 
-/// Wraps a string in another header, used to aggregate data.
-std::string withHeader(char tag, std::string data) {
-        std::ostringstream header;
-        header << tag << Num(data.size());
-        return header.str() + data;
-}
+        /// Drop a value, including its header.
+        void cancel(size_t mark) { buffer.resize(mark - 1); }
+
+        /// Ends a line in hex mode, for readability.
+        void newline() {
+                if (hex_mode)
+                        buffer.push_back('\n');
+        }
+
+        void clear() { buffer.clear(); }
+        const std::string& data() const { return buffer; }
+        std::string& data() { return buffer; }
+
+       private:
+        const bool hex_mode;
+        std::string buffer;
+};
 
 /// Counts characters that don't match the given character.
 /// Used to count digits skipping '_'.
@@ -171,7 +302,8 @@ int count_without(std::string::iterator start,
 /// so that the rightmost bit will be the LSB of a Num.
 /// e.g. This would be 31 for 33'b0.
 int lead_bits(int bits) {
-        return (Num::kWidth - (bits % Num::kWidth)) % Num::kWidth;
+        return (Encoder::kNumWidth - (bits % Encoder::kNumWidth)) %
+               Encoder::kNumWidth;
 }
 
 // clang-format off
@@ -190,6 +322,26 @@ int from_hex_digit(char c) {
 /// Use at most once per line to allow simple grepping.
 #define TAG(c, long_name) (c)
 
+/// The tag of each kind of TLV value, named by the second argument of TAG.
+/// See FasmParserBaseVisitor below for how each is used.
+namespace tag {
+constexpr char kComment = TAG('#', comment);
+constexpr char kLine = TAG('l', line);
+constexpr char kFeature = TAG('f', feature);
+constexpr char kSetFeature = TAG('s', set_feature);
+constexpr char kAddress = TAG(':', address);
+constexpr char kWidth = TAG('\'', width);
+constexpr char kPlain = TAG('p', plain);
+constexpr char kHex = TAG('h', hex);
+constexpr char kBinary = TAG('b', binary);
+constexpr char kDecimal = TAG('d', decimal);
+constexpr char kOctal = TAG('o', octal);
+constexpr char kAnnotations = TAG('{', annotations);
+constexpr char kAnnotationName = TAG('.', annotation_name);
+constexpr char kAnnotationValue = TAG('=', annotation_value);
+constexpr char kAnnotation = TAG('a', annotation);
+}  // namespace tag
+
 /// Raised on parse errors
 struct ParseException {
         size_t line;          ///< Line number of error.
@@ -197,33 +349,31 @@ struct ParseException {
         std::string message;  ///< A descriptive message.
 };
 
-/// Helper macro to convert a rule context into a string
+/// Helper macro to encode a rule context, if present.
 /// For use inside FasmParserBaseVisitor
-#define GET(x) (context->x() ? visit(context->x()).as<std::string>() : "")
+#define VISIT(x)                     \
+        if (context->x()) {          \
+                visit(context->x()); \
+        }
 
 /// FasmParserBaseVisitor is a visitor for the parse tree
 /// generated by the ANTLR parser.
-/// It will encode the tree a line at a time and stream out of
-/// the given std::ostream
+/// It will encode the tree a line at a time into the given Encoder.
+/// Each visit method writes its encoding directly to the Encoder.
 class FasmParserBaseVisitor : public FasmParserVisitor {
        public:
         static constexpr size_t kHeaderSize = 5;
 
-        /// The constructor requires a std::ostream to stream encoded lines.
+        /// The constructor requires an Encoder to write encoded lines.
         /// This is to avoid storing an entire copy of the parse tree in a
         /// different form.
-        FasmParserBaseVisitor(std::ostream& out) : out(out) {}
+        FasmParserBaseVisitor(Encoder& out) : out(out) {}
 
         /// Stream out FASM lines.
         virtual Any visitFasmFile(
             FasmParser::FasmFileContext* context) override {
                 for (auto& line : context->fasmLine()) {
-                        std::string str = visit(line).as<std::string>();
-                        if (!str.empty()) {
-                                out << str;
-                                if (hex_mode)
-                                        out << std::endl;
-                        }
+                        visit(line);
                 }
                 return {};
         }
@@ -233,20 +383,23 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
         /// Tag: line (l)
         virtual Any visitFasmLine(
             FasmParser::FasmLineContext* context) override {
-                std::ostringstream data;
-                data << GET(setFasmFeature) << GET(annotations);
+                size_t mark = out.begin(tag::kLine);
+                VISIT(setFasmFeature);
+                VISIT(annotations);
 
                 if (context->COMMENT_CAP()) {
                         std::string c = context->COMMENT_CAP()->getText();
-                        c.erase(0, 1);  /// Remove the leading #
-                        data << Str(TAG('#', comment), c);
+                        /// Remove the leading #
+                        out.str(tag::kComment, c.data() + 1, c.size() - 1);
                 }
 
-                if (!data.str().empty()) {
-                        return withHeader(TAG('l', line), data.str());
+                if (!out.empty(mark)) {
+                        out.end(mark);
+                        out.newline();
                 } else {
-                        return std::string();  /// Don't emit empty lines.
+                        out.cancel(mark);  /// Don't emit empty lines.
                 }
+                return {};
         }
 
         /// The set feature portion of a line (before annotations and comment.)
@@ -254,23 +407,26 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
         /// Tag: set feature (s)
         virtual Any visitSetFasmFeature(
             FasmParser::SetFasmFeatureContext* context) override {
-                std::ostringstream data;
-                data << Str(TAG('f', feature), context->FEATURE()->getText())
-                     << GET(featureAddress) << GET(value);
-                return withHeader(TAG('s', set_feature), data.str());
+                size_t mark = out.begin(tag::kSetFeature);
+                out.str(tag::kFeature, context->FEATURE()->getText());
+                VISIT(featureAddress);
+                VISIT(value);
+                out.end(mark);
+                return {};
         }
 
         /// The bracketed address, where the second number is optional.
         /// Tag: address (:)
         virtual Any visitFeatureAddress(
             FasmParser::FeatureAddressContext* context) override {
-                std::ostringstream data;
-                data << Num(std::stoul(context->INT(0)->getText()));
+                size_t mark = out.begin(tag::kAddress);
+                out.num(std::stoul(context->INT(0)->getText()));
 
                 if (context->INT(1)) {
-                        data << Num(std::stoul(context->INT(1)->getText()));
+                        out.num(std::stoul(context->INT(1)->getText()));
                 }
-                return withHeader(TAG(':', address), data.str());
+                out.end(mark);
+                return {};
         }
 
         /// A Verilog style number. It can be "plain" (no leading size and
@@ -278,41 +434,38 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
         /// width (')
         virtual Any visitVerilogValue(
             FasmParser::VerilogValueContext* context) override {
-                std::ostringstream data;
                 if (context->verilogDigits()) {
                         if (context->INT()) {
-                                data << Num(
-                                    TAG('\'', width),
-                                    std::stoi(context->INT()->getText()));
+                                out.num(tag::kWidth,
+                                        std::stoi(context->INT()->getText()));
                         }
-                        data << visit(context->verilogDigits())
-                                    .as<std::string>();
+                        visit(context->verilogDigits());
                 }
-                return data.str();
+                return {};
         }
 
         /// A "plain" decimal value.
         /// Tag: plain (p)
         virtual Any visitPlainDecimal(
             FasmParser::PlainDecimalContext* context) override {
-                std::ostringstream data;
+                uint32_t value;
                 try {
-                        data << Num(TAG('p', plain),
-                                    std::stoi(context->INT()->getText()));
+                        value = std::stoi(context->INT()->getText());
                 } catch (...) {
                         throw ParseException{
                             .line = context->start->getLine(),
                             .position = context->start->getCharPositionInLine(),
                             .message = "Could not decode decimal number."};
                 }
-                return data.str();
+                out.num(tag::kPlain, value);
+                return {};
         }
 
         /// A Verilog hex value.
         /// Tag: hex (h)
         virtual Any visitHexValue(
             FasmParser::HexValueContext* context) override {
-                std::ostringstream data;
+                size_t mark = out.begin(tag::kHex);
                 std::string value = context->HEXADECIMAL_VALUE()->getText();
                 auto it = value.begin();
                 it += 2;  /// skip 'h
@@ -324,8 +477,8 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
                         if (*it != '_') {
                                 word = (word << 4) | from_hex_digit(*it);
                                 bits += 4;
-                                if (bits == Num::kWidth) {
-                                        data << Num(word);
+                                if (bits == Encoder::kNumWidth) {
+                                        out.num(word);
                                         word = 0;
                                         bits = 0;
                                 }
@@ -333,14 +486,15 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
                         it++;
                 }
                 assert(!word);
-                return withHeader(TAG('h', hex), data.str());
+                out.end(mark);
+                return {};
         }
 
         /// A Verilog binary value.
         /// Tag: binary (b)
         virtual Any visitBinaryValue(
             FasmParser::BinaryValueContext* context) override {
-                std::ostringstream data;
+                size_t mark = out.begin(tag::kBinary);
                 std::string value = context->BINARY_VALUE()->getText();
                 auto it = value.begin();
                 it += 2;  /// skip 'b
@@ -352,8 +506,8 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
                         if (*it != '_') {
                                 word = (word << 1) | (*it == '1' ? 1 : 0);
                                 bits += 1;
-                                if (bits == Num::kWidth) {
-                                        data << Num(word);
+                                if (bits == Encoder::kNumWidth) {
+                                        out.num(word);
                                         word = 0;
                                         bits = 0;
                                 }
@@ -361,7 +515,8 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
                         it++;
                 }
                 assert(!word);
-                return withHeader(TAG('b', binary), data.str());
+                out.end(mark);
+                return {};
         }
 
         /// A Verilog decimal value.
@@ -396,16 +551,17 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
                         it++;
                 }
 
-                std::ostringstream data;
-                data << Num(integer);
-                return withHeader(TAG('d', decimal), data.str());
+                size_t mark = out.begin(tag::kDecimal);
+                out.num(integer);
+                out.end(mark);
+                return {};
         }
 
         /// A Verilog octal value.
         /// Tags: octal (o)
         virtual Any visitOctalValue(
             FasmParser::OctalValueContext* context) override {
-                std::ostringstream data;
+                size_t mark = out.begin(tag::kOctal);
                 std::string value = context->OCTAL_VALUE()->getText();
                 auto it = value.begin();
                 it += 2;  /// skip 'b
@@ -420,53 +576,206 @@ class FasmParserBaseVisitor : public FasmParserVisitor {
                         if (*it != '_') {
                                 word = (word << 3) | (*it - '0');
                                 bits += 3;
-                                if (bits >= Num::kWidth) {
-                                        data << Num(word >>
-                                                    (bits - Num::kWidth));
-                                        word >>= Num::kWidth;
-                                        bits -= Num::kWidth;
+                                if (bits >= Encoder::kNumWidth) {
+                                        out.num(word >>
+                                                (bits - Encoder::kNumWidth));
+                                        word >>= Encoder::kNumWidth;
+                                        bits -= Encoder::kNumWidth;
                                 }
                         }
                         it++;
                 }
                 assert(!word);
-                return withHeader(TAG('o', octal), data.str());
+                out.end(mark);
+                return {};
         }
 
         /// A collection of annotations. { ... }
         /// Tags: annotations ({)
         virtual Any visitAnnotations(
             FasmParser::AnnotationsContext* context) override {
-                std::ostringstream data;
+                size_t mark = out.begin(tag::kAnnotations);
                 for (auto& a : context->annotation()) {
-                        data << visit(a).as<std::string>();
+                        visit(a);
                 }
-                return withHeader(TAG('{', annotations), data.str());
+                out.end(mark);
+                return {};
         }
 
         /// An annotation: x = "y"
         /// Tags: annotation (a), annotation name (.), annotation value (=)
         virtual Any visitAnnotation(
             FasmParser::AnnotationContext* context) override {
-                std::ostringstream data;
-                data << Str(TAG('.', annotation_name),
-                            context->ANNOTATION_NAME()->getText());
+                size_t mark = out.begin(tag::kAnnotation);
+                out.str(tag::kAnnotationName,
+                        context->ANNOTATION_NAME()->getText());
                 if (context->ANNOTATION_VALUE()) {
                         std::string value =
                             context->ANNOTATION_VALUE()->getText();
-                        value.erase(0, 1);  /// Convert "value" -> value
-                        value.pop_back();
-                        data << Str(TAG('=', annotation_value), value);
+                        /// Convert "value" -> value
+                        out.str(tag::kAnnotationValue, value.data() + 1,
+                                value.size() - 2);
+                }
+                out.end(mark);
+                return {};
+        }
+
+       private:
+        Encoder& out;
+};
+
+// Prevent use of the VISIT macro outside FasmParseBaseVisitor
+#undef VISIT
+
+/// A read-only view of a whole file, mapped into memory.
+/// This avoids copying the file, and lets the OS page it in as needed.
+class MappedFile {
+       public:
+        explicit MappedFile(const char* path) {
+#ifdef _WIN32
+                file = CreateFileA(path, GENERIC_READ, FILE_SHARE_READ, nullptr,
+                                   OPEN_EXISTING, FILE_FLAG_SEQUENTIAL_SCAN,
+                                   nullptr);
+                LARGE_INTEGER file_size;
+                if (file == INVALID_HANDLE_VALUE ||
+                    !GetFileSizeEx(file, &file_size)) {
+                        return;
+                }
+                length = file_size.QuadPart;
+                if (length > 0) {
+                        mapping = CreateFileMappingA(
+                            file, nullptr, PAGE_READONLY, 0, 0, nullptr);
+                        if (!mapping) {
+                                return;
+                        }
+                        bytes = static_cast<const char*>(
+                            MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0));
+                        if (!bytes) {
+                                return;
+                        }
+                }
+#else
+                int fd = ::open(path, O_RDONLY);
+                if (fd < 0) {
+                        return;
+                }
+                struct stat st;
+                if (fstat(fd, &st) != 0) {
+                        ::close(fd);
+                        return;
+                }
+                length = st.st_size;
+                if (length > 0) {
+                        void* p = mmap(nullptr, length, PROT_READ, MAP_PRIVATE,
+                                       fd, 0);
+                        ::close(fd);
+                        if (p == MAP_FAILED) {
+                                return;
+                        }
+                        madvise(p, length, MADV_SEQUENTIAL);
+                        bytes = static_cast<const char*>(p);
+                } else {
+                        ::close(fd);
+                }
+#endif
+                opened = true;
+        }
+
+        ~MappedFile() {
+#ifdef _WIN32
+                if (bytes) {
+                        UnmapViewOfFile(bytes);
                 }
-                return withHeader(TAG('a', annotation), data.str());
+                if (mapping) {
+                        CloseHandle(mapping);
+                }
+                if (file != INVALID_HANDLE_VALUE) {
+                        CloseHandle(file);
+                }
+#else
+                if (bytes) {
+                        munmap(const_cast<char*>(bytes), length);
+                }
+#endif
         }
 
+        MappedFile(const MappedFile&) = delete;
+        MappedFile& operator=(const MappedFile&) = delete;
+
+        /// False if the file couldn't be opened or mapped.
+        bool is_open() const { return opened; }
+
+        const char* data() const { return bytes; }
+        size_t size() const { return length; }
+
        private:
-        std::ostream& out;
+        const char* bytes = nullptr;
+        size_t length = 0;
+        bool opened = false;
+#ifdef _WIN32
+        HANDLE file = INVALID_HANDLE_VALUE;
+        HANDLE mapping = nullptr;
+#endif
 };
 
-// Prevent use of the GET macro outside FasmParseBaseVisitor
-#undef GET
+/// A CharStream that reads bytes in place, e.g. from a MappedFile.
+/// ANTLRInputStream instead copies its input into a buffer of 32 bit
+/// code points. FASM is ASCII, so each byte can be used as a code point.
+class MemoryCharStream : public CharStream {
+       public:
+        MemoryCharStream(const char* data, size_t size)
+            : bytes(data), length(size) {}
+
+        virtual void consume() override {
+                if (position >= length) {
+                        throw IllegalStateException("cannot consume EOF");
+                }
+                position++;
+        }
+
+        virtual size_t LA(ssize_t i) override {
+                if (i == 0) {
+                        return 0;  // undefined
+                }
+                ssize_t index = position + (i < 0 ? i : i - 1);
+                if (index < 0 || size_t(index) >= length) {
+                        return IntStream::EOF;
+                }
+                return static_cast<unsigned char>(bytes[index]);
+        }
+
+        /// The whole input is always available, so marks are not needed.
+        virtual ssize_t mark() override { return -1; }
+        virtual void release(ssize_t marker) override {}
+
+        virtual size_t index() override { return position; }
+        virtual void seek(size_t index) override {
+                position = std::min(index, length);
+        }
+        virtual size_t size() override { return length; }
+
+        virtual std::string getSourceName() const override {
+                return IntStream::UNKNOWN_SOURCE_NAME;
+        }
+
+        virtual std::string getText(const misc::Interval& interval) override {
+                if (interval.a < 0 || interval.b < 0 ||
+                    size_t(interval.a) >= length) {
+                        return "";
+                }
+                size_t stop = std::min(size_t(interval.b), length - 1);
+                return std::string(bytes + interval.a, stop - interval.a + 1);
+        }
+
+        virtual std::string toString() const override {
+                return std::string(bytes, length);
+        }
+
+       private:
+        const char* bytes;
+        size_t length;
+        size_t position = 0;
+};
 
 class FasmErrorListener : public BaseErrorListener {
        public:
@@ -482,11 +791,14 @@ class FasmErrorListener : public BaseErrorListener {
         }
 };
 
-/// Common portion of 'from_string' and 'from_file'.
-/// Consumes an input stream and produces an output stream.
-static void parse_fasm(std::istream& in, std::ostream& out) {
-        ANTLRInputStream stream(in);
+/// Consumes a character stream and encodes it into out.
+/// Line numbers in errors are counted from first_line, which allows
+/// parsing a portion of a larger input.
+static void parse_fasm(CharStream& stream,
+                       Encoder& out,
+                       size_t first_line = 1) {
         FasmLexer lexer(&stream);
+        lexer.setLine(first_line);
         FasmErrorListener errorListener;
         lexer.removeErrorListeners();
         lexer.addErrorListener(&errorListener);
@@ -498,22 +810,679 @@ static void parse_fasm(std::istream& in, std::ostream& out) {
         FasmParserBaseVisitor(out).visit(tree);
 }
 
+/// Tracks just enough of the lexer state to find the newlines that
+/// end a FASM line. A newline inside a quoted annotation value does
+/// not end the line, so it is not safe to split the input there.
+class LineSplitter {
+       public:
+        /// Consume one character.
+        /// Returns true if the character ends a line.
+        bool consume(char c) {
+                switch (state) {
+                        case State::kDefault:
+                                if (c == '#') {
+                                        state = State::kComment;
+                                } else if (c == '{') {
+                                        state = State::kAnnotation;
+                                }
+                                return c == '\n';
+                        case State::kComment:
+                                if (c == '\n' || c == '\r') {
+                                        state = State::kDefault;
+                                }
+                                return c == '\n';
+                        case State::kAnnotation:
+                                if (c == '"') {
+                                        state = State::kString;
+                                } else if (c == '}') {
+                                        state = State::kDefault;
+                                }
+                                return false;
+                        case State::kString:
+                                if (c == '\\') {
+                                        state = State::kEscape;
+                                } else if (c == '"') {
+                                        state = State::kAnnotation;
+                                }
+                                return false;
+                        case State::kEscape:
+                                state = State::kString;
+                                return false;
+                }
+                return false;
+        }
+
+       private:
+        enum class State { kDefault, kComment, kAnnotation, kString, kEscape };
+        State state = State::kDefault;
+};
+
+/// Recognizes the most common kind of line, which only sets a feature,
+/// optionally with an address, e.g. TILE.SITE.FEATURE or FEATURE[n].
+/// These can be encoded directly, without the overhead of ANTLR.
+struct SimpleLine {
+        /// Scan the line [begin, end), which includes any line ending.
+        /// Returns true if the line is simple, or blank.
+        /// Otherwise it must be parsed by ANTLR.
+        bool scan(const char* begin, const char* end) {
+                const char* p = skip_space(begin, end);
+                feature_begin = feature_end = p;
+                address_count = 0;
+                if (p == end || *p == '\r' || *p == '\n') {
+                        return is_line_end(p, end);  /// Blank line
+                }
+
+                /// FEATURE : IDENTIFIER ('.' IDENTIFIER)*
+                /// IDENTIFIER : [a-zA-Z] [0-9a-zA-Z_]*
+                while (true) {
+                        if (p == end || !is_letter(*p)) {
+                                return false;
+                        }
+                        while (p != end &&
+                               (is_letter(*p) || is_digit(*p) || *p == '_')) {
+                                p++;
+                        }
+                        if (p == end || *p != '.') {
+                                break;
+                        }
+                        p++;
+                }
+                feature_end = p;
+
+                /// featureAddress : '[' INT (':' INT)? ']'
+                if (p != end && *p == '[') {
+                        p = scan_int(p + 1, end, &address[address_count++]);
+                        if (p != end && *p == ':') {
+                                p = scan_int(p + 1, end,
+                                             &address[address_count++]);
+                        }
+                        if (p == end || *p != ']') {
+                                return false;
+                        }
+                        p++;
+                }
+
+                return is_line_end(skip_space(p, end), end);
+        }
+
+        /// True if there is a feature to encode.
+        bool has_feature() const { return feature_begin != feature_end; }
+
+        /// Encode the line the same way as FasmParserBaseVisitor.
+        void encode(Encoder& out) const {
+                size_t line_mark = out.begin(tag::kLine);
+                size_t set_feature_mark = out.begin(tag::kSetFeature);
+                out.str(tag::kFeature, feature_begin,
+                        feature_end - feature_begin);
+                if (address_count) {
+                        size_t address_mark = out.begin(tag::kAddress);
+                        for (size_t i = 0; i < address_count; i++) {
+                                out.num(address[i]);
+                        }
+                        out.end(address_mark);
+                }
+                out.end(set_feature_mark);
+                out.end(line_mark);
+                out.newline();
+        }
+
+        const char* feature_begin;
+        const char* feature_end;
+        uint32_t address[2];
+        size_t address_count;
+
+       private:
+        static bool is_letter(char c) {
+                return (c >= 'a' && c <= 'z') || (c >= 'A' && c <= 'Z');
+        }
+
+        static bool is_digit(char c) { return c >= '0' && c <= '9'; }
+
+        static const char* skip_space(const char* p, const char* end) {
+                while (p != end && (*p == ' ' || *p == '\t')) {
+                        p++;
+                }
+                return p;
+        }
+
+        /// Only the end of the input, or line endings, can remain.
+        static bool is_line_end(const char* p, const char* end) {
+                while (p != end && *p == '\r') {
+                        p++;
+                }
+                return p == end || (*p == '\n' && p + 1 == end);
+        }
+
+        /// Scan an INT. Numbers that might not fit in a Num are left for
+        /// ANTLR, by returning a position that fails to match.
+        static const char* scan_int(const char* p,
+                                    const char* end,
+                                    uint32_t* value) {
+                const char* start = p;
+                *value = 0;
+                while (p != end && is_digit(*p)) {
+                        *value = *value * 10 + (*p - '0');
+                        p++;
+                }
+                if (p == start || p - start > 9) {
+                        return end;
+                }
+                return p;
+        }
+};
+
+/// Parse data[0, size), encoding it into out.
+/// Simple lines (see SimpleLine) are encoded directly, while runs of
+/// other lines are parsed by ANTLR. The output is the same as parsing
+/// everything with ANTLR. Line numbers in errors start at first_line.
+static void parse_fasm_lines(const char* data,
+                             size_t size,
+                             Encoder& out,
+                             size_t first_line = 1) {
+        LineSplitter splitter;
+        SimpleLine simple;
+        size_t line = first_line;
+
+        /// The run of lines waiting to be parsed by ANTLR.
+        const char* run = nullptr;
+        size_t run_line = 0;
+        auto parse_run = [&](const char* run_end) {
+                if (run) {
+                        MemoryCharStream stream(run, run_end - run);
+                        parse_fasm(stream, out, run_line);
+                        run = nullptr;
+                }
+        };
+
+        const char* end = data + size;
+        const char* p = data;
+        while (p != end) {
+                const char* line_begin = p;
+                size_t newlines = 0;
+                while (p != end) {
+                        char c = *p++;
+                        newlines += c == '\n';
+                        if (splitter.consume(c)) {
+                                break;
+                        }
+                }
+
+                if (simple.scan(line_begin, p)) {
+                        /// Blank lines can stay in a run to keep it long.
+                        if (simple.has_feature()) {
+                                parse_run(line_begin);
+                                simple.encode(out);
+                        }
+                } else if (!run) {
+                        run = line_begin;
+                        run_line = line;
+                }
+                line += newlines;
+        }
+        parse_run(end);
+}
+
+/// Common portion of 'from_string' and 'from_file'.
+/// Consumes an input stream and produces an output stream.
+static void parse_fasm(std::istream& in, Encoder& out) {
+        std::string data((std::istreambuf_iterator<char>(in)),
+                         std::istreambuf_iterator<char>());
+        parse_fasm_lines(data.data(), data.size(), out);
+}
+
+/// Consumes an input stream and produces an output stream.
+/// Use hex mode (see Encoder) if hex is true.
+static void parse_fasm(std::istream& in, std::ostream& out, bool hex = false) {
+        Encoder encoder(hex);
+        parse_fasm(in, encoder);
+        out << encoder.data();
+}
+
+/// Parses FASM incrementally, in batches of whole lines.
+///
+/// Input is fed in arbitrary pieces. Once at least batch_size bytes of
+/// complete lines are available, they are parsed and the encoded batch
+/// is passed to the emit callback, followed by a null byte like the
+/// output of from_string. Only the unparsed tail of the input and the
+/// current batch are held in memory, regardless of the input size,
+/// and the buffers holding them are reused from batch to batch.
+class FasmStreamParser {
+       public:
+        static constexpr size_t kDefaultBatchSize = 1 << 20;
+
+        using Emit = std::function<void(const std::string&)>;
+
+        FasmStreamParser(size_t batch_size, Emit emit, bool hex = false)
+            : batch_size(batch_size ? batch_size : kDefaultBatchSize),
+              emit(emit),
+              output(hex) {}
+
+        /// Add input, emitting any batches that are complete.
+        /// Throws ParseException on a parse error.
+        void feed(const char* data, size_t size) {
+                pending.append(data, size);
+                size_t start = 0;
+                for (; scanned < pending.size(); scanned++) {
+                        if (splitter.consume(pending[scanned]) &&
+                            scanned + 1 - start >= batch_size) {
+                                parse_batch(start, scanned + 1);
+                                start = scanned + 1;
+                        }
+                }
+                pending.erase(0, start);
+                scanned -= start;
+        }
+
+        /// Parse any remaining input, which may lack a final newline.
+        /// Throws ParseException on a parse error.
+        void finish() {
+                if (!pending.empty()) {
+                        parse_batch(0, pending.size());
+                }
+                pending.clear();
+                scanned = 0;
+        }
+
+       private:
+        /// Parse and emit pending[start, end), which holds whole lines.
+        void parse_batch(size_t start, size_t end) {
+                output.clear();
+                parse_fasm_lines(pending.data() + start, end - start, output,
+                                 line);
+                output.data().push_back(0);
+                emit(output.data());
+                line += std::count(pending.begin() + start,
+                                   pending.begin() + end, '\n');
+        }
+
+        size_t batch_size;
+        Emit emit;
+        LineSplitter splitter;
+        Encoder output;       ///< The batch being encoded.
+        std::string pending;  ///< Input that has not been parsed yet.
+        size_t scanned = 0;   ///< How much of pending has been split.
+        size_t line = 1;      ///< Line number of the start of pending.
+};
+
+/// Parse data[0, size) using up to nthreads threads, appending the
+/// output to out. The input is split into chunks of whole lines, which
+/// are parsed independently and joined in order.
+/// If there are errors, the one earliest in the input is thrown as a
+/// ParseException.
+/// Use hex mode (see Encoder) if hex is true.
+static void parse_fasm_parallel(const char* data,
+                                size_t size,
+                                size_t nthreads,
+                                std::string& out,
+                                bool hex = false) {
+        if (nthreads == 0) {
+                nthreads = std::max(1u, std::thread::hardware_concurrency());
+        }
+
+        /// Use a few chunks per thread to balance the load.
+        size_t nchunks = nthreads * 4;
+
+        struct Chunk {
+                size_t start;  ///< Offset of the chunk in data.
+                size_t size;   ///< Size of the chunk.
+                size_t line;   ///< Line number of the start of the chunk.
+                std::string output;
+                std::optional<ParseException> error;
+        };
+        std::vector<Chunk> chunks;
+
+        /// Split the input into chunks of about size / nchunks bytes.
+        /// Finding line ends requires a serial pass, but it is much
+        /// cheaper than parsing.
+        LineSplitter splitter;
+        size_t start = 0;
+        size_t line = 1;
+        size_t lines_in_chunk = 0;
+        size_t target = std::max<size_t>(1, size / nchunks);
+        for (size_t i = 0; i < size; i++) {
+                if (data[i] == '\n') {
+                        lines_in_chunk++;
+                }
+                if (splitter.consume(data[i]) && i + 1 - start >= target) {
+                        chunks.push_back({start, i + 1 - start, line});
+                        start = i + 1;
+                        line += lines_in_chunk;
+                        lines_in_chunk = 0;
+                }
+        }
+        if (start < size || chunks.empty()) {
+                chunks.push_back({start, size - start, line});
+        }
+
+        /// Threads take the next unparsed chunk until none are left.
+        std::atomic<size_t> next_chunk(0);
+        auto worker = [&]() {
+                for (size_t i = next_chunk++; i < chunks.size();
+                     i = next_chunk++) {
+                        Chunk& chunk = chunks[i];
+                        try {
+                                Encoder output(hex);
+                                parse_fasm_lines(data + chunk.start, chunk.size,
+                                                 output, chunk.line);
+                                chunk.output = std::move(output.data());
+                        } catch (ParseException e) {
+                                chunk.error = e;
+                        }
+                }
+        };
+        std::vector<std::thread> threads;
+        for (size_t i = 1; i < std::min(nthreads, chunks.size()); i++) {
+                threads.emplace_back(worker);
+        }
+        worker();
+        for (auto& thread : threads) {
+                thread.join();
+        }
+
+        size_t total = 0;
+        for (auto& chunk : chunks) {
+                if (chunk.error) {
+                        throw *chunk.error;
+                }
+                total += chunk.output.size();
+        }
+        out.reserve(out.size() + total);
+        for (auto& chunk : chunks) {
+                out += chunk.output;
+                std::string().swap(chunk.output);
+        }
+}
+
+/// Writes size bytes from data to the file descriptor fd.
+/// Returns false on an error.
+static bool write_fd(int fd, const char* data, size_t size) {
+        while (size > 0) {
+#ifdef _WIN32
+                int n = _write(
+                    fd, data,
+                    static_cast<unsigned>(std::min<size_t>(size, 1 << 30)));
+#else
+                ssize_t n = ::write(fd, data, size);
+                if (n < 0 && errno == EINTR) {
+                        continue;
+                }
+#endif
+                if (n <= 0) {
+                        return false;
+                }
+                data += n;
+                size -= n;
+        }
+        return true;
+}
+
+/// Expands encoded lines into the canonical form of FASM, where each
+/// line sets a single bit. Addressed values are split into one line per
+/// set bit, bits that are not set are dropped, and address 0 is omitted.
+/// The lines are sorted and deduplicated when written, which gives the
+/// same output as fasm_tuple_to_string(..., canonical=True) in Python.
+class CanonicalLines {
+       public:
+        /// Add the lines encoded in data[0, size), the output of an
+        /// Encoder that is not in hex mode, optionally followed by a null
+        /// byte. Throws ParseException for values that don't fit the
+        /// canonical form, like the assertions in Python.
+        void add(const char* data, size_t size) {
+                const char* end = data + size;
+                while (data + kHeaderSize <= end && *data == tag::kLine) {
+                        const char* line_end = contents_end(data);
+                        for (const char* p = data + kHeaderSize; p < line_end;
+                             p = next(p)) {
+                                if (*p == tag::kSetFeature) {
+                                        add_set_feature(p + kHeaderSize,
+                                                        contents_end(p));
+                                }
+                        }
+                        data = line_end;
+                }
+        }
+
+        /// Sort and deduplicate the lines, and write each followed by a
+        /// newline to fd. Returns false on a write error.
+        bool write(int fd) {
+                std::sort(lines.begin(), lines.end());
+                lines.erase(std::unique(lines.begin(), lines.end()),
+                            lines.end());
+
+                std::string buffer;
+                for (const auto& line : lines) {
+                        buffer += line;
+                        buffer.push_back('\n');
+                        if (buffer.size() >= kWriteSize) {
+                                if (!write_fd(fd, buffer.data(),
+                                              buffer.size())) {
+                                        return false;
+                                }
+                                buffer.clear();
+                        }
+                }
+                return write_fd(fd, buffer.data(), buffer.size());
+        }
+
+        /// The number of lines, which are distinct after write.
+        size_t size() const { return lines.size(); }
+
+       private:
+        static constexpr size_t kHeaderSize = 5;
+        static constexpr size_t kWriteSize = 1 << 16;
+
+        static uint32_t read_u32(const char* p) {
+                uint32_t value;
+                memcpy(&value, p, sizeof(value));
+                return value;
+        }
+
+        /// The end of the contents of the value with a header at p.
+        static const char* contents_end(const char* p) {
+                return p + kHeaderSize + read_u32(p + 1);
+        }
+
+        /// The value following the one at p.
+        /// Plain values and widths are stored in the header.
+        static const char* next(const char* p) {
+                if (*p == tag::kPlain || *p == tag::kWidth) {
+                        return p + kHeaderSize;
+                }
+                return contents_end(p);
+        }
+
+        /// The index of the lowest set bit of a non-zero word.
+        static int lowest_bit(uint32_t word) {
+#ifdef _MSC_VER
+                unsigned long index;
+                _BitScanForward(&index, word);
+                return index;
+#else
+                return __builtin_ctz(word);
+#endif
+        }
+
+        /// The index of the highest set bit of a non-zero word.
+        static int highest_bit(uint32_t word) {
+#ifdef _MSC_VER
+                unsigned long index;
+                _BitScanReverse(&index, word);
+                return index;
+#else
+                return 31 - __builtin_clz(word);
+#endif
+        }
+
+        static ParseException error(std::string_view feature,
+                                    const char* message) {
+                return ParseException{
+                    .line = 0,
+                    .position = 0,
+                    .message = std::string(feature) + message};
+        }
+
+        /// Add the lines of a set feature, with contents [p, end).
+        void add_set_feature(const char* p, const char* end) {
+                std::string_view feature;
+                uint32_t address[2] = {0, 0};
+                size_t address_count = 0;
+                uint32_t declared_width = 0;  ///< 0 if not declared.
+                const char* words = nullptr;  ///< Most significant first.
+                size_t nwords = 0;
+
+                for (; p < end; p = next(p)) {
+                        switch (*p) {
+                                case tag::kFeature:
+                                        feature = std::string_view(
+                                            p + kHeaderSize, read_u32(p + 1));
+                                        break;
+                                case tag::kAddress:
+                                        address_count = std::min<size_t>(
+                                            read_u32(p + 1) / sizeof(uint32_t),
+                                            2);
+                                        for (size_t i = 0; i < address_count;
+                                             i++) {
+                                                address[i] = read_u32(
+                                                    p + kHeaderSize +
+                                                    i * sizeof(uint32_t));
+                                        }
+                                        break;
+                                case tag::kWidth:
+                                        declared_width = read_u32(p + 1);
+                                        break;
+                                case tag::kPlain:
+                                        words = p + 1;
+                                        nwords = 1;
+                                        break;
+                                case tag::kHex:
+                                case tag::kBinary:
+                                case tag::kDecimal:
+                                case tag::kOctal:
+                                        words = p + kHeaderSize;
+                                        nwords =
+                                            read_u32(p + 1) / sizeof(uint32_t);
+                                        break;
+                        }
+                }
+
+                /// Without a value, the feature is set to 1.
+                char one[sizeof(uint32_t)];
+                if (!words) {
+                        uint32_t value = 1;
+                        memcpy(one, &value, sizeof(value));
+                        words = one;
+                        nwords = 1;
+                }
+
+                /// The number of significant bits of the value.
+                uint64_t bits = 0;
+                for (size_t i = 0; i < nwords; i++) {
+                        uint32_t word = read_u32(words + i * sizeof(uint32_t));
+                        if (word) {
+                                bits = uint64_t(nwords - 1 - i) * 32 +
+                                       highest_bit(word) + 1;
+                                break;
+                        }
+                }
+                if (bits == 0) {
+                        return;
+                }
+
+                if (declared_width && bits > declared_width) {
+                        throw error(feature,
+                                    " has a value wider than its declared "
+                                    "width.");
+                }
+
+                /// [end:start], or a single bit.
+                uint64_t start = address[address_count < 2 ? 0 : 1];
+                uint64_t width = 1;
+                if (address_count == 2) {
+                        if (address[0] < start) {
+                                throw error(feature,
+                                            " has a reversed address range.");
+                        }
+                        width = uint64_t(address[0]) - start + 1;
+                }
+                if (bits > width) {
+                        throw error(feature,
+                                    " has a value wider than its address.");
+                }
+
+                /// Walk the set bits, from the least significant word.
+                for (size_t i = 0; i < nwords; i++) {
+                        uint64_t base = uint64_t(i) * 32;
+                        uint32_t word = read_u32(words + (nwords - 1 - i) *
+                                                             sizeof(uint32_t));
+                        for (; word; word &= word - 1) {
+                                add_line(feature,
+                                         start + base + lowest_bit(word));
+                        }
+                }
+        }
+
+        /// Add feature[address], or just feature if address is 0.
+        void add_line(std::string_view feature, uint64_t address) {
+                std::string line(feature);
+                if (address != 0) {
+                        line.push_back('[');
+                        line += std::to_string(address);
+                        line.push_back(']');
+                }
+                lines.push_back(std::move(line));
+        }
+
+        std::vector<std::string> lines;
+};
+
+/// The state of a series of parses with the same options.
+///
+/// Nothing is shared between contexts, so parses using different
+/// contexts can run concurrently on different threads. A context
+/// must only be used by one thread at a time, since it reuses its
+/// output buffer from parse to parse.
+struct FasmContext {
+        explicit FasmContext(bool hex) : output(hex) {}
+
+        Encoder output;
+};
+
+/// Create a parse context.
+/// Use hex mode (see Encoder) if hex is true.
+/// The result must be released with fasm_context_destroy.
+FasmContext* fasm_context_create(bool hex) {
+        return new FasmContext(hex);
+}
+
+/// Release a context returned by fasm_context_create.
+void fasm_context_destroy(FasmContext* ctx) {
+        delete ctx;
+}
+
 /// Parse the given input string, returning output.
-/// Use hex mode (see above) if hex is true.
 /// Use a callback to avoid copying the result.
-void from_string(const char* in,
-                 bool hex,
-                 void (*ret)(const char* str, size_t),
-                 void (*err)(size_t, size_t, const char*)) {
-        hex_mode = hex;
-        std::istringstream input(in);
-        std::ostringstream output;
+void fasm_context_parse_string(FasmContext* ctx,
+                               const char* in,
+                               void (*ret)(const char* str, size_t),
+                               void (*err)(size_t, size_t, const char*)) {
+        fasm_context_parse_buffer(ctx, in, strlen(in), ret, err);
+}
+
+/// Parse the size bytes of input at data, which need not be null
+/// terminated, returning output.
+/// Use a callback to avoid copying the result.
+void fasm_context_parse_buffer(FasmContext* ctx,
+                               const char* data,
+                               size_t size,
+                               void (*ret)(const char* str, size_t),
+                               void (*err)(size_t, size_t, const char*)) {
+        Encoder& output = ctx->output;
+        output.clear();
 
         try {
-                parse_fasm(input, output);
-                output.put(0);
-                std::string result = output.str();
-                ret(result.c_str(), result.size());
+                parse_fasm_lines(data, size, output);
+                output.data().push_back(0);
+                ret(output.data().c_str(), output.data().size());
         } catch (ParseException e) {
                 // Parse failure will throw this exception.
                 err(e.line, e.position, e.message.c_str());
@@ -521,21 +1490,19 @@ void from_string(const char* in,
 }
 
 /// Parse the given input file, returning output.
-/// Use hex mode (see above) if hex is true.
 /// Use a callback to avoid copying the result.
-void from_file(const char* path,
-               bool hex,
-               void (*ret)(const char* str, size_t),
-               void (*err)(size_t, size_t, const char*)) {
-        hex_mode = hex;
-        std::fstream input(std::string(path), input.in);
-        std::ostringstream output;
+void fasm_context_parse_file(FasmContext* ctx,
+                             const char* path,
+                             void (*ret)(const char* str, size_t),
+                             void (*err)(size_t, size_t, const char*)) {
+        MappedFile input(path);
+        Encoder& output = ctx->output;
+        output.clear();
         if (input.is_open()) {
                 try {
-                        parse_fasm(input, output);
-                        output.put(0);
-                        std::string result = output.str();
-                        ret(result.c_str(), result.size());
+                        parse_fasm_lines(input.data(), input.size(), output);
+                        output.data().push_back(0);
+                        ret(output.data().c_str(), output.data().size());
                 } catch (ParseException e) {
                         // Parse failure will throw this exception.
                         err(e.line, e.position, e.message.c_str());
@@ -544,3 +1511,295 @@ void from_file(const char* path,
                 err(0, 0, "Couldn't open file");
         }
 }
+
+/// Parse the given input string, returning output.
+/// Use hex mode (see Encoder) if hex is true.
+/// Use a callback to avoid copying the result.
+void from_string(const char* in,
+                 bool hex,
+                 void (*ret)(const char* str, size_t),
+                 void (*err)(size_t, size_t, const char*)) {
+        FasmContext ctx(hex);
+        fasm_context_parse_string(&ctx, in, ret, err);
+}
+
+/// Parse the given input file, returning output.
+/// Use hex mode (see Encoder) if hex is true.
+/// Use a callback to avoid copying the result.
+void from_file(const char* path,
+               bool hex,
+               void (*ret)(const char* str, size_t),
+               void (*err)(size_t, size_t, const char*)) {
+        FasmContext ctx(hex);
+        fasm_context_parse_file(&ctx, path, ret, err);
+}
+
+/// Parse the given input file in batches of about batch_size bytes,
+/// calling ret once per encoded batch, each terminated by a null byte.
+/// A batch_size of 0 selects a default size.
+/// Memory use is bounded by the batch size rather than the file size.
+/// Use hex mode (see Encoder) if hex is true.
+void from_file_streaming(const char* path,
+                         bool hex,
+                         size_t batch_size,
+                         void (*ret)(const char* str, size_t),
+                         void (*err)(size_t, size_t, const char*)) {
+        std::fstream input(std::string(path), input.in);
+        if (!input.is_open()) {
+                err(0, 0, "Couldn't open file");
+                return;
+        }
+
+        FasmStreamParser parser(
+            batch_size,
+            [&](const std::string& batch) { ret(batch.c_str(), batch.size()); },
+            hex);
+        std::vector<char> buffer(1 << 16);
+        try {
+                while (input) {
+                        input.read(buffer.data(), buffer.size());
+                        parser.feed(buffer.data(), input.gcount());
+                }
+                parser.finish();
+        } catch (ParseException e) {
+                // Parse failure will throw this exception.
+                err(e.line, e.position, e.message.c_str());
+        }
+}
+
+/// Parse the given input file using nthreads threads, or one per
+/// core if nthreads is 0, returning the output through a single call
+/// to ret. The output is the same as from_file.
+/// Use hex mode (see Encoder) if hex is true.
+void from_file_parallel(const char* path,
+                        size_t nthreads,
+                        bool hex,
+                        void (*ret)(const char* str, size_t),
+                        void (*err)(size_t, size_t, const char*)) {
+        MappedFile input(path);
+        if (!input.is_open()) {
+                err(0, 0, "Couldn't open file");
+                return;
+        }
+
+        from_buffer_parallel(input.data(), input.size(), nthreads, hex, ret,
+                             err);
+}
+
+/// Parse the size bytes of FASM at data, as from_file_parallel does for
+/// a file.
+void from_buffer_parallel(const char* data,
+                          size_t size,
+                          size_t nthreads,
+                          bool hex,
+                          void (*ret)(const char* str, size_t),
+                          void (*err)(size_t, size_t, const char*)) {
+        try {
+                std::string result;
+                parse_fasm_parallel(data, size, nthreads, result, hex);
+                result.push_back(0);
+                ret(result.c_str(), result.size());
+        } catch (ParseException e) {
+                // Parse failure will throw this exception.
+                err(e.line, e.position, e.message.c_str());
+        }
+}
+
+/// A file being parsed a batch at a time, for consumers that pull
+/// batches on demand instead of receiving them all through a callback.
+/// Stopping early avoids parsing the rest of the file.
+struct FasmFileStream {
+        FasmFileStream(const char* path, bool hex, size_t batch_size)
+            : input(std::string(path), input.in),
+              parser(
+                  batch_size,
+                  [this](const std::string& batch) {
+                          batches.push_back(batch);
+                  },
+                  hex) {}
+
+        /// Read and parse until at least one batch is available,
+        /// or the input is exhausted.
+        /// Throws ParseException on a parse error.
+        void fill() {
+                std::vector<char> buffer(1 << 16);
+                while (batches.empty() && !finished) {
+                        if (input) {
+                                input.read(buffer.data(), buffer.size());
+                                parser.feed(buffer.data(), input.gcount());
+                        } else {
+                                parser.finish();
+                                finished = true;
+                        }
+                }
+        }
+
+        std::fstream input;
+        FasmStreamParser parser;
+        std::deque<std::string> batches;  ///< Parsed, but not returned.
+        bool finished = false;
+};
+
+/// Open the given input file for parsing a batch at a time with
+/// next_batch. Returns null, after calling err, if the file can't be
+/// opened. The result must be released with close_stream.
+/// Use hex mode (see Encoder) if hex is true.
+FasmFileStream* open_file_stream(const char* path,
+                                 bool hex,
+                                 size_t batch_size,
+                                 void (*err)(size_t, size_t, const char*)) {
+        auto stream = std::make_unique<FasmFileStream>(path, hex, batch_size);
+        if (!stream->input.is_open()) {
+                err(0, 0, "Couldn't open file");
+                return nullptr;
+        }
+        return stream.release();
+}
+
+/// Parse the next batch of the stream, passing it to ret.
+/// Returns true if ret was called, or false at the end of the input
+/// or after calling err on a parse error.
+bool next_batch(FasmFileStream* stream,
+                void (*ret)(const char* str, size_t),
+                void (*err)(size_t, size_t, const char*)) {
+        try {
+                stream->fill();
+        } catch (ParseException e) {
+                // Parse failure will throw this exception.
+                err(e.line, e.position, e.message.c_str());
+                return false;
+        }
+        if (stream->batches.empty()) {
+                return false;
+        }
+        std::string batch = std::move(stream->batches.front());
+        stream->batches.pop_front();
+        ret(batch.c_str(), batch.size());
+        return true;
+}
+
+/// Release a stream returned by open_file_stream.
+void close_stream(FasmFileStream* stream) {
+        delete stream;
+}
+
+/// Input pushed by the caller a piece at a time, e.g. as it is read
+/// from a pipe, and parsed in batches as whole lines become available.
+struct FasmFeedStream {
+        FasmFeedStream(bool hex, size_t batch_size)
+            : parser(
+                  batch_size,
+                  [this](const std::string& batch) {
+                          ret(batch.c_str(), batch.size());
+                  },
+                  hex) {}
+
+        FasmStreamParser parser;
+        void (*ret)(const char* str, size_t) = nullptr;  ///< Current call.
+};
+
+/// Create a stream to push input into with feed_stream.
+/// A batch_size of 0 selects a default size.
+/// Use hex mode (see Encoder) if hex is true.
+/// The result must be released with close_feed_stream.
+FasmFeedStream* open_feed_stream(bool hex, size_t batch_size) {
+        return new FasmFeedStream(hex, batch_size);
+}
+
+/// Add the size bytes at data to the input of the stream, calling ret
+/// with each batch that is complete, terminated by a null byte.
+/// Returns false after calling err on a parse error.
+bool feed_stream(FasmFeedStream* stream,
+                 const char* data,
+                 size_t size,
+                 void (*ret)(const char* str, size_t),
+                 void (*err)(size_t, size_t, const char*)) {
+        stream->ret = ret;
+        try {
+                stream->parser.feed(data, size);
+        } catch (ParseException e) {
+                // Parse failure will throw this exception.
+                err(e.line, e.position, e.message.c_str());
+                return false;
+        }
+        return true;
+}
+
+/// End the input of the stream, calling ret with the last batch if
+/// there is one. Returns false after calling err on a parse error.
+bool finish_stream(FasmFeedStream* stream,
+                   void (*ret)(const char* str, size_t),
+                   void (*err)(size_t, size_t, const char*)) {
+        stream->ret = ret;
+        try {
+                stream->parser.finish();
+        } catch (ParseException e) {
+                // Parse failure will throw this exception.
+                err(e.line, e.position, e.message.c_str());
+                return false;
+        }
+        return true;
+}
+
+/// Release a stream returned by open_feed_stream.
+void close_feed_stream(FasmFeedStream* stream) {
+        delete stream;
+}
+
+/// Parse the given input file using nthreads threads, or one per core
+/// if nthreads is 0, and write its canonical form (see CanonicalLines)
+/// to the file descriptor fd, setting *count to the number of lines
+/// written. Returns false after calling err on a parse or write error.
+bool canonical_from_file(const char* path,
+                         size_t nthreads,
+                         int fd,
+                         size_t* count,
+                         void (*err)(size_t, size_t, const char*)) {
+        MappedFile input(path);
+        if (!input.is_open()) {
+                err(0, 0, "Couldn't open file");
+                return false;
+        }
+
+        CanonicalLines lines;
+        try {
+                std::string encoded;
+                parse_fasm_parallel(input.data(), input.size(), nthreads,
+                                    encoded);
+                lines.add(encoded.data(), encoded.size());
+        } catch (ParseException e) {
+                // Parse failure will throw this exception.
+                err(e.line, e.position, e.message.c_str());
+                return false;
+        }
+        if (!lines.write(fd)) {
+                err(0, 0, "Couldn't write output");
+                return false;
+        }
+        *count = lines.size();
+        return true;
+}
+
+/// Write the canonical form (see CanonicalLines) of the size bytes of
+/// encoded lines at data, e.g. the output of from_file, to the file
+/// descriptor fd, setting *count to the number of lines written.
+/// Returns false after calling err on an error.
+bool canonical_from_encoded(const char* data,
+                            size_t size,
+                            int fd,
+                            size_t* count,
+                            void (*err)(size_t, size_t, const char*)) {
+        CanonicalLines lines;
+        try {
+                lines.add(data, size);
+        } catch (ParseException e) {
+                err(e.line, e.position, e.message.c_str());
+                return false;
+        }
+        if (!lines.write(fd)) {
+                err(0, 0, "Couldn't write output");
+                return false;
+        }
+        *count = lines.size();
+        return true;
+}
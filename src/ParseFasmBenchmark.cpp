@@ -0,0 +1,168 @@
+// Copyright 2017-2022 F4PGA Authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+//
+// SPDX-License-Identifier: Apache-2.0
+
+/// Benchmarks for ParseFasm, reporting time and heap allocations per line.
+/// parse_fasm_benchmark [lines]
+///   lines : The number of lines to parse, default 100000.
+
+#include <chrono>
+#include <cstdlib>
+#include <new>
+
+#include "ParseFasm.cpp"
+
+/// Count every heap allocation made by the process.
+static std::atomic<size_t> allocations(0);
+
+void* operator new(size_t size) {
+        allocations++;
+        if (void* p = std::malloc(size ? size : 1)) {
+                return p;
+        }
+        throw std::bad_alloc();
+}
+
+void operator delete(void* p) noexcept {
+        std::free(p);
+}
+
+void operator delete(void* p, size_t) noexcept {
+        std::free(p);
+}
+
+/// The encoding of a line as it was done before Encoder, where each
+/// level of nesting is built in its own std::ostringstream, and copied
+/// into its parent with another header in front.
+namespace string_encoding {
+
+std::string num(uint32_t num) {
+        return std::string(reinterpret_cast<const char*>(&num), sizeof(num));
+}
+
+std::string str(char tag, std::string data) {
+        std::ostringstream s;
+        s << tag << num(data.size()) << data;
+        return s.str();
+}
+
+std::string withHeader(char tag, std::string data) {
+        std::ostringstream header;
+        header << tag << num(data.size());
+        return header.str() + data;
+}
+
+std::string line(const std::string& feature) {
+        std::ostringstream set_feature;
+        set_feature << str(tag::kFeature, feature)
+                    << withHeader(tag::kAddress, num(31) + num(0))
+                    << tag::kWidth << num(32)
+                    << withHeader(tag::kHex, num(0xdeadbeef));
+        std::ostringstream annotation;
+        annotation << str(tag::kAnnotationName, "name")
+                   << str(tag::kAnnotationValue, "value");
+        std::ostringstream data;
+        data << withHeader(tag::kSetFeature, set_feature.str())
+             << withHeader(tag::kAnnotations,
+                           withHeader(tag::kAnnotation, annotation.str()))
+             << str(tag::kComment, " comment");
+        return withHeader(tag::kLine, data.str());
+}
+
+}  // namespace string_encoding
+
+/// The same line as above, encoded with Encoder.
+void encode_line(Encoder& out, const std::string& feature) {
+        size_t line = out.begin(tag::kLine);
+        size_t set_feature = out.begin(tag::kSetFeature);
+        out.str(tag::kFeature, feature);
+        size_t address = out.begin(tag::kAddress);
+        out.num(31);
+        out.num(0);
+        out.end(address);
+        out.num(tag::kWidth, 32);
+        size_t hex = out.begin(tag::kHex);
+        out.num(0xdeadbeef);
+        out.end(hex);
+        out.end(set_feature);
+        size_t annotations = out.begin(tag::kAnnotations);
+        size_t annotation = out.begin(tag::kAnnotation);
+        out.str(tag::kAnnotationName, "name");
+        out.str(tag::kAnnotationValue, "value");
+        out.end(annotation);
+        out.end(annotations);
+        out.str(tag::kComment, " comment");
+        out.end(line);
+}
+
+/// Run f, then print the time and allocations per line.
+template <typename F>
+void measure(const char* name, size_t lines, F f) {
+        size_t start_allocations = allocations;
+        auto start = std::chrono::steady_clock::now();
+        f();
+        auto end = std::chrono::steady_clock::now();
+        double ns =
+            std::chrono::duration<double, std::nano>(end - start).count();
+        std::cout << name << ": " << ns / lines << " ns/line, "
+                  << double(allocations - start_allocations) / lines
+                  << " allocations/line" << std::endl;
+}
+
+int main(int argc, char* argv[]) {
+        size_t lines = argc > 1 ? std::stoul(argv[1]) : 100000;
+
+        std::vector<std::string> features;
+        std::string simple;
+        std::string full;
+        for (size_t i = 0; i < lines; i++) {
+                features.push_back("CLBLL_L_X" + std::to_string(i % 100) + "Y" +
+                                   std::to_string(i / 100) +
+                                   ".SLICEL_X0.ALUT.INIT");
+                simple +=
+                    features.back() + "[" + std::to_string(i % 64) + "]\n";
+                full += features.back() +
+                        "[31:0] = 32'hDEADBEEF { name = \"value\" } "
+                        "# comment\n";
+        }
+
+        size_t size = 0;
+        measure("encode line, strings", lines, [&]() {
+                for (auto& feature : features) {
+                        size += string_encoding::line(feature).size();
+                }
+        });
+
+        Encoder encoder;
+        measure("encode line, Encoder", lines, [&]() {
+                for (auto& feature : features) {
+                        encode_line(encoder, feature);
+                }
+        });
+        if (encoder.data().size() != size) {
+                std::cerr << "Encodings differ in size." << std::endl;
+                return 1;
+        }
+
+        encoder.clear();
+        measure("parse simple lines", lines, [&]() {
+                parse_fasm_lines(simple.data(), simple.size(), encoder);
+        });
+
+        encoder.clear();
+        measure("parse full lines", lines,
+                [&]() { parse_fasm_lines(full.data(), full.size(), encoder); });
+        return 0;
+}
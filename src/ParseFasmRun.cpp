@@ -24,12 +24,13 @@ int main(int argc, char* argv[]) {
         /// If no args say otherwise,
         /// run as a filter (stdin -> parse_fasm -> stdout)
         bool filter = true;
+        bool hex = false;
 
         /// Parse flags first
         for (int i = 1; i < argc; i++) {
                 std::string arg(argv[i]);
                 if (arg == "-hex") {
-                        hex_mode = true;
+                        hex = true;
                 }
         }
 
@@ -39,7 +40,7 @@ int main(int argc, char* argv[]) {
                 if (arg[0] == '-') {
                         std::ifstream in;
                         in.open(arg);
-                        parse_fasm(in, std::cout);
+                        parse_fasm(in, std::cout, hex);
                 }
         }
 
@@ -48,7 +49,7 @@ int main(int argc, char* argv[]) {
                 std::istringstream in_line;
                 for (std::string line; std::getline(std::cin, line);) {
                         in_line.str(line);
-                        parse_fasm(in_line, std::cout);
+                        parse_fasm(in_line, std::cout, hex);
                 }
         }
         return 0;
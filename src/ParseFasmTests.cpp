@@ -19,19 +19,44 @@
 #include <gtest/gtest.h>
 #include "ParseFasm.cpp"
 
-// Test the Num class
+// Test Encoder::num
 TEST(ParseFasmTests, Num) {
-        std::ostringstream str;
-        str << Num('a', 0x74736554);
-        if (str.str() == "aTest") {
+        Encoder encoder;
+        encoder.num('a', 0x74736554);
+        if (encoder.data() == "aTest") {
                 std::cout << "little endian" << std::endl;
-        } else if (str.str() == "atseT") {
+        } else if (encoder.data() == "atseT") {
                 std::cout << "big endian" << std::endl;
         } else {
                 ASSERT_TRUE(false);
         }
 }
 
+// Check that nested values get the right lengths, and that empty
+// values can be dropped, in both modes.
+TEST(ParseFasmTests, Encoder) {
+        Encoder encoder(true);
+        size_t outer = encoder.begin('l');
+        size_t inner = encoder.begin('s');
+        encoder.str('f', "a<b");
+        encoder.end(inner);
+        size_t empty = encoder.begin('{');
+        EXPECT_TRUE(encoder.empty(empty));
+        encoder.cancel(empty);
+        EXPECT_FALSE(encoder.empty(outer));
+        encoder.end(outer);
+        EXPECT_EQ(encoder.data(), "l<c>s<8>f<3>a\\<b");
+
+        Encoder binary;
+        outer = binary.begin('l');
+        binary.str('f', "ab");
+        binary.end(outer);
+        uint32_t length;
+        memcpy(&length, binary.data().data() + 1, sizeof(length));
+        EXPECT_EQ(length, 7);
+        EXPECT_EQ(binary.data().size(), 12);
+}
+
 // Check that count_without() works
 TEST(ParseFasmTests, count_without) {
         std::string str = "_01_2_34_";
@@ -45,9 +70,7 @@ TEST(ParseFasmTests, count_without) {
 TEST(ParseFasmTests, parse_fasm) {
     std::istringstream input("a.b.c[31:0] = 7'o123 { d = \"e\", .f = \"\" } # hello\nthere");
     std::ostringstream output;
-    bool stored_hex_mode = hex_mode;
-    hex_mode = true;
-    parse_fasm(input, output);
+    parse_fasm(input, output, true);
     
     /// The below string is the input above encoded in hex mode.
     EXPECT_EQ(output.str(),
@@ -71,6 +94,282 @@ TEST(ParseFasmTests, parse_fasm) {
             "f<5>there" /// Feature = "there"
         "\n" /// Newline (only in hex mode for readability)
       );
-     hex_mode = stored_hex_mode;
 }
 // clang-format on
+
+// Check that LineSplitter only splits at newlines that end a line.
+TEST(ParseFasmTests, LineSplitter) {
+        std::string input =
+            "a\n"
+            "b # {\n"
+            "c { d = \"e\nf\" }\n"
+            "g { h = \"\\\"\n\" }\n";
+        std::vector<size_t> ends;
+        LineSplitter splitter;
+        for (size_t i = 0; i < input.size(); i++) {
+                if (splitter.consume(input[i])) {
+                        ends.push_back(i + 1);
+                }
+        }
+        EXPECT_EQ(ends, std::vector<size_t>({2, 8, 24, 40}));
+}
+
+// Parsing in small batches should give the same output as parsing
+// the whole input at once, split on line boundaries.
+TEST(ParseFasmTests, FasmStreamParser) {
+        std::string input =
+            "a.b[3:0] = 4'hA\n"
+            "c { d = \"e\nf\" } # comment\n"
+            "\n"
+            "g[1]";
+        std::istringstream whole_input(input);
+        std::ostringstream whole;
+        parse_fasm(whole_input, whole);
+
+        std::string streamed;
+        size_t batches = 0;
+        FasmStreamParser parser(1, [&](const std::string& batch) {
+                ASSERT_FALSE(batch.empty());
+                EXPECT_EQ(batch.back(), 0);
+                streamed.append(batch, 0, batch.size() - 1);
+                batches++;
+        });
+        for (char c : input) {
+                parser.feed(&c, 1);
+        }
+        parser.finish();
+
+        EXPECT_EQ(streamed, whole.str());
+        EXPECT_EQ(batches, 4);
+}
+
+// Errors in later batches should report line numbers in the whole input.
+TEST(ParseFasmTests, FasmStreamParserErrorLine) {
+        std::string input = "a\nb\nc = 1'b2\n";
+        FasmStreamParser parser(1, [](const std::string&) {});
+        try {
+                parser.feed(input.data(), input.size());
+                parser.finish();
+                FAIL();
+        } catch (ParseException e) {
+                EXPECT_EQ(e.line, 3);
+        }
+}
+
+// Parsing on several threads should give the same output as parsing
+// on one, and report errors at the right line.
+TEST(ParseFasmTests, parse_fasm_parallel) {
+        std::string input;
+        for (int i = 0; i < 1000; i++) {
+                input += "a.b" + std::to_string(i) + "[" + std::to_string(i) +
+                         "] { c = \"d\ne\" } # f\n";
+        }
+        std::istringstream serial_input(input);
+        std::ostringstream serial;
+        parse_fasm(serial_input, serial);
+
+        std::string parallel;
+        parse_fasm_parallel(input.data(), input.size(), 8, parallel);
+        EXPECT_EQ(parallel, serial.str());
+
+        input += "g = 1'b2\n";
+        try {
+                parallel.clear();
+                parse_fasm_parallel(input.data(), input.size(), 8, parallel);
+                FAIL();
+        } catch (ParseException e) {
+                EXPECT_EQ(e.line, 2001);
+        }
+}
+
+// Simple lines are encoded without ANTLR. The output must be the same
+// as when everything is parsed by ANTLR, in both modes.
+TEST(ParseFasmTests, SimpleLine) {
+        std::string input =
+            "a\n"
+            "a.b.c\n"
+            "  A_1.b2 \t\n"
+            "a[0]\n"
+            "a.b[007]\n"
+            "a[31:0]\n"
+            "a[123456789:2]\n"
+            "a[1234567890]\n"
+            "a [1]\n"
+            "a\r\n"
+            "\n"
+            "   \n"
+            "a = 1\n"
+            "b # c\n"
+            "d { e = \"f\ng\" }\n"
+            "h";
+
+        SimpleLine simple;
+        EXPECT_TRUE(simple.scan("a.b[3:1]\n", "a.b[3:1]\n" + 9));
+        EXPECT_EQ(std::string(simple.feature_begin, simple.feature_end), "a.b");
+        EXPECT_EQ(simple.address_count, 2);
+        EXPECT_EQ(simple.address[0], 3);
+        EXPECT_EQ(simple.address[1], 1);
+        EXPECT_FALSE(simple.scan("a.1\n", "a.1\n" + 4));
+        EXPECT_FALSE(simple.scan("a = 1", "a = 1" + 5));
+
+        for (bool hex : {false, true}) {
+                ANTLRInputStream stream(input);
+                Encoder antlr_output(hex);
+                parse_fasm(stream, antlr_output);
+
+                Encoder output(hex);
+                parse_fasm_lines(input.data(), input.size(), output);
+                EXPECT_EQ(output.data(), antlr_output.data());
+        }
+}
+
+TEST(ParseFasmTests, MemoryCharStream) {
+        std::string input = "a.b[1] { x = \"y\" } # c\nd\n";
+        MemoryCharStream stream(input.data(), input.size());
+        EXPECT_EQ(stream.size(), input.size());
+        EXPECT_EQ(stream.LA(1), 'a');
+        stream.consume();
+        EXPECT_EQ(stream.LA(-1), 'a');
+        EXPECT_EQ(stream.LA(1), '.');
+        EXPECT_EQ(stream.getText(misc::Interval(size_t(2), size_t(5))), "b[1]");
+        stream.seek(input.size());
+        EXPECT_EQ(stream.LA(1), IntStream::EOF);
+
+        for (bool hex : {false, true}) {
+                ANTLRInputStream antlr_stream(input);
+                Encoder antlr_output(hex);
+                parse_fasm(antlr_stream, antlr_output);
+
+                MemoryCharStream memory_stream(input.data(), input.size());
+                Encoder output(hex);
+                parse_fasm(memory_stream, output);
+                EXPECT_EQ(output.data(), antlr_output.data());
+        }
+}
+
+// Check that parses using separate contexts can run concurrently,
+// each keeping its own mode.
+TEST(ParseFasmTests, FasmContext) {
+        std::string input;
+        for (int i = 0; i < 1000; i++) {
+                input += "a.b[" + std::to_string(i) + "]\n";
+        }
+
+        std::string expected[2];
+        for (bool hex : {false, true}) {
+                Encoder output(hex);
+                parse_fasm_lines(input.data(), input.size(), output);
+                output.data().push_back(0);
+                expected[hex] = output.data();
+        }
+
+        std::atomic<int> mismatches(0);
+        std::vector<std::thread> threads;
+        for (int t = 0; t < 8; t++) {
+                threads.emplace_back([&, t]() {
+                        bool hex = t % 2;
+                        FasmContext* ctx = fasm_context_create(hex);
+                        for (int i = 0; i < 10; i++) {
+                                fasm_context_parse_string(
+                                    ctx, input.c_str(),
+                                    [](const char* str, size_t n) {},
+                                    [](size_t, size_t, const char*) {});
+                                if (ctx->output.data() != expected[hex]) {
+                                        mismatches++;
+                                }
+                        }
+                        fasm_context_destroy(ctx);
+                });
+        }
+        for (auto& thread : threads) {
+                thread.join();
+        }
+        EXPECT_EQ(mismatches, 0);
+}
+
+// Feeding input through the C interface should give the same output as
+// parsing the whole buffer at once.
+TEST(ParseFasmTests, FasmFeedStream) {
+        std::string input;
+        for (int i = 0; i < 1000; i++) {
+                input += "a.b[" + std::to_string(i) + "]\n";
+        }
+
+        static std::string whole;
+        whole.clear();
+        FasmContext ctx(false);
+        fasm_context_parse_buffer(
+            &ctx, input.data(), input.size(),
+            [](const char* str, size_t n) { whole.assign(str, n - 1); },
+            [](size_t, size_t, const char*) {});
+
+        static std::string streamed;
+        streamed.clear();
+        auto ret = [](const char* str, size_t n) {
+                streamed.append(str, n - 1);
+        };
+        auto err = [](size_t, size_t, const char*) { FAIL(); };
+        FasmFeedStream* stream = open_feed_stream(false, 100);
+        for (size_t i = 0; i < input.size(); i += 7) {
+                EXPECT_TRUE(feed_stream(stream, input.data() + i,
+                                        std::min<size_t>(7, input.size() - i),
+                                        ret, err));
+        }
+        EXPECT_TRUE(finish_stream(stream, ret, err));
+        close_feed_stream(stream);
+
+        EXPECT_EQ(streamed, whole);
+}
+
+TEST(ParseFasmTests, CanonicalLines) {
+        std::string input =
+            "d[0]\n"
+            "a.b[7:0] = 8'h81\n"
+            "c\n"
+            "c\n"
+            "e[35:4] = 32'b0\n"
+            "a.b[40:33] = 5'b10001 # x\n";
+
+        Encoder output(false);
+        parse_fasm_lines(input.data(), input.size(), output);
+        CanonicalLines lines;
+        lines.add(output.data().data(), output.data().size());
+
+        FILE* file = tmpfile();
+        ASSERT_NE(file, nullptr);
+        EXPECT_TRUE(lines.write(fileno(file)));
+        EXPECT_EQ(lines.size(), 6u);
+        rewind(file);
+        char buffer[256];
+        size_t size = fread(buffer, 1, sizeof(buffer), file);
+        fclose(file);
+
+        EXPECT_EQ(std::string(buffer, size),
+                  "a.b\n"
+                  "a.b[33]\n"
+                  "a.b[37]\n"
+                  "a.b[7]\n"
+                  "c\n"
+                  "d\n");
+}
+
+// Values wider than their address or declared width are errors, as in
+// Python, rather than losing their high bits.
+TEST(ParseFasmTests, CanonicalLinesWideValue) {
+        for (std::string input :
+             {"a[3:0] = 8'hFF\n", "a[7:0] = 4'hFF\n", "a[3] = 2'b10\n"}) {
+                Encoder output(false);
+                parse_fasm_lines(input.data(), input.size(), output);
+                CanonicalLines lines;
+                EXPECT_THROW(
+                    lines.add(output.data().data(), output.data().size()),
+                    ParseException);
+        }
+
+        std::string input = "a[39:0] = 40'h8000000001\n";
+        Encoder output(false);
+        parse_fasm_lines(input.data(), input.size(), output);
+        CanonicalLines lines;
+        lines.add(output.data().data(), output.data().size());
+        EXPECT_EQ(lines.size(), 2u);
+}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import fasm
+import fasm.aio
+import fasm.parser
+
+
+def example(fname):
+    return os.path.join(os.path.dirname(__file__), '..', 'examples', fname)
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        self.expected = list(
+            fasm.parser.parse_fasm_filename(example('many.fasm')))
+
+    def test_parse(self):
+        async def parse():
+            return await asyncio.gather(
+                *[
+                    fasm.aio.aparse_fasm_filename(example('many.fasm'))
+                    for _ in range(4)
+                ])
+
+        for lines in run(parse()):
+            self.assertEqual(list(lines), self.expected)
+
+    def test_iter(self):
+        async def collect(chunk_size):
+            lines = []
+            async for line in fasm.aio.AsyncFasmLines(example('many.fasm'),
+                                                      chunk_size=chunk_size):
+                lines.append(line)
+            return lines
+
+        for chunk_size in (1, 7, 4096):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(run(collect(chunk_size)), self.expected)
+
+    def test_iter_parses_on_executor(self):
+        threads = []
+        iter_parse_fasm_filename = fasm.aio.iter_parse_fasm_filename
+
+        def iter_parse(filename, **kwargs):
+            threads.append(threading.get_ident())
+            return iter_parse_fasm_filename(filename, **kwargs)
+
+        async def collect():
+            lines = fasm.aio.AsyncFasmLines(example('many.fasm'))
+            # Nothing is parsed until the first line is requested.
+            self.assertEqual(threads, [])
+            collected = []
+            async for line in lines:
+                collected.append(line)
+            return collected
+
+        with mock.patch.object(fasm.aio, 'iter_parse_fasm_filename',
+                               iter_parse):
+            self.assertEqual(run(collect()), self.expected)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_iter_close(self):
+        async def first():
+            async with fasm.aio.AsyncFasmLines(example('many.fasm'),
+                                               chunk_size=1) as lines:
+                line = await lines.__anext__()
+            with self.assertRaises(StopAsyncIteration):
+                await lines.__anext__()
+            return line
+
+        self.assertEqual(run(first()), self.expected[0])
+
+    def test_write(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'out.fasm')
+            run(fasm.aio.awrite_fasm_filename(filename, self.expected))
+            with open(filename) as f:
+                self.assertEqual(
+                    f.read(), fasm.fasm_tuple_to_string(self.expected))
+        finally:
+            shutil.rmtree(directory)
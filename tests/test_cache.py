@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import importlib
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import fasm
+import fasm.parser
+from fasm.parser.cache import DiskCache, MemoryCache, file_digest
+
+parsers = {}
+for name in fasm.parser.available:
+    parsers[name] = importlib.import_module('fasm.parser.' + name)
+
+
+def example(fname):
+    return os.path.join(os.path.dirname(__file__), '..', 'examples', fname)
+
+
+def source(directory, name, contents):
+    filename = os.path.join(directory, name)
+    with open(filename, 'w') as f:
+        f.write(contents)
+    return filename
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiskCache(os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_load(self):
+        filename = source(self.directory, 'a.fasm', 'a.b\n')
+        key = self.cache.key(filename)
+        self.assertIsNone(self.cache.load(key))
+
+        self.cache.store(key, b'encoded\0', file_digest(filename))
+        self.assertEqual(bytes(self.cache.load(key)), b'encoded\0')
+
+        # Touching the file keeps the entry.
+        os.utime(filename, ns=(0, 0))
+        key = self.cache.key(filename)
+        self.assertEqual(bytes(self.cache.load(key)), b'encoded\0')
+
+        # Changing the file does not.
+        source(self.directory, 'a.fasm', 'a.c\n')
+        self.assertIsNone(self.cache.load(self.cache.key(filename)))
+
+        # The digest given to store is what touched files are checked
+        # against.
+        key = self.cache.key(filename)
+        self.cache.store(key, b'encoded\0', bytes(32))
+        os.utime(filename, ns=(0, 0))
+        self.assertIsNone(self.cache.load(self.cache.key(filename)))
+
+    def test_evict(self):
+        self.cache.max_bytes = 2500
+        keys = []
+        for i in range(4):
+            filename = source(self.directory, '{}.fasm'.format(i), 'a.b\n')
+            keys.append(self.cache.key(filename))
+            self.cache.store(keys[-1], bytes(1000), file_digest(filename))
+            os.utime(self.cache.entry_path(keys[-1]), ns=(i, i))
+
+        self.assertIsNone(self.cache.load(keys[0]))
+        self.assertIsNone(self.cache.load(keys[1]))
+        self.assertIsNotNone(self.cache.load(keys[2]))
+        self.assertIsNotNone(self.cache.load(keys[3]))
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.load(keys[3]))
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_parse(self):
+        parser = parsers['antlr']
+        with open(example('many.fasm')) as f:
+            filename = source(self.directory, 'many.fasm', f.read())
+        expected = parser.parse_fasm_filename(filename)
+        for lazy in (False, True, False):
+            with self.subTest(lazy=lazy):
+                lines = parser.parse_fasm_filename(
+                    filename, lazy=lazy, cache=self.cache)
+                self.assertEqual(list(lines), expected)
+                self.assertIsNotNone(self.cache.load(self.cache.key(filename)))
+
+        # The digest of the parsed contents is stored.
+        os.utime(filename, ns=(0, 0))
+        self.assertIsNotNone(self.cache.load(self.cache.key(filename)))
+
+        # A cache that can't be written doesn't change the result.
+        shutil.rmtree(self.cache.directory)
+        for lazy in (False, True):
+            with self.subTest(lazy=lazy, writable=False):
+                lines = parser.parse_fasm_filename(
+                    filename, lazy=lazy, cache=self.cache)
+                self.assertEqual(list(lines), expected)
+
+
+class TestMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hits(self):
+        cache = MemoryCache()
+        expected = list(fasm.parser.parse_fasm_filename(example('many.fasm')))
+
+        lines = cache.parse_fasm_filename(example('many.fasm'))
+        self.assertIsInstance(lines, tuple)
+        self.assertEqual(
+            fasm.fasm_tuple_to_string(lines),
+            fasm.fasm_tuple_to_string(expected))
+        for line in lines:
+            if line.annotations is not None:
+                self.assertIsInstance(line.annotations, tuple)
+
+        self.assertIs(cache.parse_fasm_filename(example('many.fasm')), lines)
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.entries), (1, 1, 1))
+        self.assertGreater(info.size, 0)
+
+    def test_invalidate(self):
+        cache = MemoryCache()
+        filename = source(self.directory, 'a.fasm', 'a.b\n')
+        self.assertEqual(
+            cache.parse_fasm_filename(filename)[0].set_feature.feature, 'a.b')
+
+        source(self.directory, 'a.fasm', 'a.bc\n')
+        self.assertEqual(
+            cache.parse_fasm_filename(filename)[0].set_feature.feature, 'a.bc')
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.entries), (0, 2, 1))
+
+    def test_evict(self):
+        cache = MemoryCache(parse=fasm.parser.parse_fasm_filename)
+        filenames = [
+            source(
+                self.directory, '{}.fasm'.format(i), 'a.b{}\n'.format(i) * 100)
+            for i in range(3)
+        ]
+        cache.parse_fasm_filename(filenames[0])
+        cache.max_bytes = cache.info().size * 2
+
+        for filename in filenames:
+            cache.parse_fasm_filename(filename)
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses), (1, 3))
+        self.assertEqual((info.evictions, info.entries), (1, 2))
+        self.assertLessEqual(info.size, info.max_bytes)
+
+        # The first file was least recently used.
+        cache.parse_fasm_filename(filenames[2])
+        self.assertEqual(cache.info().hits, 2)
+
+        cache.clear()
+        self.assertEqual(cache.info().size, 0)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import importlib
+import os.path
+import tempfile
+import unittest
+
+import fasm
+import fasm.parser
+
+try:
+    import numpy
+    from fasm.columns import FasmColumns, NONE
+except ImportError:
+    numpy = None
+
+parsers = {}
+for name in fasm.parser.available:
+    parsers[name] = importlib.import_module('fasm.parser.' + name)
+
+
+def example(fname):
+    return os.path.join(os.path.dirname(__file__), '..', 'examples', fname)
+
+
+@unittest.skipIf(numpy is None, 'numpy is not available')
+class TestFasmColumns(unittest.TestCase):
+    def test_round_trip(self):
+        for name, parser in parsers.items():
+            with self.subTest(name, parser=name):
+                lines = list(parser.parse_fasm_filename(example('many.fasm')))
+                columns = parser.parse_fasm_filename_columns(
+                    example('many.fasm'))
+                self.assertEqual(len(columns), len(lines))
+                self.assertEqual(columns.to_lines(), lines)
+                self.assertEqual(columns.line(-1), lines[-1])
+                self.assertEqual(
+                    columns.to_string(), fasm.fasm_tuple_to_string(lines))
+                self.assertEqual(
+                    FasmColumns.from_lines(lines).to_lines(), lines)
+
+    def test_columns(self):
+        columns = FasmColumns.from_lines(
+            fasm.parser.parse_fasm_string(
+                "A.B[3:0] = 4'hA\n"
+                "A.C[1]\n"
+                "# comment\n"
+                "B.D = 1 { x = \"y\" }\n"
+                "A.B[99:0] = 100'h8000000000000000000000001\n"))
+        self.assertEqual(columns.features, ['A.B', 'A.C', 'B.D'])
+        self.assertEqual(columns.feature_id.tolist(), [0, 1, NONE, 2, 0])
+        self.assertEqual(columns.start.tolist(), [0, 1, NONE, NONE, 0])
+        self.assertEqual(columns.end.tolist(), [3, NONE, NONE, NONE, 99])
+        self.assertEqual(columns.value.tolist(), [10, 1, 0, 1, 0])
+        self.assertEqual(
+            columns.value_format.tolist(), [
+                fasm.ValueFormat.VERILOG_HEX.value, NONE, NONE,
+                fasm.ValueFormat.PLAIN.value,
+                fasm.ValueFormat.VERILOG_HEX.value
+            ])
+        self.assertEqual(columns.wide_values, {4: 2**99 + 1})
+        self.assertEqual(columns.comments, {2: ' comment'})
+        self.assertEqual(list(columns.annotations), [3])
+
+    def test_padded_values(self):
+        # Values are wide by their size, not the digits they are written
+        # with, so a zero padded value that fits in 64 bits is in value.
+        source = (
+            "A.B[79:0] = 80'h00000000000000000001\n"
+            "A.B[99:0] = 100'h0000000000010000000000000000\n")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'padded.fasm')
+            with open(filename, 'w') as f:
+                f.write(source)
+            for name, parser in parsers.items():
+                with self.subTest(name, parser=name):
+                    columns = parser.parse_fasm_filename_columns(filename)
+                    expected = FasmColumns.from_lines(
+                        parser.parse_fasm_filename(filename))
+                    self.assertEqual(columns.value.tolist(), [1, 0])
+                    self.assertEqual(columns.wide_values, {1: 2**64})
+                    self.assertEqual(
+                        columns.value.tolist(), expected.value.tolist())
+                    self.assertEqual(columns.wide_values, expected.wide_values)
+
+    def test_select(self):
+        lines = list(fasm.parser.parse_fasm_filename(example('many.fasm')))
+        columns = FasmColumns.from_lines(lines)
+
+        mask = columns.prefix_mask('CLBLL_L_X12Y124.')
+        expected = [
+            line for line in lines if line.set_feature
+            and line.set_feature.feature.startswith('CLBLL_L_X12Y124.')
+        ]
+        self.assertTrue(expected)
+        self.assertEqual(columns.select(mask).to_lines(), expected)
+
+        rows = numpy.flatnonzero(columns.feature_id == NONE)[::-1]
+        self.assertEqual(
+            columns.select(rows).to_lines(), [lines[row] for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
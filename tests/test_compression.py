@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import bz2
+import importlib
+import io
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import fasm.parser
+from fasm.compression import detect_compression, open_fasm_file
+
+try:
+    import zstandard  # noqa: F401
+    extensions = ['.gz', '.xz', '.bz2', '.zst']
+except ImportError:
+    extensions = ['.gz', '.xz', '.bz2']
+
+parsers = {}
+for name in fasm.parser.available:
+    parsers[name] = importlib.import_module('fasm.parser.' + name)
+
+
+class TricklingReader(io.RawIOBase):
+    """ Unbuffered stream returning a byte per read, like a slow pipe. """
+
+    def __init__(self, data):
+        self.data = data
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self.data), 1)
+        b[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+def example(fname):
+    return os.path.join(os.path.dirname(__file__), '..', 'examples', fname)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(example('many.fasm'), 'rb') as f:
+            self.source = f.read()
+
+        # Names don't match the compression, which is found by magic.
+        self.filenames = {}
+        for extension in extensions:
+            filename = os.path.join(self.directory, 'many' + extension)
+            with open_fasm_file(filename, 'wb') as f:
+                f.write(self.source)
+            os.rename(filename, filename + '.fasm')
+            self.filenames[extension] = filename + '.fasm'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_detect(self):
+        self.assertIsNone(detect_compression(example('many.fasm')))
+        for extension, filename in self.filenames.items():
+            with self.subTest(extension):
+                self.assertIsNotNone(detect_compression(filename))
+                with open_fasm_file(filename) as f:
+                    self.assertEqual(f.read(), self.source)
+
+    def test_detect_bz2(self):
+        # A plain file can start with the letters of the bz2 magic.
+        plain = os.path.join(self.directory, 'plain.fasm')
+        with open(plain, 'w') as f:
+            f.write('BZh9.FOO\n')
+        empty = os.path.join(self.directory, 'empty.fasm')
+        with open(empty, 'wb') as f:
+            f.write(bz2.compress(b''))
+
+        self.assertIsNone(detect_compression(plain))
+        self.assertEqual(detect_compression(empty), 'bz2')
+        for name, parser in parsers.items():
+            with self.subTest(parser=name):
+                lines = list(parser.parse_fasm_filename(plain))
+                self.assertEqual(
+                    [line.set_feature.feature for line in lines], ['BZh9.FOO'])
+                with open(plain, 'rb') as f:
+                    self.assertEqual(parser.parse_fasm_file(f), lines)
+                self.assertEqual(list(parser.parse_fasm_filename(empty)), [])
+
+    def test_parse(self):
+        for name, parser in parsers.items():
+            expected = list(parser.parse_fasm_filename(example('many.fasm')))
+            for extension, filename in self.filenames.items():
+                with self.subTest(extension, parser=name):
+                    self.assertEqual(
+                        list(parser.parse_fasm_filename(filename)), expected)
+                    self.assertEqual(
+                        list(parser.parse_fasm_filename(filename, lazy=True)),
+                        expected)
+                    self.assertEqual(
+                        list(parser.iter_parse_fasm_filename(filename)),
+                        expected)
+                    with open(filename, 'rb') as f:
+                        self.assertEqual(parser.parse_fasm_file(f), expected)
+
+    def test_parse_short_reads(self):
+        for name, parser in parsers.items():
+            expected = list(parser.parse_fasm_filename(example('many.fasm')))
+            for extension, filename in self.filenames.items():
+                with open(filename, 'rb') as f:
+                    data = f.read()
+                with self.subTest(extension, parser=name):
+                    self.assertEqual(
+                        parser.parse_fasm_file(TricklingReader(data)),
+                        expected)
+                    self.assertEqual(
+                        parser.parse_fasm_file(io.BytesIO(data)), expected)
+                    # A short peek must not hide the magic either.
+                    self.assertEqual(
+                        parser.parse_fasm_file(
+                            io.BufferedReader(TricklingReader(data))),
+                        expected)
+            with self.subTest('plain', parser=name):
+                self.assertEqual(
+                    parser.parse_fasm_file(TricklingReader(self.source)),
+                    expected)
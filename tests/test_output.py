@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2022 F4PGA Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+
+from fasm import SetFasmFeature, FasmLine, ValueFormat, Annotation
+from fasm.output import merge_features, merge_and_sort, \
+    merge_and_sort_sharded
+
+
+def feature(start, end=None, value=None):
+    return SetFasmFeature('A.B', start, end, value, None)
+
+
+def example_model():
+    model = []
+    for i in range(200):
+        tile = 'T{}'.format(i * 7 % 13)
+        model.append(
+            FasmLine(
+                SetFasmFeature(
+                    '{}.F{}'.format(tile, i % 3), i % 5, None, 1, None), None,
+                None))
+        if i % 11 == 0:
+            model.append(FasmLine(None, None, ' {}'.format(i)))
+        if i % 17 == 0:
+            model.append(FasmLine(None, [Annotation('a', 'b')], None))
+    return model
+
+
+def zero_function(feature):
+    return feature.startswith('T1.')
+
+
+class TestOutput(unittest.TestCase):
+    def test_merge_features(self):
+        merged = merge_features(
+            [
+                feature(5),
+                feature(7),
+                feature(6, value=0),
+                feature(0, 3, 0b1001)
+            ])
+        self.assertEqual(
+            merged,
+            SetFasmFeature(
+                'A.B', 0, 7, 0b10101001, ValueFormat.VERILOG_BINARY))
+
+    def test_merge_wide_features(self):
+        value = (1 << 16383) | 5
+        merged = merge_features(
+            [feature(16384, 32767, value),
+             feature(0, 16383, value)])
+        self.assertEqual(merged.end, 32767)
+        self.assertEqual(merged.value, value | (value << 16384))
+
+    def test_merge_conflict(self):
+        with self.assertRaises(AssertionError):
+            merge_features([feature(1), feature(0, 3, 0b0101)])
+
+    def test_merge_and_sort(self):
+        model = [
+            FasmLine(feature(1), None, None),
+            FasmLine(SetFasmFeature('A.C', None, None, 1, None), None, None),
+            FasmLine(feature(0, value=0), None, None),
+        ]
+        self.assertEqual(
+            list(merge_and_sort(model)), [
+                FasmLine(
+                    SetFasmFeature(
+                        'A.B', 0, 1, 0b10, ValueFormat.VERILOG_BINARY), None,
+                    None),
+                FasmLine(
+                    SetFasmFeature('A.C', None, None, 1, None), None, None),
+            ])
+
+    def test_merge_and_sort_sharded(self):
+        model = example_model()
+        for kwargs in ({}, {'zero_function': zero_function, 'sort_key': len}):
+            expected = list(merge_and_sort(model, **kwargs))
+            for run_lines in (1, 50, None):
+                with self.subTest(run_lines=run_lines, **kwargs):
+                    self.assertEqual(
+                        list(
+                            merge_and_sort_sharded(
+                                model, run_lines=run_lines, **kwargs)),
+                        expected)
+
+    def test_merge_and_sort_workers(self):
+        model = example_model()
+        for kwargs in ({}, {'zero_function': zero_function, 'sort_key': len}):
+            with self.subTest(**kwargs):
+                self.assertEqual(
+                    list(merge_and_sort(model, workers=2, **kwargs)),
+                    list(merge_and_sort(model, **kwargs)))
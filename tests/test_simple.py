@@ -17,9 +17,17 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
+import gzip
+import io
 import os
 import os.path
 import importlib
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 import unittest
 import fasm
@@ -96,6 +104,409 @@ class TestFasm(unittest.TestCase):
                 result = list(parser.parse_fasm_filename(example('many.fasm')))
                 check_round_trip(self, parser, result)
 
+    def test_iter_parse(self):
+        for name, parser in parsers.items():
+            with self.subTest(name, parser=name):
+                lines = parser.iter_parse_fasm_filename(example('many.fasm'))
+                self.assertEqual(
+                    next(lines),
+                    list(parser.parse_fasm_filename(example('many.fasm')))[0])
+                lines.close()
+
+                self.assertEqual(
+                    list(
+                        parser.iter_parse_fasm_filename(example('many.fasm'))),
+                    list(parser.parse_fasm_filename(example('many.fasm'))))
+
+    def test_lazy(self):
+        for name, parser in parsers.items():
+            with self.subTest(name, parser=name):
+                expected = list(
+                    parser.parse_fasm_filename(example('many.fasm')))
+                lines = parser.parse_fasm_filename(
+                    example('many.fasm'), lazy=True)
+                self.assertEqual(len(lines), len(expected))
+                self.assertEqual(list(lines), expected)
+                self.assertEqual(lines[-1], expected[-1])
+                self.assertEqual(lines[1:5], expected[1:5])
+                self.assertEqual(
+                    lines.index(expected[3]), expected.index(expected[3]))
+                self.assertEqual(
+                    lines.count(expected[3]), expected.count(expected[3]))
+                with self.assertRaises(ValueError):
+                    lines.index(expected[0], 1, 1)
+
+                source = fasm.fasm_tuple_to_string(expected)
+                self.assertEqual(
+                    list(parser.parse_fasm_string(source, lazy=True)),
+                    list(parser.parse_fasm_string(source)))
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_lazy_features(self):
+        parser = parsers['antlr']
+        expected = parser.parse_fasm_filename(example('many.fasm'))
+        for workers in (None, 2):
+            with self.subTest(workers=workers):
+                lines = parser.parse_fasm_filename(
+                    example('many.fasm'), workers=workers, lazy=True)
+                self.assertEqual(list(lines), expected)
+                self.assertEqual(
+                    list(lines.features()), [
+                        line.set_feature.feature
+                        for line in expected
+                        if line.set_feature
+                    ])
+        with self.assertRaises(IndexError):
+            lines[len(expected)]
+
+    def test_write_fasm(self):
+        model = list(fasm.parser.parse_fasm_filename(
+            example('many.fasm'))) * 1000
+        for canonical in (False, True):
+            with self.subTest(canonical=canonical):
+                lines = [
+                    line for fasm_line in model
+                    for line in fasm.fasm_line_to_string(
+                        fasm_line, canonical=canonical)
+                ]
+                if canonical:
+                    lines = sorted(set(lines))
+
+                output = io.StringIO()
+                self.assertEqual(
+                    fasm.write_fasm(model, output, canonical=canonical),
+                    len(lines))
+                self.assertEqual(
+                    output.getvalue(), ''.join(line + '\n' for line in lines))
+
+    def test_canonical_wide_feature(self):
+        set_feature = fasm.SetFasmFeature(
+            'BRAM.INIT', 0, 4095, (1 << 4000) | (1 << 17) | 1, None)
+        self.assertEqual(
+            [
+                feature.start
+                for feature in fasm.canonical_features(set_feature)
+            ], [None, 17, 4000])
+
+        model = [
+            fasm.FasmLine(set_feature, None, None),
+            fasm.FasmLine(None, None, 'comment'),
+            fasm.FasmLine(fasm.SetFasmFeature('A', 3, 4, 2, None), None, None),
+        ]
+        expected = [
+            ('BRAM.INIT', None),
+            ('BRAM.INIT', 17),
+            ('BRAM.INIT', 4000),
+            ('A', 4),
+        ]
+        self.assertEqual(list(fasm.canonical_feature_bits(model)), expected)
+
+    def test_sorted_canonical_lines(self):
+        model = list(fasm.parser.parse_fasm_filename(example('many.fasm')))
+        model += [
+            fasm.FasmLine(
+                fasm.SetFasmFeature(
+                    'A{}.B'.format(i % 7), 0, 15, i * 997, None), None, None)
+            for i in range(100)
+        ]
+        expected = sorted(
+            set(
+                line for fasm_line in model
+                for line in fasm.fasm_line_to_string(
+                    fasm_line, canonical=True)))
+        for run_lines in (1, 10, 1000, fasm.CANONICAL_RUN_LINES):
+            with self.subTest(run_lines=run_lines):
+                self.assertEqual(
+                    list(fasm.sorted_canonical_lines(model, run_lines)),
+                    expected)
+
+    def test_write_canonical_fasm(self):
+        for name, parser in parsers.items():
+            for fname in ('blank.fasm', 'feature_only.fasm', 'many.fasm'):
+                with self.subTest(fname, parser=name):
+                    expected = io.StringIO()
+                    fasm.write_fasm(
+                        parser.parse_fasm_filename(example(fname)),
+                        expected,
+                        canonical=True)
+                    for workers in (None, 0, 2):
+                        with tempfile.TemporaryFile('w+') as f:
+                            self.assertEqual(
+                                parser.write_canonical_fasm(
+                                    example(fname), f, workers),
+                                expected.getvalue().count('\n'))
+                            f.seek(0)
+                            self.assertEqual(f.read(), expected.getvalue())
+
+    def test_canonical_wide_value(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'wide.fasm')
+            # Wider than the address, and wider than the declared width.
+            for source in ("A[3:0] = 8'hFF\n", "A[7:0] = 4'hFF\n"):
+                with open(filename, 'w') as f:
+                    f.write(source)
+                for name, parser in parsers.items():
+                    with self.subTest(source, parser=name):
+                        for parse in (parser.parse_fasm_filename,
+                                      parser.iter_parse_fasm_filename):
+                            with self.assertRaises(AssertionError):
+                                fasm.write_fasm(
+                                    parse(filename),
+                                    io.StringIO(),
+                                    canonical=True)
+                        with tempfile.TemporaryFile('w') as f:
+                            with self.assertRaises(Exception):
+                                parser.write_canonical_fasm(filename, f)
+
+    def test_tool_output(self):
+        root = os.path.join(os.path.dirname(__file__), '..')
+        with tempfile.TemporaryDirectory() as directory:
+            empty = os.path.join(directory, 'empty.fasm')
+            open(empty, 'w').close()
+            for name, parser in parsers.items():
+                for filename in (empty, example('blank.fasm'),
+                                 example('many.fasm')):
+                    for canonical in (False, True):
+                        with self.subTest(filename, parser=name,
+                                          canonical=canonical):
+                            # The output of print(fasm_tuple_to_string()).
+                            expected = fasm.fasm_tuple_to_string(
+                                parser.parse_fasm_filename(filename),
+                                canonical) + '\n'
+                            args = [
+                                sys.executable, '-m', 'fasm.tool', filename,
+                                '--parser', name
+                            ]
+                            if canonical:
+                                args.append('--canonical')
+                            output = subprocess.check_output(
+                                args, cwd=root, universal_newlines=True)
+                            self.assertEqual(output, expected)
+
+    def test_parse_buffers_and_files(self):
+        with open(example('many.fasm'), 'rb') as f:
+            source = f.read()
+        for name, parser in parsers.items():
+            with self.subTest(name, parser=name):
+                expected = list(parser.parse_fasm_string(source.decode()))
+                self.assertEqual(
+                    list(parser.parse_fasm_string(source)), expected)
+                self.assertEqual(
+                    list(parser.parse_fasm_string(memoryview(source))),
+                    expected)
+                self.assertEqual(
+                    parser.parse_fasm_file(io.BytesIO(source)), expected)
+                self.assertEqual(
+                    parser.parse_fasm_file(io.StringIO(source.decode())),
+                    expected)
+                self.assertEqual(
+                    list(parser.iter_parse_fasm_file(io.BytesIO(source))),
+                    expected)
+
+    def test_parse_fasm_filenames(self):
+        filenames = [
+            example(fname)
+            for fname in ('many.fasm', 'blank.fasm', 'feature_only.fasm')
+        ]
+        for name, parser in parsers.items():
+            with self.subTest(name, parser=name):
+                expected = [
+                    list(parser.parse_fasm_filename(filename))
+                    for filename in filenames
+                ]
+                results = list(
+                    fasm.parser.parse_fasm_filenames(
+                        filenames, workers=2, backend=name))
+                self.assertEqual(
+                    [result.filename for result in results], filenames)
+                self.assertEqual(
+                    [result.lines for result in results], expected)
+                for result in results:
+                    self.assertGreaterEqual(result.seconds, 0)
+
+                results = fasm.parser.parse_fasm_filenames(
+                    filenames, workers=2, backend=name, ordered=False)
+                self.assertEqual(
+                    sorted(result.filename for result in results),
+                    sorted(filenames))
+
+                with self.assertRaises(Exception):
+                    list(
+                        fasm.parser.parse_fasm_filenames(
+                            filenames + [example('missing.fasm')],
+                            backend=name))
+
+    def test_parse_fasm_filenames_error(self):
+        import fasm.parser.batch
+        parse_timed = fasm.parser.batch.parse_timed
+        filenames = [example('many.fasm'), example('missing.fasm')]
+        filenames += [example('feature_only.fasm')] * 10
+        release = threading.Event()
+        done = threading.Event()
+        parsed = []
+        finished = []
+
+        def slow_parse_timed(backend, filename, kwargs):
+            parsed.append(filename)
+            if filename == filenames[0]:
+                # Still being parsed when the second file fails.
+                release.wait(10)
+            try:
+                return parse_timed(backend, filename, kwargs)
+            finally:
+                finished.append(filename)
+                if filename == filenames[0]:
+                    done.set()
+
+        for name in parsers:
+            with self.subTest(name, parser=name):
+                release.clear()
+                done.clear()
+                parsed.clear()
+                finished.clear()
+                with mock.patch.object(fasm.parser.batch, 'parse_timed',
+                                       slow_parse_timed), \
+                        mock.patch.object(fasm.parser.batch,
+                                          'ProcessPoolExecutor',
+                                          ThreadPoolExecutor):
+                    with self.assertRaises(FileNotFoundError):
+                        list(
+                            fasm.parser.parse_fasm_filenames(
+                                filenames, workers=2, backend=name))
+                    # Raised without waiting for the first file.
+                    self.assertEqual(finished, [filenames[1]])
+                    release.set()
+                    self.assertTrue(done.wait(10))
+
+                # The files after the failed one were cancelled.
+                self.assertEqual(sorted(parsed), sorted(filenames[:2]))
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_small_batches(self):
+        parser = parsers['antlr']
+        expected = parser.parse_fasm_filename(example('many.fasm'))
+        self.assertEqual(
+            parser.parse_fasm_filename(example('many.fasm'), batch_size=1),
+            expected)
+        self.assertEqual(
+            list(
+                parser.iter_parse_fasm_filename(
+                    example('many.fasm'), batch_size=1)), expected)
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_workers(self):
+        parser = parsers['antlr']
+        expected = parser.parse_fasm_filename(example('many.fasm'))
+        for workers in (0, 1, 4):
+            with self.subTest(workers=workers):
+                self.assertEqual(
+                    parser.parse_fasm_filename(
+                        example('many.fasm'), workers=workers), expected)
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_decode_error(self):
+        parser = parsers['antlr']
+        # The invalid line follows enough lines to fill several batches.
+        with open(example('many.fasm')) as f:
+            valid = f.read() * 10
+        source = valid + "A[3:0] = 8'hFF\n"
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'invalid.fasm')
+            with open(filename, 'w') as f:
+                f.write(source)
+
+            with self.assertRaises(AssertionError):
+                parser.parse_fasm_string(source)
+            for batch_size in (0, 1):
+                with self.subTest(batch_size=batch_size):
+                    with self.assertRaises(AssertionError):
+                        parser.parse_fasm_filename(
+                            filename, batch_size=batch_size)
+            for workers in (0, 2):
+                with self.subTest(workers=workers):
+                    with self.assertRaises(AssertionError):
+                        parser.parse_fasm_filename(filename, workers=workers)
+            for compressed in (False, True):
+                with self.subTest(compressed=compressed):
+                    data = source.encode()
+                    if compressed:
+                        data = gzip.compress(data)
+                    with self.assertRaises(AssertionError):
+                        parser.parse_fasm_file(io.BytesIO(data))
+
+            # The lines before the invalid one are yielded first.
+            expected = parser.parse_fasm_string(valid)
+            for batch_size in (0, 1):
+                with self.subTest(batch_size=batch_size, iterate=True):
+                    lines = []
+                    with self.assertRaises(AssertionError):
+                        for line in parser.iter_parse_fasm_filename(
+                                filename, batch_size=batch_size):
+                            lines.append(line)
+                    self.assertEqual(lines, expected[:len(lines)])
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_decode_buffer(self):
+        from fasm.parser import antlr_to_tuple
+        parser = parsers['antlr']
+        data = [None]
+
+        @parser.RESULT_CALLBACK
+        def callback(s, n):
+            data[0] = s[:n]
+
+        @parser.ERROR_CALLBACK
+        def error_callback(line, position, message):
+            pass
+
+        with open(example('many.fasm'), 'rb') as f:
+            parser.parse_fasm.from_string(
+                f.read(), 0, callback, error_callback)
+
+        expected = antlr_to_tuple.parse_fasm_data(data[0])
+        self.assertEqual(
+            expected, parser.parse_fasm_filename(example('many.fasm')))
+        for buffer in (bytearray(data[0]), memoryview(data[0])):
+            with self.subTest(type=type(buffer).__name__):
+                self.assertEqual(
+                    antlr_to_tuple.parse_fasm_data(buffer), expected)
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_interned_names(self):
+        parser = parsers['antlr']
+        lines = parser.parse_fasm_string('A.B[0]\nA.B[1] { c = "" }\n')
+        self.assertIs(
+            lines[0].set_feature.feature, lines[1].set_feature.feature)
+
+        # Batches of the same file share names.
+        names = {}
+        for line in parser.parse_fasm_filename(example('many.fasm'),
+                                               batch_size=1):
+            if line.set_feature:
+                feature = line.set_feature.feature
+                self.assertIs(names.setdefault(feature, feature), feature)
+
+    @unittest.skipUnless('antlr' in parsers, 'antlr parser is not available')
+    def test_threads(self):
+        parser = parsers['antlr']
+        expected = parser.parse_fasm_filename(example('many.fasm'))
+        source = fasm.fasm_tuple_to_string(expected)
+        expected_string = parser.parse_fasm_string(source)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            files = [
+                executor.submit(
+                    parser.parse_fasm_filename, example('many.fasm'))
+                for _ in range(16)
+            ]
+            strings = [
+                executor.submit(parser.parse_fasm_string, source)
+                for _ in range(16)
+            ]
+            for future in files:
+                self.assertEqual(future.result(), expected)
+            for future in strings:
+                self.assertEqual(future.result(), expected_string)
+
     def test_implementations(self):
         self.assertTrue('antlr' in fasm.parser.available)
         self.assertTrue('textx' in fasm.parser.available)